@@ -0,0 +1,206 @@
+import sqlite3
+import threading
+import contextlib
+import hashlib
+import json
+import re
+import time
+from collections import Counter, OrderedDict
+
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses: an in-memory LRU of the `memory_size` most recently used entries in front of a
+    SQLite store that survives restarts.
+
+    Entries expire `ttl` seconds after they were stored. The disk store is trimmed to `max_disk_entries`, dropping
+    the least recently used entries first. Keys come from make_key, so a response is only reused for the same
+    model, the same prompt and the same data.
+    """
+
+    def __init__(self, path, memory_size=256, ttl=86400, max_disk_entries=5000):
+        self.path = path
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # key -> (response, stored at), least recently used first
+        self.counters = Counter()
+        self.init_db()
+
+    @contextlib.contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def init_db(self):
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY, response TEXT, stored_at REAL, last_used REAL
+                );
+                CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+            """)
+
+    @staticmethod
+    def normalize_prompt(prompt):
+        return " ".join(prompt.lower().split())
+
+    @staticmethod
+    def fingerprint(data):
+        """Hashes any JSON-serializable data, independent of dictionary key order."""
+        serialized = json.dumps(data, sort_keys=True, default=str, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    @classmethod
+    def make_key(cls, model, prompt, data):
+        return cls.fingerprint([model, cls.normalize_prompt(prompt), cls.fingerprint(data)])
+
+    def get(self, key):
+        """Returns the cached response for `key`, or None if there isn't a live one."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                response, stored_at = entry
+                if now - stored_at < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return response
+                del self.memory[key]
+                self.counters["expired"] += 1
+
+        with self.connect() as conn:
+            row = conn.execute("SELECT response, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] >= self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.count("expired")
+                row = None
+            elif row is not None:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+
+        if row is None:
+            self.count("misses")
+            return None
+        self.count("disk_hits")
+        self.remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        self.remember(key, response, now)
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses (key, response, stored_at, last_used) VALUES (?, ?, ?, ?)",
+                         (key, response, now, now))
+            expired = conn.execute("DELETE FROM responses WHERE stored_at <= ?", (now - self.ttl,)).rowcount
+            excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+            if excess > 0:
+                conn.execute("DELETE FROM responses WHERE key IN "
+                             "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,))
+        self.count("expired", expired)
+        self.count("disk_evictions", max(excess, 0))
+
+    def remember(self, key, response, stored_at):
+        with self.lock:
+            self.memory[key] = (response, stored_at)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_size:
+                self.memory.popitem(last=False)
+                self.counters["memory_evictions"] += 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        """Returns the hit, miss, eviction and expiry counts, and the overall hit rate."""
+        stats = {name: self.counters[name] for name in
+                 ("memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions", "expired")}
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+class QueryResultCache:
+    """
+    In-memory LRU cache of SQL query results, keyed by the canonical form of the SQL (see canonicalize_sql) and its
+    parameters, so the same search written with different spacing or keyword case is only run once.
+
+    Entries expire `ttl` seconds after they were stored. The cache holds at most `max_entries` results and roughly
+    `max_bytes` of serialized rows, evicting the least recently used first. A result larger than `max_bytes` is
+    not cached at all.
+    """
+
+    # Single-quoted string literals, whose contents (including '' escapes) must be left exactly as written
+    LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*')")
+
+    def __init__(self, ttl=300, max_entries=128, max_bytes=20_000_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (rows, size, stored at), least recently used first
+        self.bytes = 0
+        self.counters = Counter()
+
+    @classmethod
+    def canonicalize_sql(cls, sql):
+        """Collapses whitespace and uppercases everything outside string literals, and drops a trailing ';'."""
+        parts = cls.LITERAL_PATTERN.split(sql.strip().rstrip(";").strip())
+        # split() with a capturing group puts the literals at the odd indexes
+        return "".join(part if index % 2 else re.sub(r"\s+", " ", part).upper() for index, part in enumerate(parts))
+
+    @classmethod
+    def make_key(cls, sql, params=None):
+        return ResponseCache.fingerprint([cls.canonicalize_sql(sql), list(params or ())])
+
+    def get(self, key):
+        """Returns the cached rows for `key`, or None if there isn't a live entry."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            rows, size, stored_at = entry
+            if time.time() - stored_at >= self.ttl:
+                self.discard(key)
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return rows
+
+    def put(self, key, rows):
+        size = len(json.dumps(rows, default=str, separators=(",", ":")))
+        with self.lock:
+            self.discard(key)
+            if size > self.max_bytes:
+                self.counters["too_large"] += 1
+                return
+            self.entries[key] = (rows, size, time.time())
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.discard(oldest)
+                self.counters["evictions"] += 1
+
+    def discard(self, key):
+        """Removes `key` if present. Must be called with the lock held."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def stats(self):
+        """Returns the hit, miss, eviction and expiry counts, the overall hit rate and the cache's current size."""
+        stats = {name: self.counters[name] for name in ("hits", "misses", "evictions", "expired", "too_large")}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        with self.lock:
+            stats["entries"] = len(self.entries)
+            stats["bytes"] = self.bytes
+        return stats
@@ -0,0 +1,129 @@
+import threading
+from collections import deque, namedtuple
+
+# One message as kept in memory: the role, the text (shortened if long) and the ticket numbers it mentioned
+MessageRecord = namedtuple("MessageRecord", ["role", "content", "tickets"])
+
+
+class ConversationMemory:
+    """
+    Bounded conversation history: the latest `max_messages` messages in a ring buffer, and everything older folded
+    into a rolling summary, so a long session holds constant memory and produces a prompt of constant size. Every
+    message is always in the prompt in some form: verbatim while in the buffer, shortened while waiting to be
+    summarized, then as part of the summary.
+
+    Messages longer than `record_chars` (such as ticket dumps) are shortened when stored, but the ticket numbers
+    they mention are kept, and the `max_tickets` most recently mentioned ones are always listed in the history.
+
+    Messages pushed out of the buffer are summarized `fold_batch` at a time by `summarize(summary, records)`,
+    which returns the new summary. With an `executor` the summary is updated in the background and the previous
+    one is used meanwhile; if it falls so far behind that `fold_batch` * 4 messages are waiting, the ones after
+    the batch in progress are dropped (their tickets stay listed). Without `summarize`, or when it fails, messages
+    are added to the summary as shortened lines instead. The summary is trimmed to `summary_chars`.
+    """
+
+    def __init__(self, max_messages=6, record_chars=500, summary_chars=1500, fold_batch=6, max_tickets=10,
+                 summarize=None, executor=None, ticket_pattern=None, normalize_ticket=str):
+        self.records = deque(maxlen=max_messages)
+        self.record_chars = record_chars
+        self.summary_chars = summary_chars
+        self.fold_batch = fold_batch
+        self.max_tickets = max_tickets
+        self.summarize = summarize
+        self.executor = executor
+        self.ticket_pattern = ticket_pattern
+        self.normalize_ticket = normalize_ticket
+        self.lock = threading.Lock()
+        self.summary = ""
+        self.pending = []  # Records pushed out of the buffer and not yet in the summary
+        self.folding = False
+        self.tickets = []  # Most recently mentioned last
+
+    def add(self, role, content):
+        content = " ".join(str(content).split())
+        tickets = ()
+        if self.ticket_pattern is not None:
+            tickets = tuple(dict.fromkeys(self.normalize_ticket(match.group())
+                                          for match in self.ticket_pattern.finditer(content)))
+        if len(content) > self.record_chars:
+            content = content[:self.record_chars] + "..."
+
+        with self.lock:
+            if len(self.records) == self.records.maxlen:
+                self.pending.append(self.records[0])
+            self.records.append(MessageRecord(role, content, tickets))
+            for ticket in tickets:
+                if ticket in self.tickets:
+                    self.tickets.remove(ticket)
+                self.tickets.append(ticket)
+            del self.tickets[:-self.max_tickets]
+
+            if len(self.pending) < self.fold_batch or self.folding:
+                if len(self.pending) >= self.fold_batch * 4:
+                    del self.pending[self.fold_batch:self.fold_batch * 2]
+                return
+            batch = self.pending[:self.fold_batch]
+            self.folding = True
+
+        if self.executor is not None:
+            self.executor.submit(self.fold, batch)
+        else:
+            self.fold(batch)
+
+    def fold(self, batch):
+        """Folds `batch`, the oldest pending records, into the summary, then any further full batches waiting."""
+        while batch:
+            summary = None
+            if self.summarize is not None:
+                try:
+                    summary = self.summarize(self.summary, batch)
+                except Exception as e:
+                    print(f"Error summarizing conversation history: {e}")
+            with self.lock:
+                if summary:
+                    self.set_summary(summary)
+                    del self.pending[:len(batch)]
+                else:
+                    self.fold_locally(batch)
+                batch = self.pending[:self.fold_batch] if len(self.pending) >= self.fold_batch else None
+                self.folding = batch is not None
+
+    @staticmethod
+    def shorten(record):
+        return f"{record.role}: {record.content[:150]}"
+
+    def fold_locally(self, batch):
+        """Appends shortened copies of `batch` to the summary. Must be called with the lock held."""
+        lines = [self.shorten(record) for record in batch]
+        self.set_summary("\n".join(filter(None, [self.summary] + lines)))
+        del self.pending[:len(batch)]
+
+    def set_summary(self, summary):
+        """Keeps the end of `summary`, cut at a line break where possible. Must be called with the lock held."""
+        if len(summary) > self.summary_chars:
+            summary = summary[-self.summary_chars:]
+            if "\n" in summary:
+                summary = summary[summary.index("\n") + 1:]
+        self.summary = summary
+
+    def recent_history(self):
+        """
+        Returns the history as text for a prompt: the summary of earlier messages, the tickets discussed, shortened
+        copies of the messages waiting to be summarized and the messages in the buffer.
+        """
+        with self.lock:
+            records = list(self.records)
+            pending = list(self.pending)
+            summary = self.summary
+            tickets = list(self.tickets)
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation: {summary}\n")
+        if tickets:
+            parts.append(f"Tickets discussed (most recent last): {', '.join(tickets)}\n")
+        parts.extend(f"{self.shorten(record)}\n" for record in pending)
+        parts.extend(f"{record.role}: {record.content}\n" for record in records)
+        return "".join(parts)
+
+    def __len__(self):
+        return len(self.records)
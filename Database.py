@@ -0,0 +1,309 @@
+import os
+import time
+import datetime
+import threading
+import contextlib
+import logging
+import pymssql
+
+logger = logging.getLogger(__name__)
+
+# Limits for queries run through BoundedQuery, applied whatever the SQL text asks for
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", 100))
+SQL_MAX_BYTES = int(os.getenv("SQL_MAX_BYTES", 1_000_000))
+SQL_FETCH_BATCH_SIZE = int(os.getenv("SQL_FETCH_BATCH_SIZE", 50))
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of pymssql connections to one server and database.
+
+    At most `max_size` connections are open at once (idle plus checked out); callers block for up to
+    `checkout_timeout` seconds when all of them are in use. Connections idle for longer than `idle_timeout` are
+    closed, and a connection that has been idle longer than `health_check_interval` is tested with a trivial
+    query before it is handed out.
+    """
+
+    def __init__(self, connect_kwargs, max_size=8, idle_timeout=300, health_check_interval=30, checkout_timeout=30):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.idle = []  # (connection, last used) pairs, most recently used last
+        self.size = 0
+        self.condition = threading.Condition()
+
+    def open(self):
+        return pymssql.connect(**self.connect_kwargs)
+
+    @staticmethod
+    def close_quietly(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled connection: {e}")
+
+    @staticmethod
+    def is_healthy(connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def evict_idle(self):
+        """Removes connections that have sat idle too long. Must be called with the lock held."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = [connection for connection, last_used in self.idle if last_used < cutoff]
+        if expired:
+            self.idle = [(connection, last_used) for connection, last_used in self.idle if last_used >= cutoff]
+            self.size -= len(expired)
+        return expired
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self.condition:
+            while True:
+                expired = self.evict_idle()
+                if self.idle:
+                    connection, last_used = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    connection, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No SQL connection available to {self.connect_kwargs.get('host')} "
+                                       f"after {self.checkout_timeout} seconds")
+                self.condition.wait(remaining)
+
+        for expired_connection in expired:
+            self.close_quietly(expired_connection)
+
+        try:
+            if connection is not None and time.monotonic() - last_used > self.health_check_interval:
+                if not self.is_healthy(connection):
+                    self.close_quietly(connection)
+                    connection = None
+            if connection is None:
+                connection = self.open()
+        except Exception:
+            self.release_slot()
+            raise
+        return connection
+
+    def release(self, connection, discard=False):
+        if discard:
+            self.close_quietly(connection)
+            self.release_slot()
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def release_slot(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Checks out a connection. It is discarded rather than reused if the block raises."""
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+        for connection, _ in idle:
+            self.close_quietly(connection)
+
+
+# Seconds any query may wait on the server. FreeTDS keeps a single query timeout for the whole process, and every
+# pymssql.connect call sets it, so it is one setting applied to every pooled connection rather than per query.
+SQL_QUERY_TIMEOUT = int(os.getenv("SQL_QUERY_TIMEOUT", 300))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(**connect_kwargs):
+    """
+    Returns the process-wide pool for the given pymssql.connect arguments. Pools are keyed by everything except
+    the password, so every caller using the same server, database and login shares connections.
+    """
+    connect_kwargs.setdefault("autocommit", True)  # Pooled connections should never sit in an open transaction
+    connect_kwargs["timeout"] = SQL_QUERY_TIMEOUT
+    if "server" in connect_kwargs:
+        connect_kwargs["host"] = connect_kwargs.pop("server")
+    key = tuple(sorted((k, v) for k, v in connect_kwargs.items() if k != "password"))
+
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                connect_kwargs,
+                max_size=int(os.getenv("SQL_POOL_SIZE", 8)),
+                idle_timeout=float(os.getenv("SQL_POOL_IDLE_TIMEOUT", 300)),
+                health_check_interval=float(os.getenv("SQL_POOL_HEALTH_CHECK_INTERVAL", 30)),
+                checkout_timeout=float(os.getenv("SQL_POOL_CHECKOUT_TIMEOUT", 30)),
+            )
+        return _pools[key]
+
+
+def sql_connection(**connect_kwargs):
+    """
+    Context manager that checks out a pooled connection, e.g.:
+
+        with sql_connection(host="gp2018", database="SBM01", user=user, password=password) as conn:
+            ...
+    """
+    return get_pool(**connect_kwargs).connection()
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+def execute_parameterized(cursor, statement, params):
+    """
+    Executes `statement` through sp_executesql with typed parameters, so SQL Server compiles it once and reuses
+    the cached plan for every set of values. `params` is a list of (name, SQL type, value) tuples, referenced as
+    @name in the statement. The statement must not contain '%', which pymssql reserves for its own placeholders.
+    """
+    if not params:
+        return cursor.execute(statement)
+    escaped_statement = statement.replace("'", "''")
+    declarations = ", ".join(f"@{name} {sql_type}" for name, sql_type, _ in params)
+    assignments = ", ".join(f"@{name} = %({name})s" for name, _, _ in params)
+    return cursor.execute(f"EXEC sp_executesql N'{escaped_statement}', N'{declarations}', {assignments}",
+                          {name: value for name, _, value in params})
+
+
+def in_list_params(name, sql_type, values):
+    """
+    Builds the parameters for an IN (...) filter, returning ("@name0, @name1, ...", params) for
+    execute_parameterized. The list is padded to a power of two by repeating the last value, so SQL Server caches
+    a handful of plans rather than one for every list length.
+    """
+    values = list(values)
+    size = 1
+    while size < len(values):
+        size *= 2
+    values += values[-1:] * (size - len(values))
+    params = [(f"{name}{index}", sql_type, value) for index, value in enumerate(values)]
+    return ", ".join(f"@{param_name}" for param_name, _, _ in params), params
+
+
+def row_size(row):
+    """Roughly how many bytes a result row holds: the length of each text value, eight bytes for anything else."""
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row.values())
+
+
+def format_date(value):
+    return value.strftime('%Y-%m-%d')
+
+
+def format_datetime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class BoundedQuery:
+    """
+    Runs one query and yields its rows as dicts, fetching `batch_size` rows at a time, so memory use depends on the
+    caps rather than on how many rows the query matches.
+
+    At most `max_rows` rows are returned: the server is told to stop after one more than that with SET ROWCOUNT,
+    which also covers queries without a TOP clause. Fetching stops early once the rows returned reach `max_bytes`
+    (see row_size). When either cap cuts the results short, `truncated` says which. The connection's query timeout
+    (SQL_QUERY_TIMEOUT) applies as to any other query. Date and datetime columns are converted to strings, with the format picked once per column.
+
+        with sql_connection(...) as conn:
+            query = BoundedQuery(conn, "SELECT ... WHERE x = %s", ("value",))
+            rows = list(query)
+    """
+
+    def __init__(self, connection, statement, params=None, max_rows=SQL_MAX_ROWS, max_bytes=SQL_MAX_BYTES,
+                 batch_size=SQL_FETCH_BATCH_SIZE):
+        self.connection = connection
+        self.statement = statement
+        self.params = params
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = None  # "rows" or "bytes" when a cap cut the results short
+
+    def __iter__(self):
+        cursor = self.connection.cursor(as_dict=True)
+        finished = False
+        try:
+            cursor.execute(f"SET ROWCOUNT {int(self.max_rows) + 1}")
+            if self.params:
+                cursor.execute(self.statement, self.params)
+            else:
+                cursor.execute(self.statement)
+
+            converters = None
+            while True:
+                batch = cursor.fetchmany(self.batch_size)
+                if not batch:
+                    finished = True
+                    return
+                if converters is None:
+                    converters = {column[0]: None for column in cursor.description or []
+                                  if column[1] == pymssql.DATETIME}
+                self.resolve_converters(converters, batch)
+
+                for row in batch:
+                    if self.rows >= self.max_rows:
+                        self.truncated = "rows"
+                        return
+                    for column, convert in converters.items():
+                        if convert is not None and row.get(column) is not None:
+                            row[column] = convert(row[column])
+                    self.rows += 1
+                    self.bytes += row_size(row)
+                    yield row
+                    if self.bytes >= self.max_bytes:
+                        self.truncated = "bytes"
+                        return
+        finally:
+            if not finished:
+                # Discard whatever the server has left to send, so the connection can be reused
+                try:
+                    self.connection._conn.cancel()
+                except Exception as e:
+                    logger.debug(f"Error cancelling query: {e}")
+            try:
+                cursor.execute("SET ROWCOUNT 0")
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def resolve_converters(converters, batch):
+        """Picks the formatter for each date column from its first non-null value (DATETIME covers both types)."""
+        for column, convert in converters.items():
+            if convert is not None:
+                continue
+            for row in batch:
+                value = row.get(column)
+                if isinstance(value, datetime.datetime):
+                    converters[column] = format_datetime
+                    break
+                if isinstance(value, datetime.date):
+                    converters[column] = format_date
+                    break
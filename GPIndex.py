@@ -0,0 +1,260 @@
+import sqlite3
+import threading
+import contextlib
+import datetime
+import json
+import time
+
+# Base query columns copied into indexed SQLite columns, by search slot
+SLOT_COLUMNS = {
+    "serial": "Serial Number",
+    "account": "Account Number",
+    "item": "Item Number",
+    "customer": "Customer Name",
+    "tracking": "Tracking_Number",
+}
+
+# GP tables whose DEX_ROW_TS (last modified, UTC) marks a ticket as changed
+CHANGE_TABLES = ["sop10100", "sop30200", "sop10200", "sop30300", "sop10201", "sop10107"]
+TICKET_EXPRESSION = "COALESCE(sop10100.SOPNUMBE, sop30300.SOPNUMBE)"
+
+
+def account_key(value):
+    """Account numbers are stored with or without a leading zero, so they are compared without it."""
+    return str(value).strip().lstrip("0")
+
+
+def format_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, str):
+        return value.strip()  # GP pads char columns with spaces
+    return value
+
+
+class GPIndex:
+    """
+    Local SQLite copy of the rows base_gp_query returns, indexed by serial, account, item, customer and tracking
+    number, so plain "what ticket is X on" searches are answered without querying GP.
+
+    A full sync streams every row into a new table and swaps it in. Incremental syncs re-fetch only the tickets
+    whose GP rows have a DEX_ROW_TS after the last sync. Deletions are only picked up by a full sync, which runs
+    every `full_sync_interval` seconds. Syncs run in a background thread, so searches never wait for one; until
+    the first full sync has finished, search returns None and callers should query GP instead.
+    """
+
+    # Rows modified while a sync is in flight can be missed if we use the exact start time, so overlap a bit.
+    SYNC_OVERLAP_SECONDS = 60
+    FETCH_BATCH_SIZE = 1000
+
+    def __init__(self, path, connect, base_query, sync_interval=300, full_sync_interval=86400):
+        self.path = path
+        self.connect_gp = connect  # Callable returning a context manager that yields a pymssql connection
+        self.base_query = base_query
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.sync_lock = threading.Lock()
+        self.sync_thread = None
+
+        self.init_db()
+        with self.connect() as conn:
+            self.last_sync = float(self.get_meta(conn, "last_sync", 0))
+            self.last_full_sync = float(self.get_meta(conn, "last_full_sync", 0))
+            self.gp_watermark = self.get_meta(conn, "gp_watermark")
+
+    @contextlib.contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def init_db(self):
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # Searches keep reading while a sync writes
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.create_lines_table(conn, "lines")
+            self.create_lines_indexes(conn)
+
+    @staticmethod
+    def create_lines_table(conn, table):
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                ticket TEXT, serial TEXT, account TEXT, item TEXT, customer TEXT, tracking TEXT, queue TEXT, row TEXT
+            );
+        """)
+
+    @staticmethod
+    def create_lines_indexes(conn):
+        # Run statement by statement rather than with executescript, which would commit the caller's transaction
+        for statement in [
+            "CREATE INDEX IF NOT EXISTS lines_ticket ON lines (ticket)",
+            "CREATE INDEX IF NOT EXISTS lines_serial ON lines (serial COLLATE NOCASE)",
+            "CREATE INDEX IF NOT EXISTS lines_account ON lines (account)",
+            "CREATE INDEX IF NOT EXISTS lines_item ON lines (item COLLATE NOCASE)",
+            "CREATE INDEX IF NOT EXISTS lines_tracking ON lines (tracking COLLATE NOCASE)",
+        ]:
+            conn.execute(statement)
+
+    @staticmethod
+    def get_meta(conn, key, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @staticmethod
+    def set_meta(conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def ready(self):
+        return bool(self.last_full_sync)
+
+    def ensure_fresh(self):
+        """Starts a background sync if one is due and none is running, doing a full reload when one is due."""
+        now = time.time()
+        full = now - self.last_full_sync >= self.full_sync_interval
+        if not full and now - self.last_sync < self.sync_interval:
+            return
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            return
+        self.sync_thread = threading.Thread(target=self.sync, kwargs={"full": full}, daemon=True)
+        self.sync_thread.start()
+
+    def sync(self, full=False):
+        """
+        Pulls changes from GP into the index. Returns False if GP could not be queried, in which case the existing
+        index is left untouched.
+        """
+        with self.sync_lock:
+            full = full or not self.last_full_sync or not self.gp_watermark
+            started = time.time()
+            try:
+                with self.connect_gp() as gp_conn:
+                    cursor = gp_conn.cursor(as_dict=True)
+                    # DEX_ROW_TS is in GP's clock, so the next incremental sync starts from GP's time, not ours
+                    cursor.execute("SELECT CONVERT(VARCHAR(23), GETUTCDATE(), 121) AS now")
+                    watermark = cursor.fetchone()["now"]
+                    if full:
+                        count = self.full_sync(cursor)
+                    else:
+                        count = self.incremental_sync(cursor)
+            except Exception as e:
+                print(f"GP index sync failed, using the existing index: {e}")
+                return False
+
+            with self.connect() as conn:
+                self.set_meta(conn, "last_sync", started)
+                self.set_meta(conn, "gp_watermark", watermark)
+                if full:
+                    self.set_meta(conn, "last_full_sync", started)
+            self.last_sync = started
+            self.gp_watermark = watermark
+            if full:
+                self.last_full_sync = started
+            print(f"GP index {'full' if full else 'incremental'} sync stored {count} rows "
+                  f"in {time.time() - started:.1f} seconds.")
+            return True
+
+    def full_sync(self, cursor):
+        """Streams every base query row into a new table, then swaps it in for the old one."""
+        cursor.execute(self.base_query)
+        with self.connect() as conn:
+            conn.execute("DROP TABLE IF EXISTS lines_new")
+            self.create_lines_table(conn, "lines_new")
+            count = self.store_rows(conn, cursor, "lines_new")
+            conn.commit()
+            # One transaction, so searches see either the old table or the new one with its indexes
+            conn.execute("BEGIN")
+            conn.execute("DROP TABLE lines")
+            conn.execute("ALTER TABLE lines_new RENAME TO lines")
+            self.create_lines_indexes(conn)
+        return count
+
+    def incremental_sync(self, cursor):
+        """Replaces the rows of every ticket changed since the last sync's watermark (minus an overlap)."""
+        since = (datetime.datetime.strptime(self.gp_watermark, '%Y-%m-%d %H:%M:%S.%f')
+                 - datetime.timedelta(seconds=self.SYNC_OVERLAP_SECONDS))
+        changed_query = " UNION ".join(f"SELECT SOPNUMBE FROM {table} WHERE DEX_ROW_TS > %(since)s"
+                                       for table in CHANGE_TABLES)
+        cursor.execute(changed_query, {"since": since})
+        changed = [row["SOPNUMBE"].strip() for row in cursor.fetchall()]
+        if not changed:
+            return 0
+
+        cursor.execute(f"{self.base_query.strip()}\nAND {TICKET_EXPRESSION} IN ({changed_query})", {"since": since})
+        with self.connect() as conn:
+            # Tickets that no longer match the base query at all (e.g. deleted) simply lose their rows
+            for start in range(0, len(changed), 500):
+                batch = changed[start:start + 500]
+                conn.execute(f"DELETE FROM lines WHERE ticket IN ({', '.join('?' * len(batch))})", batch)
+            return self.store_rows(conn, cursor, "lines")
+
+    def store_rows(self, conn, cursor, table):
+        count = 0
+        while True:
+            batch = cursor.fetchmany(self.FETCH_BATCH_SIZE)
+            if not batch:
+                return count
+            records = []
+            for row in batch:
+                row = {key: format_value(value) for key, value in row.items()}
+                records.append((
+                    row.get("Equipment Ticket"),
+                    row.get(SLOT_COLUMNS["serial"]),
+                    account_key(row.get(SLOT_COLUMNS["account"]) or ""),
+                    row.get(SLOT_COLUMNS["item"]),
+                    row.get(SLOT_COLUMNS["customer"]),
+                    row.get(SLOT_COLUMNS["tracking"]),
+                    row.get("Queue"),
+                    json.dumps(row, default=str),
+                ))
+            conn.executemany(f"INSERT INTO {table} (ticket, serial, account, item, customer, tracking, queue, row) "
+                             f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+            count += len(records)
+
+    def search(self, slots, status=None, limit=100):
+        """
+        Returns the rows matching every slot ({slot: value}, as from QueryTemplates.parse_search), in the same
+        shape as base_gp_query's, or None if the index hasn't finished its first full sync. `status` is "open",
+        "closed" or None for all tickets.
+        """
+        self.ensure_fresh()
+        if not self.ready:
+            return None
+
+        filters, params = [], []
+        for slot, value in slots.items():
+            value = str(value).strip()
+            if slot == "account":
+                filters.append("account = ?")
+                params.append(account_key(value))
+            elif slot == "customer":
+                filters.append("customer LIKE ?")
+                params.append(f"%{value}%")
+            else:
+                filters.append(f"{slot} = ? COLLATE NOCASE")
+                params.append(value)
+        if status == "open":
+            filters.append("queue != 'RDY TO INVOICE'")
+        elif status == "closed":
+            filters.append("queue = 'RDY TO INVOICE'")
+
+        with self.connect() as conn:
+            rows = conn.execute(f"SELECT row FROM lines WHERE {' AND '.join(filters)} ORDER BY rowid LIMIT ?",
+                                params + [limit]).fetchall()
+        return [json.loads(row) for row, in rows]
+
+
+if __name__ == "__main__":
+    # Builds or refreshes the index outside the bot, e.g. from a nightly scheduled task
+    import argparse
+    from bot import get_gp_index
+
+    parser = argparse.ArgumentParser(description="Sync the local GP index used for plain database searches.")
+    parser.add_argument("--incremental", action="store_true", help="only fetch tickets changed since the last sync")
+    args = parser.parse_args()
+    raise SystemExit(0 if get_gp_index().sync(full=not args.incremental) else 1)
@@ -0,0 +1,76 @@
+import os
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+
+
+class PooledSession(requests.Session):
+    """
+    Session for a single host that keeps up to HTTP_POOL_SIZE connections alive and applies a default timeout to
+    every request that doesn't set its own.
+
+    Idempotent requests (GET, HEAD, OPTIONS) that fail to connect or get a 502/504 are retried with backoff. Other
+    methods are never retried automatically. Throttling (429/503 with Retry-After) is left to the caller, which
+    knows how long it is willing to wait; TeamsSearch handles it for Graph.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                 retries=HTTP_RETRIES):
+        super().__init__()
+        self.default_timeout = timeout
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(502, 504),
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    Returns the process-wide session for the host in `url`, so every call to that host reuses the same
+    keep-alive connections.
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = PooledSession()
+        return _sessions[key]
+
+
+def http_get(url, **kwargs):
+    return get_session(url).get(url, **kwargs)
+
+
+def http_post(url, **kwargs):
+    return get_session(url).post(url, **kwargs)
+
+
+def close_all_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -1,8 +1,9 @@
 import time
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from msal import ConfidentialClientApplication
-from threading import Event
+from threading import Event, Lock, Timer
 from urllib.parse import urlparse, parse_qs
 import os
 import dotenv
@@ -10,6 +11,8 @@ import requests
 import json
 from threading import Thread
 import re
+from HttpClient import get_session
+from Tracing import traced, submit
 
 dotenv.load_dotenv()
 
@@ -28,10 +31,18 @@ class Authenticate:
             self.client_id,
             authority=f"https://login.microsoftonline.com/{self.tenant_id}",
             client_credential=self.client_secret,
+            http_client=get_session("https://login.microsoftonline.com"),
         )
 
-        self.session = requests.Session()
         self.auth_completed_event = Event()
+        self.interactive_token_response = None  # Set by RedirectHandler when an interactive sign-in completes
+
+        # The current token is held in memory so requests don't touch token.json or the network; it is refreshed
+        # in the background shortly before it expires.
+        self.token_response = None
+        self.token_lock = Lock()
+        self.refresh_timer = None
+        self.refresh_margin = int(os.getenv('MS_TOKEN_REFRESH_MARGIN', 300))
 
     def start_http_server(self, port=8888):
         server_address = ("127.0.0.1", port)
@@ -39,24 +50,66 @@ class Authenticate:
         httpd.handle_request()
 
     def authenticate(self):
-        token_response = self.load_token_from_file()
+        # Fast path: the token held in memory is still good
+        token_response = self.token_response
+        if token_response and not self.is_token_expired(token_response):
+            return token_response
 
-        if token_response and 'access_token' in token_response:
-            if not self.is_token_expired(token_response) and self.test_token_validity(token_response):
-                return token_response
-            elif 'refresh_token' in token_response:
-                silent_response = self.acquire_token_by_refresh_token(token_response['refresh_token'])
-                if silent_response:
-                    return silent_response
+        with self.token_lock:
+            token_response = self.token_response or self.load_token_from_file()
+
+            if token_response and 'access_token' in token_response:
+                if not self.is_token_expired(token_response):
+                    self.set_token(token_response, save=False)
+                    return token_response
+                elif 'refresh_token' in token_response:
+                    silent_response = self.acquire_token_by_refresh_token(token_response['refresh_token'])
+                    if silent_response:
+                        return silent_response
+
+            # print("Attempting interactive token acquisition.")
+            return self.acquire_new_token()
 
-        # print("Attempting interactive token acquisition.")
-        return self.acquire_new_token()
+    def get_headers(self):
+        token = self.authenticate()
+        if token and 'access_token' in token:
+            return {"Authorization": f"Bearer {token['access_token']}", "Content-Type": "application/json"}
+        return None
+
+    def set_token(self, token_response, save=True):
+        """Records a token with its absolute expiry and schedules a background refresh before it expires."""
+        if 'expires_on' not in token_response and 'expires_in' in token_response:
+            token_response['expires_on'] = int(time.time()) + int(token_response['expires_in'])
+        self.token_response = token_response
+        if save:
+            self.save_token_to_file(token_response)
+        self.schedule_refresh(token_response)
+
+    def schedule_refresh(self, token_response):
+        if self.refresh_timer:
+            self.refresh_timer.cancel()
+            self.refresh_timer = None
+        if 'refresh_token' not in token_response or 'expires_on' not in token_response:
+            return
+        delay = max(0, int(token_response['expires_on']) - self.refresh_margin - time.time())
+        self.refresh_timer = Timer(delay, self.refresh_in_background)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+    def refresh_in_background(self):
+        with self.token_lock:
+            token_response = self.token_response
+            # Skip if another thread already refreshed the token while this one was waiting
+            if token_response and 'refresh_token' in token_response and \
+                    self.is_token_expired(token_response, margin=self.refresh_margin):
+                # On failure the next authenticate() call falls back to the usual refresh or interactive flow
+                self.acquire_token_by_refresh_token(token_response['refresh_token'])
 
     def acquire_token_by_refresh_token(self, refresh_token):
         token_response = self.app.acquire_token_by_refresh_token(refresh_token, scopes=self.scope)
 
         if "access_token" in token_response:
-            self.save_token_to_file(token_response)
+            self.set_token(token_response)
             # print("Refresh token acquired!")
             return token_response
         else:
@@ -68,21 +121,6 @@ class Authenticate:
             os.remove(self.token_file_path)
             # print("Token file deleted.")
 
-    def test_token_validity(self, token_response):
-        # Make a test API call using the access token
-        graph_url = "https://graph.microsoft.com/v1.0/users"
-        headers = {
-            "Authorization": f"Bearer {token_response['access_token']}",
-            "Accept": "application/json"
-        }
-        params = {
-            "$filter": f"userPrincipalName eq 'mmarcotte@granitenet.com'"
-        }
-
-        response = self.session.get(graph_url, headers=headers, params=params)
-        if response.status_code == 200:
-            return True
-
     def save_token_to_file(self, token_response):
         with open(self.token_file_path, 'w') as file:
             json.dump(token_response, file)
@@ -95,28 +133,25 @@ class Authenticate:
         return None
 
     @staticmethod
-    def is_token_expired(token_response):
+    def is_token_expired(token_response, margin=60):
         try:
-            expiration_seconds = int(token_response['expires_in'])
-        except KeyError:
-            print("Error: 'expires_in' not found in token response.")
-            return False
-
-        current_timestamp = int(time.time())
-
-        if expiration_seconds <= 0:
-            return 'refresh_token' not in token_response
-
-        # Calculate the absolute expiration time ('expires_on')
-        expires_on = current_timestamp + expiration_seconds
+            # 'expires_on' is the absolute expiry recorded by set_token when the token was acquired
+            expires_on = int(token_response['expires_on'])
+        except (KeyError, TypeError, ValueError):
+            # Tokens saved before the expiry was recorded can't be dated, so refresh them
+            return True
 
-        return current_timestamp >= expires_on
+        return time.time() >= expires_on - margin
 
     def acquire_new_token(self):
         max_retries = 3  # Set a maximum number of retry attempts
         retry_delay = 5  # Set a delay between retries (in seconds)
 
         for _ in range(max_retries):
+            # Only accept a token from this attempt's redirect, never one left over from an earlier sign-in
+            self.interactive_token_response = None
+            self.auth_completed_event.clear()
+
             # Start the HTTP server on a separate thread
             server_thread = Thread(target=self.start_http_server)
             server_thread.start()
@@ -131,10 +166,11 @@ class Authenticate:
             server_thread.join()
 
             # Check if the authentication was completed and token response is available
-            if auth_completed and self.token_response:
+            token_response = self.interactive_token_response
+            if auth_completed and token_response:
                 # Save the token to the file
-                self.save_token_to_file(self.token_response)
-                return self.token_response
+                self.set_token(token_response)
+                return token_response
             else:
                 print("Error: Authentication may not have been completed. Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
@@ -172,7 +208,7 @@ class RedirectHandler(BaseHTTPRequestHandler):
                 )
 
                 if "access_token" in token_response:
-                    self.authenticate.token_response = token_response
+                    self.authenticate.interactive_token_response = token_response
                     self.authenticate.auth_completed_event.set()
                 else:
                     raise ValueError("Access token not found in token response")
@@ -183,18 +219,145 @@ class RedirectHandler(BaseHTTPRequestHandler):
         self.wfile.write(b"<script>window.close();</script>")
 
 
+class ChannelTeamIndex:
+    """
+    Maps channel IDs to the team that owns them, cached in memory and in a JSON file for `ttl` seconds.
+    A lookup that misses rebuilds the index, at most once every `min_rebuild_interval` seconds.
+    """
+
+    def __init__(self, file_path, ttl=86400, min_rebuild_interval=300):
+        self.file_path = file_path
+        self.ttl = ttl
+        self.min_rebuild_interval = min_rebuild_interval
+        self.lock = Lock()
+        self.channels = {}
+        self.built_at = 0
+        self.load_from_file()
+
+    def load_from_file(self):
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, 'r') as file:
+                    cached = json.load(file)
+                self.channels = cached.get('channels', {})
+                self.built_at = cached.get('built_at', 0)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"Ignoring unreadable channel cache: {e}")
+
+    def save_to_file(self):
+        with open(self.file_path, 'w') as file:
+            json.dump({'built_at': self.built_at, 'channels': self.channels}, file)
+
+    def rebuild(self, build):
+        channels = build()
+        if channels is None:  # Keep the old index if Graph could not be reached
+            return
+        self.channels = channels
+        self.built_at = time.time()
+        self.save_to_file()
+
+    def lookup(self, channel_id, build):
+        """Returns the team ID for a channel. `build` is called to list every channel when the index is stale."""
+        with self.lock:
+            age = time.time() - self.built_at
+            if age >= self.ttl:
+                self.rebuild(build)
+            elif channel_id not in self.channels and age >= self.min_rebuild_interval:
+                # The channel may be new, or we may have joined its team since the index was built
+                self.rebuild(build)
+            return self.channels.get(channel_id)
+
+
+channel_team_index = ChannelTeamIndex(os.getenv('TEAMS_CHANNEL_CACHE_PATH', 'channel_teams.json'),
+                                      ttl=int(os.getenv('TEAMS_CHANNEL_CACHE_TTL', 86400)))
+
+
+# Thread downloads share one small pool so that concurrent ticket lookups together stay under Graph's throttling
+# limits rather than each opening its own burst of requests.
+TEAMS_FETCH_WORKERS = int(os.getenv('TEAMS_FETCH_WORKERS', 4))
+thread_fetch_executor = ThreadPoolExecutor(max_workers=TEAMS_FETCH_WORKERS, thread_name_prefix="teams-fetch")
+
+
 class TeamsSearch:
+    MAX_THROTTLE_RETRIES = 4
+    BATCH_SIZE = 20  # Graph's limit on sub-requests per $batch call
+
     def __init__(self, authenticate):
         self.authenticate = authenticate
         self.graph_base_url = "https://graph.microsoft.com/beta"
 
+        # Every Graph call shares the process-wide keep-alive session for the Graph host
+        self.session = get_session(self.graph_base_url)
+
+    def graph_get(self, url, headers):
+        """GETs a Graph URL, waiting out 429/503 throttling responses as directed by their Retry-After header."""
+        for attempt in range(self.MAX_THROTTLE_RETRIES + 1):
+            response = self.session.get(url, headers=headers)
+            if response.status_code not in (429, 503) or attempt == self.MAX_THROTTLE_RETRIES:
+                return response
+            time.sleep(self.retry_delay(response.headers, attempt))
+
+    @staticmethod
+    def retry_delay(headers, attempt):
+        try:
+            delay = float(headers.get('Retry-After', 2 ** attempt))
+        except ValueError:
+            delay = 2 ** attempt
+        return min(delay, 60)
+
+    def batch_get(self, paths, headers):
+        """
+        GETs several Graph paths (relative to graph_base_url) through $batch calls of up to BATCH_SIZE requests,
+        run in parallel on the fetch pool. Returns the response bodies in the same order as `paths`.
+        """
+        chunks = [paths[i:i + self.BATCH_SIZE] for i in range(0, len(paths), self.BATCH_SIZE)]
+        futures = [submit(thread_fetch_executor, self.post_batch, chunk, headers) for chunk in chunks]
+        return [body for future in futures for body in future.result()]
+
+    @traced("teams.batch")
+    def post_batch(self, paths, headers):
+        """
+        Sends one $batch call and splits the responses back out by request ID. Sub-requests that were throttled
+        are sent again in a smaller batch once their Retry-After has passed.
+        """
+        results = [None] * len(paths)
+        pending = list(range(len(paths)))
+
+        for attempt in range(self.MAX_THROTTLE_RETRIES + 1):
+            payload = {"requests": [{"id": str(i), "method": "GET", "url": paths[i]} for i in pending]}
+            response = self.session.post(f"{self.graph_base_url}/$batch", headers=headers, json=payload)
+            if response.status_code in (429, 503) and attempt < self.MAX_THROTTLE_RETRIES:
+                time.sleep(self.retry_delay(response.headers, attempt))
+                continue
+            if response.status_code != 200:
+                print(f"Error sending Graph batch: {response.status_code}")
+                break
+
+            throttled, delay = [], 0
+            for item in response.json().get('responses', []):
+                i = int(item['id'])
+                if item.get('status') in (429, 503):
+                    throttled.append(i)
+                    delay = max(delay, self.retry_delay(item.get('headers') or {}, attempt))
+                else:
+                    results[i] = item.get('body') or {}
+            pending = throttled
+            if not pending or attempt == self.MAX_THROTTLE_RETRIES:
+                break
+            time.sleep(delay)
+
+        # Anything still missing is reported the way Graph reports a failed request
+        return [body if body is not None else {'error': {'message': 'Request failed or was throttled'}}
+                for body in results]
+
     def get_headers(self):
-        token = self.authenticate.authenticate()
-        if token and 'access_token' in token:
-            return {"Authorization": f"Bearer {token['access_token']}", "Content-Type": "application/json"}
+        headers = self.authenticate.get_headers()
+        if headers:
+            return headers
         print("Authentication failed.")
         return None
 
+    @traced("teams.search_messages")
     def search_teams_messages(self, search_term, size=100):
         headers = self.get_headers()
         search_payload = {
@@ -205,91 +368,112 @@ class TeamsSearch:
                 "size": size
             }]
         }
-        response = requests.post(f"{self.graph_base_url}/search/query", headers=headers, json=search_payload,
-                                 timeout=60)
+        response = self.session.post(f"{self.graph_base_url}/search/query", headers=headers, json=search_payload,
+                                     timeout=60)
         return response.json().get('value', [])[0].get('hitsContainers', [])[0].get('hits', [])
 
     def get_conversations(self, search_term):
         top_threads = self.search_teams_messages(search_term)
-        conversations = {}
+        headers = self.get_headers()
+        message_paths = {}
 
         for thread in top_threads:
             resource = thread['resource']
             message_id = resource['id']
+            if message_id in message_paths:
+                continue
             channel_id = resource.get('channelIdentity', {}).get('channelId')
             team_id = self.get_actual_team_id_for_message(channel_id) or resource.get('channelIdentity', {}).get(
                 'teamId')
 
             if team_id:
-                # Get conversation messages
-                conversation_messages = self.get_channel_message_thread(team_id, channel_id, message_id)
-                # Check if there are non-empty messages before adding to conversations
-                if conversation_messages:  # Only add if there's at least one message
-                    conversations[message_id] = conversation_messages
-                else:
-                    # print(f"No valid messages found for message ID: {message_id}")
-                    pass
+                message_paths[message_id] = f"/teams/{team_id}/channels/{channel_id}/messages/{message_id}"
             else:
                 # print(f"Could not verify team ID for message ID: {message_id}")
                 pass
 
+        # Each thread's main message and first page of replies go out together in $batch calls
+        paths = []
+        for message_path in message_paths.values():
+            paths += [message_path, f"{message_path}/replies"]
+        try:
+            responses = self.batch_get(paths, headers)
+        except requests.RequestException as e:
+            print(f"Error fetching Teams threads: {e}")
+            return {}
+
+        # Only threads with more than one page of replies need further requests
+        futures = {}
+        for index, message_id in enumerate(message_paths):
+            main_message, first_replies = responses[2 * index], responses[2 * index + 1]
+            futures[message_id] = submit(thread_fetch_executor, self.build_thread, main_message, first_replies,
+                                         headers)
+
+        # Collect in search-rank order, whatever order the threads finish in
+        conversations = {}
+        for message_id, future in futures.items():
+            try:
+                conversation_messages = future.result()
+            except requests.RequestException as e:
+                print(f"Error fetching thread for message ID {message_id}: {e}")
+                continue
+            # Check if there are non-empty messages before adding to conversations
+            if conversation_messages:  # Only add if there's at least one message
+                conversations[message_id] = conversation_messages
+
         return conversations
 
     def get_actual_team_id_for_message(self, channel_id):
+        return channel_team_index.lookup(channel_id, self.list_channel_teams)
+
+    def list_channel_teams(self):
+        """Lists every channel in the user's joined teams, returning {channel ID: team ID}."""
         headers = self.get_headers()
-        response = requests.get(f"{self.graph_base_url}/me/joinedTeams", headers=headers)
-        teams = response.json().get('value', [])
+        response = self.graph_get(f"{self.graph_base_url}/me/joinedTeams", headers)
+        if response.status_code != 200:
+            print(f"Error listing joined teams: {response.status_code}")
+            return None
 
-        for team in teams:
+        channel_teams = {}
+        for team in response.json().get('value', []):
             team_id = team['id']
-            response = requests.get(f"{self.graph_base_url}/teams/{team_id}/channels", headers=headers)
-            channels = response.json().get('value', [])
-            if any(channel['id'] == channel_id for channel in channels):
-                return team_id
-        # print("Could not find team for channel ID.")
-        return None
-
-    def get_channel_message_thread(self, team_id, channel_id, message_id):
-        headers = self.get_headers()
+            response = self.graph_get(f"{self.graph_base_url}/teams/{team_id}/channels", headers)
+            for channel in response.json().get('value', []):
+                channel_teams[channel['id']] = team_id
+        return channel_teams
+
+    def get_channel_message_thread(self, team_id, channel_id, message_id, headers=None):
+        headers = headers or self.get_headers()
+        message_url = f"{self.graph_base_url}/teams/{team_id}/channels/{channel_id}/messages/{message_id}"
         # Fetch the main message
-        main_message = self.fetch_message(
-            f"{self.graph_base_url}/teams/{team_id}/channels/{channel_id}/messages/{message_id}", headers)
-
-        messages = []
+        main_message = self.fetch_message(message_url, headers)
 
         # Check for an error in the main message response
         if 'error' in main_message:
             # print(f"Error fetching message ID {message_id}: {main_message['error']['message']}")
-            return messages  # Return an empty list for this message ID
-
-        # Debug output to inspect the main message structure
-        # print('Main message:', main_message)
-
-        # Continue processing if no error is found
-        sent_by = self.get_sender_name(main_message)
-        content = self.handle_special_messages(main_message)
-
-        messages.append({
-            'timestamp': main_message.get('createdDateTime', 'No timestamp available'),
-            'sent_by': sent_by,
-            'content': content
-        })
+            return []  # Return an empty list for this message ID
 
         # Fetch replies to the main message
-        replies = self.fetch_replies(
-            f"{self.graph_base_url}/teams/{team_id}/channels/{channel_id}/messages/{message_id}/replies", headers)
+        replies = self.fetch_replies(f"{message_url}/replies", headers)
+        return [self.format_message(message) for message in [main_message] + replies]
 
-        for reply in replies:
-            sent_by = self.get_sender_name(reply)
-            content = self.handle_special_messages(reply)
-
-            messages.append({
-                'timestamp': reply.get('createdDateTime', 'No timestamp available'),
-                'sent_by': sent_by,
-                'content': content
-            })
-
-        return messages
+    @traced("teams.thread_fetch")
+    def build_thread(self, main_message, first_replies, headers):
+        """Builds a thread from its main message and first page of replies, fetching any further reply pages."""
+        if 'error' in main_message:
+            return []
+        replies = list(first_replies.get('value', []))
+        next_link = first_replies.get('@odata.nextLink')
+        if next_link:
+            replies += self.fetch_replies(next_link, headers)
+        return [self.format_message(message) for message in [main_message] + replies]
+
+    def format_message(self, message):
+        return {
+            'timestamp': message.get('createdDateTime', 'No timestamp available'),
+            'sent_by': self.get_sender_name(message),
+            'content': self.handle_special_messages(message)
+        }
 
     def handle_special_messages(self, message):
         """Handles messages that may contain special formats like adaptive cards."""
@@ -358,12 +542,12 @@ class TeamsSearch:
         return 'Unknown Sender'
 
     def fetch_message(self, url, headers):
-        return requests.get(url, headers=headers).json()
+        return self.graph_get(url, headers).json()
 
     def fetch_replies(self, url, headers):
         replies = []
         while url:
-            response = requests.get(url, headers=headers).json()
+            response = self.graph_get(url, headers).json()
             replies += response.get('value', [])
             url = response.get('@odata.nextLink')
         return replies
@@ -0,0 +1,282 @@
+import json
+import math
+import re
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:  # Optional; token counts are estimated from the text length without it
+    tiktoken = None
+
+# Sources in order of preference: a value that appears in more than one is kept in the first and dropped from the rest
+SOURCE_PRIORITY = ["Salespad/GP", "ConnectWise", "WOM", "Cornerstone", "Smartsheet"]
+
+# Fields holding identifiers, whose values mean the same thing whichever source or field name they appear under
+IDENTIFIER_FIELD_PATTERN = re.compile(r"serial|tracking|ticket|account|order|sopnumbe|rma", re.IGNORECASE)
+
+# Ticket fields that matter least to an answer, dropped first when the context is over budget
+LOW_VALUE_FIELDS = ["Entered by", "Date entered", "Access", "Ticket Creator", "Creation Date"]
+
+MAX_MESSAGE_CHARS = 1000
+KEEP_REPLIES = 4  # When a thread is shortened, its main message and this many of the latest replies are kept
+
+# Words too common to say anything about which messages answer a question
+STOP_WORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i if in is it its me my no not of
+on or our please so that the their them there this to was we were what when where which who why will with would you
+your ticket tickets
+""".split())
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[-/][a-z0-9]+)*")
+
+_encodings = {}
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    """Counts tokens with tiktoken when it is available, otherwise estimates four characters per token."""
+    if tiktoken is not None and model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # tiktoken downloads an encoding the first time it is used, which fails without network access
+            print(f"Could not load a tokenizer, estimating token counts instead: {e}")
+            _encodings[model] = None
+
+    encoding = _encodings.get(model)
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def prune(value):
+    """Recursively drops None, empty strings and empty containers."""
+    if isinstance(value, dict):
+        pruned = {k: prune(v) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        pruned = [prune(v) for v in value]
+        return [v for v in pruned if v not in (None, "", [], {})]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def dedupe_sources(ticket_data):
+    """
+    Removes values that an earlier source in SOURCE_PRIORITY already provides, such as serial numbers listed by
+    both Salespad/GP and Smartsheet. A repeated value is dropped when it is under the same field name, or when it
+    is an identifier (see IDENTIFIER_FIELD_PATTERN) already given under another identifier field, like "Serial
+    Number" and "Serial #". Other values, such as dates and statuses, are kept under a new field name, where they
+    may mean something different. Repeats within one source are left alone.
+    """
+    seen_identifiers, seen_fields = set(), set()
+
+    def dedupe(key, value, identifiers, fields):
+        if isinstance(value, dict):
+            return {k: dedupe(k, v, identifiers, fields) for k, v in value.items()}
+        if isinstance(value, list):
+            return [v for v in (dedupe(key, v, identifiers, fields) for v in value) if v is not None]
+        normalized = str(value).strip().lower()
+        is_identifier = bool(IDENTIFIER_FIELD_PATTERN.search(str(key)))
+        if (key, normalized) in seen_fields or (is_identifier and normalized in seen_identifiers):
+            return None
+        fields.add((key, normalized))
+        if is_identifier:
+            identifiers.add(normalized)
+        return value
+
+    deduped = {}
+    for source in sorted(ticket_data, key=lambda s: SOURCE_PRIORITY.index(s) if s in SOURCE_PRIORITY
+                         else len(SOURCE_PRIORITY)):
+        identifiers, fields = set(), set()
+        deduped[source] = dedupe(source, ticket_data[source], identifiers, fields)
+        seen_identifiers |= identifiers
+        seen_fields |= fields
+    return prune({source: deduped[source] for source in ticket_data})
+
+
+def compact_conversations(chat_data):
+    """
+    Turns {message ID: [messages]} into a list of threads, each a list of "timestamp sender: text" lines, with
+    empty and repeated messages removed and long messages shortened.
+    """
+    threads, seen = [], set()
+    for messages in (chat_data or {}).values():
+        thread = []
+        for message in messages:
+            content = " ".join(str(message.get("content", "")).split())
+            if not content or content in seen:
+                continue
+            seen.add(content)
+            if len(content) > MAX_MESSAGE_CHARS:
+                content = content[:MAX_MESSAGE_CHARS] + "..."
+            timestamp = str(message.get("timestamp", ""))[:16].replace("T", " ")
+            thread.append(f"{timestamp} {message.get('sent_by', 'Unknown Sender')}: {content}")
+        if thread:
+            threads.append(thread)
+    return threads
+
+
+def tokenize(text):
+    return [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+
+
+def bm25_scores(documents, query, k1=1.5, b=0.75):
+    """Scores tokenized `documents` against a tokenized `query` with Okapi BM25. Returns an array of scores."""
+    terms = list(dict.fromkeys(query))
+    if not documents or not terms:
+        return np.zeros(len(documents))
+
+    term_index = {term: i for i, term in enumerate(terms)}
+    frequencies = np.zeros((len(documents), len(terms)))
+    for row, document in enumerate(documents):
+        for word in document:
+            column = term_index.get(word)
+            if column is not None:
+                frequencies[row, column] += 1
+
+    lengths = np.array([len(document) for document in documents], dtype=float)
+    average_length = lengths.mean() or 1.0
+    document_frequency = (frequencies > 0).sum(axis=0)
+    idf = np.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+    saturation = frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * lengths / average_length)[:, None])
+    return saturation @ idf
+
+
+def select_relevant_messages(chat_data, question, top_k=30, context=1):
+    """
+    Keeps the `top_k` messages that best match `question` (BM25 over the message text), each with `context`
+    messages either side of it and its thread's first message. Ties, including when nothing matches, go to the
+    most recent messages. Returns chat data in the same {message ID: [messages]} shape, in the original order.
+    """
+    positions = [(thread_id, index) for thread_id, messages in (chat_data or {}).items()
+                 for index in range(len(messages))]
+    if len(positions) <= top_k:
+        return chat_data
+
+    documents = [tokenize(f"{chat_data[thread_id][index].get('sent_by', '')} "
+                          f"{chat_data[thread_id][index].get('content', '')}") for thread_id, index in positions]
+    scores = bm25_scores(documents, tokenize(question))
+    timestamps = [str(chat_data[thread_id][index].get('timestamp', '')) for thread_id, index in positions]
+    ranked = sorted(range(len(positions)), key=lambda i: (scores[i], timestamps[i]), reverse=True)[:top_k]
+
+    keep = set()
+    for i in ranked:
+        thread_id, index = positions[i]
+        keep.add((thread_id, 0))
+        for neighbour in range(index - context, index + context + 1):
+            if 0 <= neighbour < len(chat_data[thread_id]):
+                keep.add((thread_id, neighbour))
+
+    selected = {}
+    for thread_id, messages in chat_data.items():
+        kept = [message for index, message in enumerate(messages) if (thread_id, index) in keep]
+        if kept:
+            selected[thread_id] = kept
+    return selected
+
+
+def shorten_thread(thread):
+    if len(thread) <= KEEP_REPLIES + 2:
+        return thread
+    omitted = len(thread) - 1 - KEEP_REPLIES
+    return [thread[0], f"({omitted} earlier replies omitted)"] + thread[-KEEP_REPLIES:]
+
+
+def build_context(ticket_data, chat_data=None, budget=12000, model="gpt-4o-mini"):
+    """
+    Serializes ticket and Teams chat data once, compactly, for a prompt and trims it to fit `budget` tokens.
+
+    Aggregated ticket data ({source: fields}) is deduplicated across sources. If the result is over budget, the
+    lowest-ranked chat threads are dropped, then long threads are cut down to their first message and latest
+    replies, then low-value ticket fields are dropped, then rows of list-shaped ticket data (database search
+    results) past what fits are dropped, and as a last resort the chat messages past what fits are dropped.
+
+    Returns {"ticket_data": text, "ms_teams_chat_data": text, "tokens": count, "trimmed": [steps taken]}.
+    """
+    ticket_data = prune(ticket_data) if ticket_data else {}
+    if isinstance(ticket_data, dict) and any(source in ticket_data for source in SOURCE_PRIORITY):
+        ticket_data = dedupe_sources(ticket_data)
+    threads = compact_conversations(chat_data)
+    trimmed = []
+
+    ticket_text = compact_json(ticket_data)
+    ticket_tokens = count_tokens(ticket_text, model)
+    thread_tokens = [count_tokens(compact_json(thread), model) for thread in threads]
+
+    def total():
+        return ticket_tokens + sum(thread_tokens)
+
+    # Drop the lowest-ranked threads, always keeping the best match
+    while len(threads) > 1 and total() > budget:
+        threads.pop()
+        thread_tokens.pop()
+        if "dropped threads" not in trimmed:
+            trimmed.append("dropped threads")
+
+    # Cut long threads down, longest first
+    for index in sorted(range(len(threads)), key=lambda i: -thread_tokens[i]):
+        if total() <= budget:
+            break
+        shortened = shorten_thread(threads[index])
+        if shortened is not threads[index]:
+            threads[index] = shortened
+            thread_tokens[index] = count_tokens(compact_json(shortened), model)
+            if "shortened threads" not in trimmed:
+                trimmed.append("shortened threads")
+
+    # Drop low-value ticket fields
+    if total() > budget and isinstance(ticket_data, dict):
+        ticket_data = drop_fields(ticket_data, LOW_VALUE_FIELDS)
+        dropped_text = compact_json(ticket_data)
+        if dropped_text != ticket_text:
+            ticket_text = dropped_text
+            ticket_tokens = count_tokens(ticket_text, model)
+            trimmed.append("dropped low-value fields")
+
+    # Keep the leading rows of search results that fit, noting how many were left out
+    if total() > budget and isinstance(ticket_data, list):
+        ticket_data, ticket_text, ticket_tokens = fit_rows(ticket_data, budget - sum(thread_tokens), model)
+        trimmed.append("dropped rows")
+
+    if total() > budget and threads:
+        # Last resort: only the best thread is left, so keep its leading messages that fit
+        thread, _, _ = fit_rows(threads[0], budget - ticket_tokens, model, unit="messages")
+        threads = [thread]
+        trimmed.append("dropped messages")
+
+    chat_text = compact_json(threads)
+
+    tokens = ticket_tokens + count_tokens(chat_text, model)
+    return {"ticket_data": ticket_text, "ms_teams_chat_data": chat_text, "tokens": tokens, "trimmed": trimmed}
+
+
+def fit_rows(rows, budget, model="gpt-4o-mini", unit="rows"):
+    """
+    Returns (rows, text, tokens) for the longest prefix of `rows` that fits in `budget` tokens, with a note of how
+    many more `unit` were left out.
+    """
+    kept, used = [], 0
+    for row in rows:
+        row_tokens = count_tokens(compact_json(row), model) + 1  # The separating comma
+        if used + row_tokens > budget - 20:  # Leave room for the note
+            break
+        kept.append(row)
+        used += row_tokens
+    kept.append(f"...({len(rows) - len(kept)} more {unit} omitted)")
+    text = compact_json(kept)
+    return kept, text, count_tokens(text, model)
+
+
+def drop_fields(value, fields):
+    if isinstance(value, dict):
+        return {k: drop_fields(v, fields) for k, v in value.items() if k not in fields}
+    if isinstance(value, list):
+        return [drop_fields(v, fields) for v in value]
+    return value
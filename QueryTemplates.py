@@ -0,0 +1,106 @@
+import re
+
+# Slot patterns: each captures the value that follows the field's name, e.g. "serial number ABC123" or "s/n: ABC123"
+# The value must contain a digit, so "serial number for ticket ..." doesn't read "for" as a serial number
+VALUE = r"""[:#=]?\s*(?:is\s+|of\s+)?["']?((?=[A-Za-z\-_/.]*\d)[A-Za-z0-9][A-Za-z0-9\-_/.]*[A-Za-z0-9])["']?"""
+SLOT_PATTERNS = {
+    "serial": re.compile(r"\b(?:serial(?:\s*(?:number|no\.?|#))?|s/?n)\s*" + VALUE, re.IGNORECASE),
+    "tracking": re.compile(r"\btracking(?:\s*(?:number|no\.?|#))?\s*" + VALUE, re.IGNORECASE),
+    "item": re.compile(r"\b(?:item|part)(?:\s*(?:number|no\.?|#))?\s*" + VALUE, re.IGNORECASE),
+    "account": re.compile(r"\b(?:account|acct)(?:\s*(?:number|no\.?|#))?\s*[:#=]?\s*(?:is\s+)?(\d{7,8})\b",
+                          re.IGNORECASE),
+    # Only "for/under/from/with/by customer ...", to the end of the request, so "which customer is on ..." isn't a search
+    "customer": re.compile(r"\b(?:for|under|from|with|by)\s+(?:the\s+)?customer(?:\s+name)?\s*[:=]?\s*(?:is\s+)?(?:\"([^\"]+)\"|'([^']+)'|"
+                           r"([A-Za-z0-9&.,' \-]+?))\s*[?.!]?\s*$", re.IGNORECASE),
+}
+account_number_pattern = re.compile(r'\b\d{7,8}\b')
+ticket_prefix_pattern = re.compile(r'\b(?:ticket|CW)\s*#?\s*$', re.IGNORECASE)
+
+# Requests mentioning any of these ask for more than a lookup on one field, so they go to the LLM
+UNSUPPORTED_PATTERN = re.compile(
+    r"\b(?:how\s+many|count|between|before|after|since|during|date|city|state|project|description|quantity|"
+    r"notes?|sort|order|latest|oldest|most\s+recent|top|average|total|sum|group|per|except|without|not)\b",
+    re.IGNORECASE)
+
+# Filters added to the base query for each slot. Values are always passed as parameters.
+SLOT_FILTERS = {
+    "serial": ("sop10201.SERLTNUM = %s", lambda value: value),
+    "tracking": ("sop10107.Tracking_Number = %s", lambda value: value),
+    "item": ("COALESCE(sop10200.ITEMNMBR, sop30300.ITEMNMBR) = %s", lambda value: value),
+    # Account numbers are stored with or without a leading zero
+    "account": ("COALESCE(sop10100.CSTPONBR, sop30200.CSTPONBR) LIKE %s", lambda value: f"%{value.lstrip('0')}"),
+    "customer": ("COALESCE(sop10100.CUSTNAME, sop30200.CUSTNAME) LIKE %s", lambda value: f"%{value}%"),
+}
+QUEUE = "COALESCE(sop10100.BACHNUMB, sop30200.BACHNUMB)"
+OPEN_FILTER = f"{QUEUE} NOT IN ('RDY TO INVOICE', 'RDY TO INV') AND {QUEUE} NOT LIKE 'Q%'"
+CLOSED_FILTER = f"({QUEUE} IN ('RDY TO INVOICE', 'RDY TO INV') OR {QUEUE} LIKE 'Q%')"
+
+
+def extract_slots(prompt):
+    """
+    Finds the search fields named in a request, returning {slot: value}. A 7 or 8 digit number that isn't the value
+    of another slot or written as a ticket number is taken as an account number, as process_user_prompt always has.
+    """
+    slots = {}
+    for slot, pattern in SLOT_PATTERNS.items():
+        match = pattern.search(prompt)
+        if match:
+            value = next(group for group in match.groups() if group)
+            slots[slot] = value.strip().strip("\"'")
+
+    if "account" not in slots:
+        taken = set(slots.values())
+        for match in account_number_pattern.finditer(prompt):
+            if match.group() not in taken and not ticket_prefix_pattern.search(prompt, 0, match.start()):
+                slots["account"] = match.group()
+                break
+    return slots
+
+
+def parse_search(prompt):
+    """
+    Reads a request that is a plain lookup by serial, account, item, customer or tracking number, returning
+    (slots, status), where status is "open", "closed" or None for all tickets. Returns None when the request
+    needs the LLM to write the query.
+    """
+    if UNSUPPORTED_PATTERN.search(prompt):
+        return None
+    slots = extract_slots(prompt)
+    if not slots:
+        return None
+
+    # Account searches have always meant open tickets unless all or closed ones are asked for
+    if re.search(r"\bclosed\b", prompt, re.IGNORECASE):
+        status = "closed"
+    elif re.search(r"\bopen\b", prompt, re.IGNORECASE) or (
+            "account" in slots and not re.search(r"\ball\b", prompt, re.IGNORECASE)):
+        status = "open"
+    else:
+        status = None
+    return slots, status
+
+
+def match_query_template(prompt, base_query):
+    """
+    Builds the SQL for a request that is a plain lookup by serial, account, item, customer or tracking number,
+    as (sql, params) for a pymssql cursor. Returns None when the request needs the LLM to write the query.
+
+    `base_query` must end in a WHERE clause; the filters are ANDed onto it.
+    """
+    search = parse_search(prompt)
+    if search is None:
+        return None
+    slots, status = search
+
+    filters, params = [], []
+    for slot, value in slots.items():
+        condition, to_param = SLOT_FILTERS[slot]
+        filters.append(condition)
+        params.append(to_param(value))
+    if status == "open":
+        filters.append(OPEN_FILTER)
+    elif status == "closed":
+        filters.append(CLOSED_FILTER)
+
+    sql = base_query.strip() + "\nAND " + "\nAND ".join(filters)
+    return sql, tuple(params)
@@ -0,0 +1,511 @@
+"""
+Records the responses of every external service the bot calls, and plays them back through local stand-ins so the
+whole pipeline can be run offline (see bench_pipeline.py).
+
+Three boundaries are intercepted:
+
+- HTTP, at requests.Session.send. This covers ConnectWise, MS Graph, MSAL and the Smartsheet SDK, which sends
+  its API calls through its own requests session.
+- SQL Server, at pymssql.connect. Replayed connections support the cursor calls the bot makes (execute, fetchone,
+  fetchmany, fetchall, description) and the cancel used by BoundedQuery.
+- OpenAI, at the chat completions `create` method, streamed or not.
+
+Each interaction is stored under a key made from the full request (method, URL and body; SQL and parameters;
+model, messages and stream flag), with how long the real call took. A request asked for more often than it was
+recorded cycles through its recorded responses. HTTP and LLM requests that don't match exactly fall back to a
+recording of the same method and path, or the same model and final message; SQL has no fallback. Fallbacks and
+misses are counted so a stale cassette shows up in the results. A miss raises the error the real client raises
+for an unreachable service.
+
+    cassette = Cassette()
+    with recording(cassette):
+        ...  # run against the live services
+    cassette.save("pipeline.cassette.json")
+
+    with replaying(Cassette.load("pipeline.cassette.json"), LatencyModel(fixed={"sql": 0.02})):
+        ...  # the same calls, answered locally
+
+Cassettes hold real ticket, customer and chat data, so keep them out of the repository. Access and refresh tokens
+in HTTP response bodies are redacted when recorded.
+"""
+import base64
+import contextlib
+import datetime
+import decimal
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from urllib.parse import urlsplit
+
+import httpx
+import openai
+import pymssql
+import requests
+from openai.resources.chat.completions import Completions
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
+from requests.structures import CaseInsensitiveDict
+
+from Tracing import span
+
+CASSETTE_VERSION = 1
+SERVICES = ("http", "sql", "openai")
+
+# The recorded body is already decoded and complete, so headers describing the wire encoding no longer apply
+DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"}
+REDACTED_KEYS = {"access_token", "refresh_token", "id_token"}
+
+DECODERS = {
+    "$datetime": datetime.datetime.fromisoformat,
+    "$date": datetime.date.fromisoformat,
+    "$decimal": decimal.Decimal,
+    "$bytes": base64.b64decode,
+    "$uuid": uuid.UUID,
+}
+
+
+def encode_value(value):
+    """Converts SQL values (dates, decimals, bytes, UUIDs) into tagged JSON, recursively."""
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(value).decode()}
+    if isinstance(value, uuid.UUID):
+        return {"$uuid": str(value)}
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            (tag, raw), = value.items()
+            if tag in DECODERS:
+                return DECODERS[tag](raw)
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def fingerprint(*parts):
+    payload = json.dumps(encode_value(list(parts)), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class Cassette:
+    """
+    Recorded interactions, by service and request key, with the settings and workload they were recorded with.
+    Thread-safe: the pipeline records and replays from several worker threads at once.
+    """
+
+    def __init__(self, interactions=None, environment=None, workload=None):
+        self.interactions = interactions or {service: {} for service in SERVICES}
+        self.environment = environment or {}
+        self.workload = workload or {}
+        self.lock = threading.Lock()
+        self.positions = defaultdict(int)
+        self.misses = Counter()
+        self.fallbacks = Counter()
+        self.missed = []  # Descriptions of the first requests that had no recording
+        self.by_fallback = {service: defaultdict(list) for service in SERVICES}
+        for service, entries in self.interactions.items():
+            for recordings in entries.values():
+                for entry in recordings:
+                    if entry["fallback"] is not None:
+                        self.by_fallback[service][entry["fallback"]].append(entry)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"{path} is a version {data.get('version')} cassette; re-record it")
+        return cls(data["interactions"], data.get("environment"), data.get("workload"))
+
+    def save(self, path):
+        with self.lock:
+            data = {"version": CASSETTE_VERSION, "environment": self.environment, "workload": self.workload,
+                    "interactions": self.interactions}
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+
+    def record(self, service, key, fallback, response, elapsed, **details):
+        entry = {"fallback": fallback, "elapsed": round(elapsed, 6), "response": response, **details}
+        with self.lock:
+            self.interactions[service].setdefault(key, []).append(entry)
+            if fallback is not None:
+                self.by_fallback[service][fallback].append(entry)
+
+    def next(self, service, key, fallback, description=None):
+        """
+        Returns the next recorded entry for `key`, or one recorded under `fallback` if given, or None. A miss is
+        noted under `description` (the fallback by default).
+        """
+        with self.lock:
+            recordings = self.interactions[service].get(key)
+            position = (service, key)
+            if not recordings:
+                recordings = self.by_fallback[service].get(fallback) if fallback is not None else None
+                position = (service, "fallback", fallback)
+                if recordings:
+                    self.fallbacks[service] += 1
+                else:
+                    self.misses[service] += 1
+                    if len(self.missed) < 10:
+                        self.missed.append(f"{service}: {description or fallback}")
+                    return None
+            entry = recordings[self.positions[position] % len(recordings)]
+            self.positions[position] += 1
+            return entry
+
+    def counts(self):
+        with self.lock:
+            return {service: sum(len(recordings) for recordings in self.interactions[service].values())
+                    for service in SERVICES}
+
+
+class LatencyModel:
+    """
+    How long replayed calls take. `fixed` maps an HTTP host, a service ("http", "sql" or "openai") or "all" to a
+    delay in seconds, in that order of precedence; calls with no fixed delay take as long as they did when recorded.
+    Every delay is multiplied by `scale` and varied randomly by up to +/- `jitter` (a fraction).
+    """
+
+    def __init__(self, fixed=None, scale=1.0, jitter=0.0, seed=0):
+        self.fixed = fixed or {}
+        self.scale = scale
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, scale=1.0, jitter=0.0):
+        """Builds a model from "recorded" or a list like "openai=800,sql=20,graph.microsoft.com=150" in ms."""
+        fixed = {}
+        if spec and spec != "recorded":
+            for item in spec.split(","):
+                name, _, milliseconds = item.partition("=")
+                fixed[name.strip()] = float(milliseconds) / 1000
+        return cls(fixed, scale, jitter)
+
+    def delay(self, service, recorded, host=None):
+        base = self.fixed.get(host, self.fixed.get(service, self.fixed.get("all", recorded)))
+        if self.jitter:
+            with self.lock:
+                base *= 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base * self.scale)
+
+
+@contextlib.contextmanager
+def patched(target, name, value):
+    original = getattr(target, name)
+    setattr(target, name, value)
+    try:
+        yield original
+    finally:
+        setattr(target, name, original)
+
+
+# HTTP
+
+def http_key(request):
+    body = request.body.encode() if isinstance(request.body, str) else request.body or b""
+    return fingerprint(request.method, request.url, hashlib.sha256(body).hexdigest())
+
+
+def http_fallback(request):
+    parts = urlsplit(request.url)
+    return f"{request.method} {parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def redact(content):
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return content
+    if not isinstance(body, dict) or not REDACTED_KEYS & body.keys():
+        return content
+    return json.dumps({key: "redacted" if key in REDACTED_KEYS else value for key, value in body.items()})
+
+
+def encode_body(content):
+    try:
+        return redact(content.decode("utf-8"))
+    except UnicodeDecodeError:
+        return encode_value(content)
+
+
+def build_response(request, recorded):
+    response = requests.Response()
+    response.status_code = recorded["status"]
+    response.reason = recorded["reason"]
+    response.headers = CaseInsensitiveDict(recorded["headers"])
+    body = recorded["body"]
+    response._content = body.encode("utf-8") if isinstance(body, str) else decode_value(body)
+    response._content_consumed = True
+    response.encoding = "utf-8" if isinstance(body, str) else None
+    response.url = request.url
+    response.request = request
+    response.elapsed = datetime.timedelta(0)
+    return response
+
+
+def record_http(cassette, original_send):
+    def send(session, request, **kwargs):
+        start = time.perf_counter()
+        response = original_send(session, request, **kwargs)
+        content = response.content  # Reads a streamed body now, so it is timed and recorded
+        recorded = {
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {key: value for key, value in response.headers.items() if key.lower() not in DROPPED_HEADERS},
+            "body": encode_body(content),
+        }
+        cassette.record("http", http_key(request), http_fallback(request), recorded, time.perf_counter() - start)
+        return response
+    return send
+
+
+def replay_http(cassette, latency):
+    def send(session, request, **kwargs):
+        host = urlsplit(request.url).netloc
+        with span("io.http", host=host):
+            entry = cassette.next("http", http_key(request), http_fallback(request))
+            if entry is None:
+                raise requests.ConnectionError(f"No recorded response for {http_fallback(request)}", request=request)
+            time.sleep(latency.delay("http", entry["elapsed"], host))
+            return build_response(request, entry["response"])
+    return send
+
+
+# SQL Server
+
+class ReplayCursor:
+    """pymssql cursor stand-in that serves each statement's rows from the cassette."""
+
+    def __init__(self, cassette, latency, as_dict=False):
+        self.cassette = cassette
+        self.latency = latency
+        self.as_dict = as_dict
+        self.rows = deque()
+        self.description = None
+        self.rowcount = -1
+
+    @staticmethod
+    def key(statement, params):
+        return fingerprint(statement, params)
+
+    def execute(self, statement, params=None):
+        with span("io.sql"):
+            description = " ".join(statement.split())[:200]
+            entry = self.cassette.next("sql", self.key(statement, params), None, description)
+            if entry is None:
+                raise pymssql.OperationalError(f"No recorded result for: {description}")
+            time.sleep(self.latency.delay("sql", entry["elapsed"]))
+            self.load(entry["response"])
+
+    def load(self, recorded):
+        rows = decode_value(recorded["rows"])
+        self.rows = deque(rows if self.as_dict else [tuple(row) for row in rows])
+        self.description = ([tuple(column) for column in recorded["description"]]
+                            if recorded["description"] is not None else None)
+        self.rowcount = len(self.rows)
+
+    def fetchone(self):
+        return self.rows.popleft() if self.rows else None
+
+    def fetchmany(self, size=1):
+        return [self.rows.popleft() for _ in range(min(size, len(self.rows)))]
+
+    def fetchall(self):
+        rows, self.rows = list(self.rows), deque()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.rows = deque()
+
+
+class RecordingCursor(ReplayCursor):
+    """Runs statements on a real cursor and records their rows, then serves them like a replayed cursor."""
+
+    def __init__(self, cassette, cursor, as_dict=False):
+        super().__init__(cassette, None, as_dict)
+        self.cursor = cursor
+
+    def execute(self, statement, params=None):
+        start = time.perf_counter()
+        if params is None:
+            self.cursor.execute(statement)
+        else:
+            self.cursor.execute(statement, params)
+        description = self.cursor.description
+        rows = self.cursor.fetchall() if description else []
+        recorded = {
+            "description": [[column[0], column[1]] for column in description] if description else None,
+            "rows": encode_value(rows),
+        }
+        self.cassette.record("sql", self.key(statement, params), None, recorded, time.perf_counter() - start)
+        self.load(recorded)
+
+    def close(self):
+        super().close()
+        self.cursor.close()
+
+
+class ReplayLowLevelConnection:
+    """Stands in for `connection._conn`, which BoundedQuery uses to cancel a query."""
+
+    def cancel(self):
+        pass
+
+
+class ReplayConnection:
+    def __init__(self, cassette, latency):
+        self.cassette = cassette
+        self.latency = latency
+        self._conn = ReplayLowLevelConnection()
+
+    def cursor(self, as_dict=False):
+        return ReplayCursor(self.cassette, self.latency, as_dict)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, cassette, connection):
+        self.cassette = cassette
+        self.connection = connection
+
+    def cursor(self, as_dict=False):
+        return RecordingCursor(self.cassette, self.connection.cursor(as_dict=as_dict), as_dict)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+# OpenAI
+
+def completion_key(model, messages, stream):
+    return fingerprint(model, list(messages), bool(stream))
+
+
+def completion_fallback(model, messages, stream):
+    messages = list(messages)
+    last = messages[-1]["content"] if messages else ""
+    return f"{model} {bool(stream)} {str(last)[:200]}"
+
+
+def build_completion(model, recorded):
+    usage = recorded.get("usage")
+    return ChatCompletion(
+        id="replayed", created=0, model=model, object="chat.completion",
+        choices=[Choice(index=0, finish_reason="stop",
+                        message=ChatCompletionMessage(role="assistant", content=recorded["content"]))],
+        usage=CompletionUsage(prompt_tokens=usage[0], completion_tokens=usage[1],
+                              total_tokens=usage[0] + usage[1]) if usage else None,
+    )
+
+
+def stream_chunks(model, entry, delay):
+    """Yields the recorded pieces, the first after the recorded share of `delay` and the rest spread evenly."""
+    pieces = entry["response"]["pieces"]
+    elapsed = entry["elapsed"] or 1
+    first_wait = delay * min(entry.get("first_token", elapsed) / elapsed, 1)
+    gap = (delay - first_wait) / max(len(pieces) - 1, 1)
+    for index, piece in enumerate(pieces):
+        time.sleep(first_wait if index == 0 else gap)
+        yield ChatCompletionChunk(
+            id="replayed", created=0, model=model, object="chat.completion.chunk",
+            choices=[ChunkChoice(index=0, finish_reason=None, delta=ChoiceDelta(content=piece))],
+        )
+
+
+def record_completions(cassette, original_create):
+    def create(self, *, messages, model, stream=False, **kwargs):
+        key, fallback = completion_key(model, messages, stream), completion_fallback(model, messages, stream)
+        start = time.perf_counter()
+        result = original_create(self, messages=messages, model=model, stream=stream, **kwargs)
+        if not stream:
+            usage = [result.usage.prompt_tokens, result.usage.completion_tokens] if result.usage else None
+            cassette.record("openai", key, fallback, {"content": result.choices[0].message.content, "usage": usage},
+                            time.perf_counter() - start)
+            return result
+
+        def chunks():
+            pieces, first_token = [], None
+            try:
+                for chunk in result:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        pieces.append(chunk.choices[0].delta.content)
+                    yield chunk
+            finally:
+                elapsed = time.perf_counter() - start
+                cassette.record("openai", key, fallback, {"content": "".join(pieces), "pieces": pieces}, elapsed,
+                                first_token=first_token if first_token is not None else elapsed)
+        return chunks()
+    return create
+
+
+def replay_completions(cassette, latency):
+    def create(self, *, messages, model, stream=False, **kwargs):
+        fallback = completion_fallback(model, messages, stream)
+        entry = cassette.next("openai", completion_key(model, messages, stream), fallback)
+        if entry is None:
+            raise openai.APIConnectionError(
+                message=f"No recorded completion for: {fallback}",
+                request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        delay = latency.delay("openai", entry["elapsed"])
+        if stream:
+            return stream_chunks(model, entry, delay)
+        time.sleep(delay)
+        return build_completion(model, entry["response"])
+    return create
+
+
+@contextlib.contextmanager
+def recording(cassette):
+    """Records every HTTP, SQL Server and OpenAI call made in the block into `cassette`."""
+    original_send, original_connect, original_create = requests.Session.send, pymssql.connect, Completions.create
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patched(requests.Session, "send", record_http(cassette, original_send)))
+        stack.enter_context(patched(pymssql, "connect", lambda *args, **kwargs: RecordingConnection(
+            cassette, original_connect(*args, **kwargs))))
+        stack.enter_context(patched(Completions, "create", record_completions(cassette, original_create)))
+        yield cassette
+
+
+@contextlib.contextmanager
+def replaying(cassette, latency=None):
+    """Answers every HTTP, SQL Server and OpenAI call made in the block from `cassette`, without network access."""
+    latency = latency or LatencyModel()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patched(requests.Session, "send", replay_http(cassette, latency)))
+        stack.enter_context(patched(pymssql, "connect", lambda *args, **kwargs: ReplayConnection(cassette, latency)))
+        stack.enter_context(patched(Completions, "create", replay_completions(cassette, latency)))
+        yield cassette
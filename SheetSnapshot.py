@@ -0,0 +1,260 @@
+import sqlite3
+import threading
+import contextlib
+import datetime
+import json
+import time
+
+
+class SheetRow:
+    """Compact copy of a sheet row: parallel tuples of column IDs and the non-empty cell values."""
+    __slots__ = ("row_id", "row_number", "column_ids", "values")
+
+    def __init__(self, row_id, row_number, column_ids, values):
+        self.row_id = row_id
+        self.row_number = row_number
+        self.column_ids = column_ids
+        self.values = values
+
+    def items(self, column_names):
+        """Returns the row as (column title, value) pairs in sheet column order."""
+        return [(column_names[column_id], value) for column_id, value in zip(self.column_ids, self.values)
+                if column_id in column_names]
+
+
+class SheetSnapshot:
+    """
+    Keeps a local SQLite copy of a Smartsheet sheet so row lookups never have to download the sheet.
+
+    The snapshot is refreshed with row-level deltas (rowsModifiedSince + ifVersionAfter), so a refresh only
+    transfers the rows that changed. Deleted rows are not reported by delta syncs, so a full reload is done
+    every `full_sync_interval` seconds to drop them.
+
+    The rows are also held in memory for the life of the process, indexed by normalized key, so a lookup is a
+    dictionary hit rather than a query.
+    """
+
+    # Rows modified while a sync is in flight can be missed if we use the exact start time, so overlap a bit.
+    SYNC_OVERLAP_SECONDS = 60
+    # After a failed sync, lookups use the existing snapshot for this long before Smartsheet is tried again
+    FAILED_SYNC_BACKOFF_SECONDS = 60
+
+    def __init__(self, path, fetch_sheet, key_column, normalize=str, sync_interval=300, full_sync_interval=86400,
+                 miss_resync_interval=30):
+        self.path = path
+        self.fetch_sheet = fetch_sheet  # Callable accepting get_sheet keyword arguments, returns a Sheet or None
+        self.key_column = key_column
+        self.normalize = normalize
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.miss_resync_interval = miss_resync_interval
+        self.sync_lock = threading.Lock()
+
+        self.column_names = {}
+        self.rows_by_key = {}
+        self.key_by_row_id = {}
+        self.column_id_tuples = {}  # Most rows share the same column layout, so they share one tuple
+        self.last_sync = 0.0
+        self.last_full_sync = 0.0
+        self.retry_at = 0.0  # No sync before this time, set when one fails
+        self.version = None
+
+        self.init_db()
+        self.load_index()
+
+    @contextlib.contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def init_db(self):
+        with self.connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS columns (id INTEGER PRIMARY KEY, title TEXT);
+                CREATE TABLE IF NOT EXISTS rows (
+                    id INTEGER PRIMARY KEY, row_number INTEGER, ticket TEXT, modified_at TEXT, cells TEXT
+                );
+                CREATE INDEX IF NOT EXISTS rows_ticket ON rows (ticket);
+            """)
+
+    @staticmethod
+    def get_meta(conn, key, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    @staticmethod
+    def set_meta(conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def load_index(self):
+        """Loads the on-disk snapshot into the in-memory index."""
+        with self.connect() as conn:
+            version = self.get_meta(conn, "version")
+            self.version = int(version) if version is not None else None
+            self.last_sync = float(self.get_meta(conn, "last_sync", 0))
+            self.last_full_sync = float(self.get_meta(conn, "last_full_sync", 0))
+            self.column_names = dict(conn.execute("SELECT id, title FROM columns"))
+
+            rows_by_key, key_by_row_id = {}, {}
+            for row_id, row_number, ticket, cells in conn.execute(
+                    "SELECT id, row_number, ticket, cells FROM rows ORDER BY row_number"):
+                self.index_row(rows_by_key, key_by_row_id, ticket, self.make_row(row_id, row_number, json.loads(cells)))
+            self.rows_by_key, self.key_by_row_id = rows_by_key, key_by_row_id
+
+    def make_row(self, row_id, row_number, cells):
+        column_ids = tuple(column_id for column_id, _ in cells)
+        column_ids = self.column_id_tuples.setdefault(column_ids, column_ids)
+        return SheetRow(row_id, row_number, column_ids, tuple(value for _, value in cells))
+
+    @staticmethod
+    def index_row(rows_by_key, key_by_row_id, key, row):
+        """
+        Indexes `row` under `key`, replacing any earlier copy of it. Each key maps to its rows in sheet order, so
+        when the first row with a key is changed to another key, the next row with that key takes its place.
+        The per-key lists are replaced rather than changed, since lookups may be reading them.
+        """
+        old_key = key_by_row_id.pop(row.row_id, None)
+        if old_key:
+            rows = [current for current in rows_by_key.get(old_key, ()) if current.row_id != row.row_id]
+            if rows:
+                rows_by_key[old_key] = rows
+            else:
+                rows_by_key.pop(old_key, None)
+
+        if key:
+            key_by_row_id[row.row_id] = key
+            rows = rows_by_key.get(key)
+            rows_by_key[key] = sorted(rows + [row], key=lambda current: current.row_number or 0) if rows else [row]
+
+    def sync_due(self, stale_after):
+        """Returns True if the snapshot is `stale_after` seconds old or a full reload is due, outside any backoff."""
+        now = time.time()
+        return now >= self.retry_at and (now - self.last_full_sync >= self.full_sync_interval or
+                                         now - self.last_sync >= stale_after)
+
+    def ensure_fresh(self):
+        """Syncs the snapshot if it is older than `sync_interval`, doing a full reload when one is due."""
+        if self.sync_due(self.sync_interval):
+            self.sync(stale_after=self.sync_interval)
+
+    def sync(self, full=False, stale_after=None):
+        """
+        Pulls changes from Smartsheet into the snapshot. Returns False if Smartsheet could not be reached,
+        in which case the existing snapshot is left untouched.
+
+        With `stale_after`, the sync only happens if it is still due once the lock is held, so concurrent lookups
+        that find the snapshot stale sync it once rather than one after another; a full reload is done if one is
+        due, and nothing at all within FAILED_SYNC_BACKOFF_SECONDS of a failed sync.
+        """
+        with self.sync_lock:
+            if stale_after is not None:
+                if time.time() < self.retry_at:
+                    return False
+                if not self.sync_due(stale_after):
+                    return True
+                full = full or time.time() - self.last_full_sync >= self.full_sync_interval
+            full = full or not self.last_full_sync
+            started = time.time()
+
+            if full:
+                sheet = self.fetch_sheet()
+            else:
+                since = datetime.datetime.fromtimestamp(self.last_sync - self.SYNC_OVERLAP_SECONDS,
+                                                        datetime.timezone.utc)
+                sheet = self.fetch_sheet(rows_modified_since=since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                         if_version_after=self.version)
+            if sheet is None:
+                print("Smartsheet sync failed, using the existing snapshot.")
+                self.retry_at = time.time() + self.FAILED_SYNC_BACKOFF_SECONDS
+                return False
+
+            index = None
+            with self.connect() as conn:
+                # An unchanged sheet comes back as an abbreviated object with only the version set
+                if sheet.columns:
+                    index = self.store_sheet(conn, sheet, replace=full)
+                self.set_meta(conn, "last_sync", started)
+                if full:
+                    self.set_meta(conn, "last_full_sync", started)
+                if sheet.version is not None:
+                    self.set_meta(conn, "version", sheet.version)
+
+            # Swapped in only once the transaction has committed, so memory never runs ahead of the snapshot
+            if index is not None:
+                self.column_names, self.rows_by_key, self.key_by_row_id = index
+            self.last_sync = started
+            self.retry_at = 0.0
+            if full:
+                self.last_full_sync = started
+            if sheet.version is not None:
+                self.version = sheet.version
+            return True
+
+    def store_sheet(self, conn, sheet, replace=False):
+        """
+        Writes the sheet's columns and rows to the snapshot, all rows if `replace`, otherwise on top of the stored
+        ones. Returns the updated (column_names, rows_by_key, key_by_row_id) for the in-memory index, leaving the
+        current index untouched.
+        """
+        key_column_id = None
+        column_names = {}
+        conn.execute("DELETE FROM columns")
+        for column in sheet.columns:
+            conn.execute("INSERT INTO columns (id, title) VALUES (?, ?)", (column.id, column.title))
+            column_names[column.id] = column.title
+            if column.title == self.key_column:
+                key_column_id = column.id
+
+        if key_column_id is None:
+            print(f"{self.key_column} column not found")
+
+        if replace:
+            conn.execute("DELETE FROM rows")
+            rows_by_key, key_by_row_id = {}, {}
+        else:
+            rows_by_key, key_by_row_id = dict(self.rows_by_key), dict(self.key_by_row_id)
+
+        for row in sheet.rows:
+            ticket = None
+            cells = []
+            for cell in row.cells:
+                if cell.value is None:
+                    continue
+                cells.append([cell.column_id, cell.value])
+                if cell.column_id == key_column_id:
+                    ticket = self.normalize(str(cell.value).strip())
+            modified_at = row.modified_at.isoformat() if row.modified_at else None
+            conn.execute(
+                "INSERT OR REPLACE INTO rows (id, row_number, ticket, modified_at, cells) VALUES (?, ?, ?, ?, ?)",
+                (row.id, row.row_number, ticket, modified_at, json.dumps(cells)))
+            self.index_row(rows_by_key, key_by_row_id, ticket, self.make_row(row.id, row.row_number, cells))
+
+        return column_names, rows_by_key, key_by_row_id
+
+    def find_row(self, key):
+        """Returns the row for `key` as a list of (column title, value) pairs in sheet column order."""
+        rows = self.rows_by_key.get(key)
+        return rows[0].items(self.column_names) if rows else None
+
+    def lookup(self, key):
+        """Looks up a row by key, resyncing once on a miss in case the row was added since the last sync."""
+        self.ensure_fresh()
+        row = self.find_row(key)
+        if row is None and self.sync_due(self.miss_resync_interval) and \
+                self.sync(stale_after=self.miss_resync_interval):
+            row = self.find_row(key)
+        return row
+
+    def lookup_many(self, keys):
+        """Looks up several rows at once, with at most one resync for all of the misses. Returns {key: row}."""
+        self.ensure_fresh()
+        rows = {key: self.find_row(key) for key in keys}
+        if None in rows.values() and self.sync_due(self.miss_resync_interval) and \
+                self.sync(stale_after=self.miss_resync_interval):
+            rows = {key: row if row is not None else self.find_row(key) for key, row in rows.items()}
+        return rows
@@ -1,8 +1,6 @@
 import smartsheet
 from smartsheet import exceptions
-import pymssql
 import dotenv
-import requests
 import os
 import json
 import datetime
@@ -11,7 +9,13 @@ import random
 import logging
 import re
 import decimal
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
+from SheetSnapshot import SheetSnapshot
+from Database import sql_connection, execute_parameterized, in_list_params
+from HttpClient import http_get, HTTP_POOL_SIZE
+from Tracing import span, submit
 
 # Configure logging
 logging.basicConfig(level=logging.WARNING)
@@ -73,32 +77,104 @@ def smartsheet_api_call_with_retry(call, *args, **kwargs):
         attempt += 1
 
 
+def query_rows(db_config, sql_query, sql_params):
+    with sql_connection(**db_config) as connection:
+        cursor = connection.cursor(as_dict=True)
+        execute_parameterized(cursor, sql_query, sql_params)
+        return cursor.fetchall()
+
+
+def fetch_many_from_sql(source_class, ticket_ids, ticket_column, chunk_size=200):
+    """
+    Runs a SQL source's query with an IN list of tickets, one query per chunk, and splits the rows back out by
+    ticket. Returns {normalized ticket ID: data}.
+    """
+    ticket_ids = list(dict.fromkeys(normalize_ticket_number(t) for t in ticket_ids))
+    rows_by_ticket = {ticket_id: [] for ticket_id in ticket_ids}
+    try:
+        for start in range(0, len(ticket_ids), chunk_size):
+            sql_query, sql_params = source_class.build_query(ticket_ids[start:start + chunk_size])
+            for row in query_rows(source_class.get_db_config(), sql_query, sql_params):
+                ticket_id = normalize_ticket_number(row.get(ticket_column))
+                if ticket_id in rows_by_ticket:
+                    rows_by_ticket[ticket_id].append(row)
+    except Exception as e:
+        print(f"Database connection error: {str(e)}")
+        return {ticket_id: {"error": str(e)} for ticket_id in ticket_ids}
+
+    return {ticket_id: source_class.process_rows(rows) for ticket_id, rows in rows_by_ticket.items()}
+
+
+_smartsheet_client = None
+_sheet_snapshots = {}
+_sheet_snapshots_lock = threading.Lock()
+
+
+def get_smartsheet_client():
+    """
+    Returns the process-wide Smartsheet client. The SDK keeps its own pooled session, so sharing one client keeps
+    its connections alive across syncs.
+    """
+    global _smartsheet_client
+    if _smartsheet_client is None:
+        _smartsheet_client = smartsheet.Smartsheet(os.getenv("SMARTSHEET_ACCESS_TOKEN"),
+                                                   max_connections=HTTP_POOL_SIZE)
+    return _smartsheet_client
+
+
+def get_sheet_snapshot(sheet_id):
+    """
+    Returns the process-wide local snapshot for a sheet, creating it on first use.
+    """
+    with _sheet_snapshots_lock:
+        if sheet_id not in _sheet_snapshots:
+            smart = get_smartsheet_client()
+            _sheet_snapshots[sheet_id] = SheetSnapshot(
+                os.getenv("SMARTSHEET_SNAPSHOT_PATH", f"smartsheet_{sheet_id}.db"),
+                fetch_sheet=lambda **kwargs: smartsheet_api_call_with_retry(smart.Sheets.get_sheet, sheet_id,
+                                                                            **kwargs),
+                key_column="Equipment Ticket",
+                normalize=normalize_ticket_number,
+                sync_interval=int(os.getenv("SMARTSHEET_SYNC_INTERVAL", 300)),
+                full_sync_interval=int(os.getenv("SMARTSHEET_FULL_SYNC_INTERVAL", 86400)),
+            )
+        return _sheet_snapshots[sheet_id]
+
+
 class GetSSInfo:
+    SHEET_ID = 8892937224015748
+
     def __init__(self, ticket_id):
         self.ticket_id = normalize_ticket_number(ticket_id)
-        self.SMARTSHEET_ACCESS_TOKEN = os.getenv("SMARTSHEET_ACCESS_TOKEN")
-        self.sheet_id = 8892937224015748
-        self.smart = smartsheet.Smartsheet(self.SMARTSHEET_ACCESS_TOKEN)
-        self.sheet = smartsheet_api_call_with_retry(self.smart.Sheets.get_sheet, self.sheet_id)
-        self.column_map = {column.title: column.id for column in self.sheet.columns}
+        self.sheet_id = self.SHEET_ID
+        self.snapshot = get_sheet_snapshot(self.sheet_id)
         self.data = self.get_ticket_info()
 
+    @classmethod
+    def fetch_many(cls, ticket_ids):
+        """Returns {normalized ticket ID: data} for several tickets from a single snapshot refresh."""
+        rows = get_sheet_snapshot(cls.SHEET_ID).lookup_many([normalize_ticket_number(t) for t in ticket_ids])
+        return {ticket_id: cls.row_data(row) for ticket_id, row in rows.items()}
+
     def get_ticket_info(self):
-        row = self.find_ticket_row()
+        return self.row_data(self.find_ticket_row())
+
+    @classmethod
+    def row_data(cls, row):
         if not row:
             return {}
 
         row_data = {}
-        for cell in row.cells:
-            column_name = next((name for name, id in self.column_map.items() if id == cell.column_id), None)
-            if column_name and column_name not in ["Created By", "Created"]:
-                cell_value = self.process_cell_value(cell.value, column_name)
+        for column_name, value in row:
+            if column_name not in ["Created By", "Created"]:
+                cell_value = cls.process_cell_value(value, column_name)
                 if cell_value is not None:
                     row_data[column_name] = cell_value
 
         return row_data
 
-    def process_cell_value(self, value, column_name):
+    @classmethod
+    def process_cell_value(cls, value, column_name):
         if isinstance(value, float) and value.is_integer():
             processed_value = int(value)
         else:
@@ -114,7 +190,7 @@ class GetSSInfo:
             clean_value = processed_value
 
         if column_name == "Serial Number(s)" and isinstance(clean_value, str):
-            return self.parse_serial_numbers(clean_value)
+            return cls.parse_serial_numbers(clean_value)
 
         return clean_value
 
@@ -135,36 +211,98 @@ class GetSSInfo:
         return items if items else value
 
     def find_ticket_row(self):
-        equipment_ticket_column_id = self.column_map.get("Equipment Ticket")
-        if not equipment_ticket_column_id:
-            print("Equipment Ticket column not found")
-            return None
-
-        for row in self.sheet.rows:
-            for cell in row.cells:
-                if cell.column_id == equipment_ticket_column_id:
-                    cell_value = str(cell.value).strip()
-                    normalized_cell_value = normalize_ticket_number(cell_value)
-                    if normalized_cell_value == self.ticket_id:
-                        return row
-
-        return None
+        return self.snapshot.lookup(self.ticket_id)
 
     def __str__(self):
         return json.dumps(self.data, indent=2)
 
 
+# Separate from source_executor, which runs GetCWInfo itself, so CW requests never wait behind their own caller
+cw_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CW_FETCH_WORKERS", 8)), thread_name_prefix="cw-fetch")
+
+
 class GetCWInfo:
-    def __init__(self, ticket_id):
+    # Only the fields get_var reads are requested, which keeps CW responses a fraction of their full size
+    TICKET_FIELDS = ("id,board/name,summary,type/name,subType/name,status/name,company/name,city,stateIdentifier,"
+                     "_info/enteredBy,_info/dateEntered,customFields")
+    PRODUCT_FIELDS = "ticket/id,catalogItem/identifier,description,quantity"
+
+    def __init__(self, ticket_id, ticket_data=None, products=None):
         self.CW_BASE_URL = os.getenv("CW_BASE_URL")
         self.CW_COMPANY_ID = os.getenv("CW_COMPANY_ID_PROD")
         self.CW_PUBLIC_KEY = os.getenv('CW_PUBLIC_KEY')
         self.CW_PRIVATE_KEY = os.getenv('CW_PRIVATE_KEY')
         self.ticket_id = normalize_ticket_number(ticket_id)
         self.headers = {"clientid": os.getenv('CW_CLIENT_ID')}
-        self.ticket_data = self.get_ticket_by_id()
+        # Batch lookups pass in data they already fetched; otherwise it is requested here
+        self.products = products
+        if ticket_data is None:
+            # Request the products alongside the ticket rather than after it
+            products_future = cw_executor.submit(self.get_ticket_products) if products is None else None
+            ticket_data = self.get_ticket_by_id()
+            if products_future:
+                if ticket_data:
+                    self.products = products_future.result()
+                else:
+                    products_future.cancel()
+        self.ticket_data = ticket_data
         self.data = self.get_var()
 
+    @classmethod
+    def fetch_many(cls, ticket_ids, chunk_size=100):
+        """
+        Returns {normalized ticket ID: data} for several tickets using one conditions query for the tickets and
+        one for their products per chunk of IDs, instead of two requests per ticket.
+        """
+        ticket_ids = list(dict.fromkeys(normalize_ticket_number(t) for t in ticket_ids))
+        numeric_ids = [ticket_id for ticket_id in ticket_ids if ticket_id.isdigit()]  # Anything else isn't a CW ID
+        results = {ticket_id: {} for ticket_id in ticket_ids}
+
+        for start in range(0, len(numeric_ids), chunk_size):
+            id_list = ",".join(numeric_ids[start:start + chunk_size])
+            products_future = cw_executor.submit(cls.get_all_pages, "/procurement/products",
+                                                 f"ticket/id in ({id_list})", cls.PRODUCT_FIELDS)
+            tickets = cls.get_all_pages("/service/tickets", f"id in ({id_list})", cls.TICKET_FIELDS) or []
+            products = products_future.result() or []
+
+            products_by_ticket = {}
+            for product in products:
+                products_by_ticket.setdefault(str(product.get("ticket", {}).get("id")), []).append(product)
+
+            for ticket in tickets:
+                ticket_id = str(ticket.get("id"))
+                products = cls.summarize_products(products_by_ticket.get(ticket_id, []))
+                results[ticket_id] = cls(ticket_id, ticket_data=ticket, products=products).data
+
+        return results
+
+    @staticmethod
+    def get_all_pages(path, conditions, fields=None, page_size=1000):
+        """
+        Fetches every page of a CW list endpoint, limited to `fields` (a comma-separated CW field list) if given.
+        Returns None if a request fails.
+        """
+        url = f"{os.getenv('CW_BASE_URL')}{path}"
+        auth = (f"{os.getenv('CW_COMPANY_ID_PROD')}+{os.getenv('CW_PUBLIC_KEY')}", os.getenv('CW_PRIVATE_KEY'))
+        headers = {"clientid": os.getenv('CW_CLIENT_ID')}
+
+        params = {"conditions": conditions, "pageSize": page_size}
+        if fields:
+            params["fields"] = fields
+
+        results = []
+        page = 1
+        while True:
+            response = http_get(url, params={**params, "page": page}, auth=auth, headers=headers)
+            if response.status_code != 200:
+                print(f"Error fetching {path}: {response.status_code} {response.text}")
+                return None
+            page_results = response.json()
+            results += page_results
+            if len(page_results) < page_size:
+                return results
+            page += 1
+
     @staticmethod
     def process_access_times(custom_fields: List[Dict[str, Any]]) -> Dict[str, str]:
         access_times: Dict[str, Dict[str, str]] = {}
@@ -214,7 +352,7 @@ class GetCWInfo:
             "Location": f"{self.get_it('city')}, {self.get_it('stateIdentifier')}",
             "Entered by": self.get_it("_info", "enteredBy"),
             "Date entered": self.get_it("_info", "dateEntered"),
-            "Products": self.get_ticket_products()
+            "Products": self.products if self.products is not None else self.get_ticket_products()
         }
 
         custom_fields = self.get_it("customFields")
@@ -242,8 +380,9 @@ class GetCWInfo:
 
     def get_ticket_by_id(self):
         url = f"{self.CW_BASE_URL}/service/tickets/{self.ticket_id}"
-        response = requests.get(url, auth=(f"{self.CW_COMPANY_ID}+{self.CW_PUBLIC_KEY}", self.CW_PRIVATE_KEY),
-                                headers=self.headers)
+        response = http_get(url, params={"fields": self.TICKET_FIELDS},
+                            auth=(f"{self.CW_COMPANY_ID}+{self.CW_PUBLIC_KEY}", self.CW_PRIVATE_KEY),
+                            headers=self.headers)
 
         if response.status_code == 200:
             # print(json.dumps(response.json(), indent=2))
@@ -255,16 +394,18 @@ class GetCWInfo:
             return None
 
     def get_ticket_products(self):
-        products_with_details = {}
-
-        products_url = f"{self.CW_BASE_URL}/procurement/products?conditions=ticket/id={self.ticket_id}"
-        response = requests.get(products_url, auth=(f"{self.CW_COMPANY_ID}+{self.CW_PUBLIC_KEY}", self.CW_PRIVATE_KEY),
-                                headers=self.headers)
-        if response.status_code != 200:
-            print(f"Error fetching products for ticket {self.ticket_id}: {response.status_code}")
+        # Paged, so tickets with more products than one page holds are not cut short
+        products = self.get_all_pages("/procurement/products", f"ticket/id={self.ticket_id}", self.PRODUCT_FIELDS)
+        if products is None:
+            print(f"Error fetching products for ticket {self.ticket_id}")
             return {}
 
-        for product in response.json():
+        return self.summarize_products(products)
+
+    @staticmethod
+    def summarize_products(products):
+        products_with_details = {}
+        for product in products:
             identifier = product.get("catalogItem", {}).get("identifier")
             if identifier:
                 products_with_details[identifier] = {
@@ -279,23 +420,14 @@ class GetCWInfo:
 
 
 class GetGPInfo:
-    def __init__(self, ticket_id):
-        self.ticket_id = normalize_ticket_number(ticket_id)
-        self.db_config = {
-            "host": "gp2018",
-            "database": "SBM01",
-            "user": os.getenv('GRT_USER'),
-            "password": os.getenv("GRT_PASS"),
-            "tds_version": "7.0"
-        }
-        self.sql_query = f"""
-DECLARE @TicketNumber NVARCHAR(100) = '{self.ticket_id}';
-
+    # The ticket filter sits inside each branch so the SOPNUMBE indexes can be used, and the statement text only
+    # depends on the number of tickets so SQL Server reuses one cached plan.
+    SQL_QUERY = """
 SELECT DISTINCT
     [Equipment Ticket], 
     [Account Number],
     CASE
-            WHEN ([Queue] IN ('RDY TO INVOICE', 'RDY TO INV') OR [Queue] LIKE 'Q%')
+            WHEN ([Queue] IN ('RDY TO INVOICE', 'RDY TO INV') OR LEFT([Queue], 1) = 'Q')
 THEN 'RDY TO INVOICE'
             ELSE [Queue]
     END AS [Queue],
@@ -334,11 +466,11 @@ FROM (
         sop10107.Tracking_Number,
         sop30200.USER2ENT AS 'SO Creator'
     FROM sop30300
-    FULL JOIN sop30200 ON sop30200.SOPNUMBE = sop30300.SOPNUMBE
-    FULL JOIN sop10107 ON sop10107.SOPNUMBE = sop30300.SOPNUMBE
-    FULL JOIN spv3SalesDocument ON spv3SalesDocument.Sales_Doc_Num = sop30300.SOPNUMBE
-    FULL JOIN sop10201 ON sop10201.ITEMNMBR = sop30300.ITEMNMBR AND sop10201.SOPNUMBE = sop30300.SOPNUMBE
-    FULL JOIN sop10200 ON sop30300.SOPNUMBE = sop10200.SOPNUMBE
+    LEFT JOIN sop30200 ON sop30200.SOPNUMBE = sop30300.SOPNUMBE
+    LEFT JOIN sop10107 ON sop10107.SOPNUMBE = sop30300.SOPNUMBE
+    LEFT JOIN spv3SalesDocument ON spv3SalesDocument.Sales_Doc_Num = sop30300.SOPNUMBE
+    LEFT JOIN sop10201 ON sop10201.ITEMNMBR = sop30300.ITEMNMBR AND sop10201.SOPNUMBE = sop30300.SOPNUMBE
+    WHERE sop30300.SOPNUMBE IN ({tickets})
 
     UNION ALL
 
@@ -359,122 +491,156 @@ FROM (
         sop10107.Tracking_Number,
         sop10100.USER2ENT AS 'SO Creator'
     FROM sop10100
-    FULL JOIN sop10200 ON sop10200.SOPNUMBE = sop10100.SOPNUMBE
-    FULL JOIN spv3SalesDocument ON spv3SalesDocument.Sales_Doc_Num = sop10100.SOPNUMBE
-    FULL JOIN sop10201 ON sop10201.SOPNUMBE = sop10100.SOPNUMBE AND sop10201.ITEMNMBR = sop10200.ITEMNMBR
-    FULL JOIN sop10107 ON sop10107.SOPNUMBE = sop10100.SOPNUMBE
-) AS MASTER_GP_QUERY
-WHERE [Equipment Ticket] IN ('CW' + @TicketNumber + '-1', @TicketNumber);
+    LEFT JOIN sop10200 ON sop10200.SOPNUMBE = sop10100.SOPNUMBE
+    LEFT JOIN spv3SalesDocument ON spv3SalesDocument.Sales_Doc_Num = sop10100.SOPNUMBE
+    LEFT JOIN sop10201 ON sop10201.SOPNUMBE = sop10100.SOPNUMBE AND sop10201.ITEMNMBR = sop10200.ITEMNMBR
+    LEFT JOIN sop10107 ON sop10107.SOPNUMBE = sop10100.SOPNUMBE
+    WHERE sop10100.SOPNUMBE IN ({tickets})
+) AS MASTER_GP_QUERY;
 """
+
+    def __init__(self, ticket_id):
+        self.ticket_id = normalize_ticket_number(ticket_id)
+        self.db_config = self.get_db_config()
+        self.sql_query, self.sql_params = self.build_query([self.ticket_id])
         self.data = self.query_gp()
 
+    @staticmethod
+    def get_db_config():
+        return {
+            "host": "gp2018",
+            "database": "SBM01",
+            "user": os.getenv('GRT_USER'),
+            "password": os.getenv("GRT_PASS"),
+            "tds_version": "7.0"
+        }
+
+    @classmethod
+    def build_query(cls, ticket_ids):
+        # CW tickets are stored in GP as 'CW<ticket>-1'
+        ticket_numbers = [number for ticket_id in ticket_ids for number in (ticket_id, f"CW{ticket_id}-1")]
+        ticket_list, params = in_list_params("TicketNumber", "VARCHAR(31)", ticket_numbers)
+        return cls.SQL_QUERY.replace("{tickets}", ticket_list), params
+
+    @classmethod
+    def fetch_many(cls, ticket_ids):
+        return fetch_many_from_sql(cls, ticket_ids, "Equipment Ticket")
+
     def query_gp(self):
-        connection = None
-        item_key = None
         try:
-            connection = pymssql.connect(**self.db_config)
-            cursor = connection.cursor(as_dict=True)
-            cursor.execute(self.sql_query)
-            rows = cursor.fetchall()
+            return self.process_rows(query_rows(self.db_config, self.sql_query, self.sql_params))
+        except Exception as e:
+            logger.error(f"Database connection error: {str(e)}")
+            return {"error": str(e)}
+
+    @staticmethod
+    def process_rows(rows):
+        item_key = None
+        if not rows:
+            return {}
 
-            if not rows:
-                return {}
+        result_data = {}
+        items = {}
 
-            result_data = {}
-            items = {}
+        for row in rows:
+            for k, v in row.items():
+                if v is None:  # Skip None values outright
+                    continue
 
-            for row in rows:
-                for k, v in row.items():
-                    if v is None:  # Skip None values outright
+                if isinstance(v, str):
+                    v = v.strip()  # Strip string values
+                    if not v:  # If the string is empty after stripping, skip it
                         continue
 
-                    if isinstance(v, str):
-                        v = v.strip()  # Strip string values
-                        if not v:  # If the string is empty after stripping, skip it
-                            continue
-
-                    # Convert datetime objects to string
-                    if isinstance(v, datetime.datetime):
-                        v = v.isoformat()
-
-                    # Processing specific fields
-                    if k == 'Internal Notes':
-                        result_data[k] = [line for line in re.split(r'\r\n|\r|\n', v) if line]
-                    elif k in ['Item Number', 'Item Description', 'Serial Number', 'Quantity']:
-                        # Handling item details
-                        if k == 'Item Number' and v:
-                            item_key = v
-                            items[item_key] = items.get(item_key, {'Serial Numbers': []})
-                        elif k == 'Item Description' and item_key in items:
-                            items[item_key]['Item Description'] = v
-                        elif k == 'Quantity' and item_key in items:
-                            items[item_key]['Quantity'] = v
-                        elif k == 'Serial Number' and item_key in items:
-                            items[item_key]['Serial Numbers'].append(v)
-                    else:
-                        result_data[k] = v
-
-            if items:
-                result_data['Items'] = items
-
-            return result_data
-
-        except Exception as e:
-            logger.error(f"Database connection error: {str(e)}")
-            return {"error": str(e)}
-        finally:
-            if connection:
-                connection.close()
+                # Convert datetime objects to string
+                if isinstance(v, datetime.datetime):
+                    v = v.isoformat()
+
+                # Processing specific fields
+                if k == 'Internal Notes':
+                    result_data[k] = [line for line in re.split(r'\r\n|\r|\n', v) if line]
+                elif k in ['Item Number', 'Item Description', 'Serial Number', 'Quantity']:
+                    # Handling item details
+                    if k == 'Item Number' and v:
+                        item_key = v
+                        items[item_key] = items.get(item_key, {'Serial Numbers': []})
+                    elif k == 'Item Description' and item_key in items:
+                        items[item_key]['Item Description'] = v
+                    elif k == 'Quantity' and item_key in items:
+                        items[item_key]['Quantity'] = v
+                    elif k == 'Serial Number' and item_key in items:
+                        items[item_key]['Serial Numbers'].append(v)
+                else:
+                    result_data[k] = v
+
+        if items:
+            result_data['Items'] = items
+
+        return result_data
 
     def __str__(self):
         return json.dumps(self.data, indent=2) or 'No data available'
 
 
 class GetCSInfo:
+    SQL_QUERY = """
+select
+    TICKETS_CORE_VIEW.TICKET_ID as 'Ticket',
+    TICKETS_CORE_VIEW.MACNUM as 'Child Account',
+    TICKETS_CORE_VIEW.TICKET_TYPE as 'Ticket Type',
+    TICKETS_CORE_VIEW.TICKET_SUB_TYPE as 'Ticket Sub-type',
+    TICKETS_CORE_VIEW.STATUS as 'Status',
+    Assignee.NAME as 'Assigned To',
+    TICKETS_CORE_VIEW.LOGGED_DT as 'Creation Date',
+    TICKETS_CORE_VIEW.SUBJECT as 'Details',
+    Creator.NAME as 'Ticket Creator'
+from Tickets.TICKETS_CORE_VIEW
+left join People.EMPLOYEES Creator on Creator.EMPLOYEE_ID = TICKETS_CORE_VIEW.LOGGED_BY
+left join People.EMPLOYEES Assignee on Assignee.EMPLOYEE_ID = TICKETS_CORE_VIEW.ASSIGNED_TO
+where TICKETS_CORE_VIEW.TICKET_ID IN ({tickets})
+
+UNION
+
+select
+    Tickets.CAN_TICKETS_CORE.TICKET_ID as 'Ticket',
+    Tickets.CAN_TICKETS_CORE.MACNUM as 'Child Account',
+    cast(Tickets.CAN_TICKETS_CORE.TICKET_TYPES_ID as nvarchar) as 'Ticket Type',
+    cast(Tickets.CAN_TICKETS_CORE.TICKET_SUB_TYPES_ID as nvarchar) as 'Ticket Sub-type',
+    cast(Tickets.CAN_TICKETS_CORE.TICKET_STATUS_ID as nvarchar) as 'Status',
+    Assignee2.NAME as 'Assigned To',
+    Tickets.CAN_TICKETS_CORE.LOGGED_DT as 'Creation Date',
+    Tickets.CAN_TICKETS_CORE.SUBJECT as 'Details',
+    Creator2.NAME as 'Ticket Creator'
+from Tickets.CAN_TICKETS_CORE
+left join People.EMPLOYEES Creator2 on Creator2.EMPLOYEE_ID = Tickets.CAN_TICKETS_CORE.LOGGED_BY
+left join People.EMPLOYEES Assignee2 on Assignee2.EMPLOYEE_ID = Tickets.CAN_TICKETS_CORE.ASSIGNED_TO
+where Tickets.CAN_TICKETS_CORE.TICKET_ID IN ({tickets});
+"""
+
     def __init__(self, ticket_id):
         self.ticket_id = normalize_ticket_number(ticket_id)
-        self.db_config = {
+        self.db_config = self.get_db_config()
+        self.sql_query, self.sql_params = self.build_query([self.ticket_id])
+        self.data = self.query_cs()
+
+    @staticmethod
+    def get_db_config():
+        return {
             "host": "ods",
             "database": "ODS",
             "user": os.getenv('GRT_USER'),
             "password": os.getenv("GRT_PASS"),
             "tds_version": "7.0"
         }
-        self.sql_query = f"""
-select distinct * from (
-    select distinct
-        TICKETS_CORE_VIEW.TICKET_ID as 'Ticket',
-        TICKETS_CORE_VIEW.MACNUM as 'Child Account',
-        TICKETS_CORE_VIEW.TICKET_TYPE as 'Ticket Type',
-        TICKETS_CORE_VIEW.TICKET_SUB_TYPE as 'Ticket Sub-type',
-        TICKETS_CORE_VIEW.STATUS as 'Status',
-        Assignee.NAME as 'Assigned To',
-        TICKETS_CORE_VIEW.LOGGED_DT as 'Creation Date',
-        TICKETS_CORE_VIEW.SUBJECT as 'Details',
-        Creator.NAME as 'Ticket Creator'
-    from Tickets.TICKETS_CORE_VIEW
-    full join People.EMPLOYEES Creator on Creator.EMPLOYEE_ID = TICKETS_CORE_VIEW.LOGGED_BY
-    full join People.EMPLOYEES Assignee on Assignee.EMPLOYEE_ID = TICKETS_CORE_VIEW.ASSIGNED_TO
-
-    UNION
-
-    select distinct
-        Tickets.CAN_TICKETS_CORE.TICKET_ID as 'Ticket',
-        Tickets.CAN_TICKETS_CORE.MACNUM as 'Child Account',
-        cast(Tickets.CAN_TICKETS_CORE.TICKET_TYPES_ID as nvarchar) as 'Ticket Type',
-        cast(Tickets.CAN_TICKETS_CORE.TICKET_SUB_TYPES_ID as nvarchar) as 'Ticket Sub-type',
-        cast(Tickets.CAN_TICKETS_CORE.TICKET_STATUS_ID as nvarchar) as 'Status',
-        Assignee2.NAME as 'Assigned To',
-        Tickets.CAN_TICKETS_CORE.LOGGED_DT as 'Creation Date',
-        Tickets.CAN_TICKETS_CORE.SUBJECT as 'Details',
-        Creator2.NAME as 'Ticket Creator'
-    from Tickets.CAN_TICKETS_CORE
-    full join People.EMPLOYEES Creator2 on Creator2.EMPLOYEE_ID = Tickets.CAN_TICKETS_CORE.LOGGED_BY
-    full join People.EMPLOYEES Assignee2 on Assignee2.EMPLOYEE_ID = Tickets.CAN_TICKETS_CORE.ASSIGNED_TO
-) as MASTER_CS_QUERY
-where [Ticket] = '{self.ticket_id}';
-"""
-        self.data = self.query_cs()
+
+    @classmethod
+    def build_query(cls, ticket_ids):
+        ticket_list, params = in_list_params("TicketNumber", "VARCHAR(20)", ticket_ids)
+        return cls.SQL_QUERY.replace("{tickets}", ticket_list), params
+
+    @classmethod
+    def fetch_many(cls, ticket_ids):
+        return fetch_many_from_sql(cls, ticket_ids, "Ticket")
 
     @staticmethod
     def clean_text(text):
@@ -483,69 +649,54 @@ where [Ticket] = '{self.ticket_id}';
         text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
         return text.strip()  # Remove leading and trailing whitespace
 
-    def parse_details(self, details):
+    @classmethod
+    def parse_details(cls, details):
         # Split the details into lines first
         lines = details.split('\n')
 
         # Then clean each line and build the cleaned details list
-        cleaned_lines = [self.clean_text(line) for line in lines if line.strip()]
+        cleaned_lines = [cls.clean_text(line) for line in lines if line.strip()]
 
         return cleaned_lines
 
     def query_cs(self):
-        connection = None
         try:
-            connection = pymssql.connect(**self.db_config)
-            cursor = connection.cursor(as_dict=True)
-            cursor.execute(self.sql_query)
-            rows = cursor.fetchall()
-
-            result_data = {}
-
-            for row in rows:
-                processed_row = {}
-                for key, value in row.items():
-                    if value is None:
-                        processed_row[key] = None
-                    elif isinstance(value, decimal.Decimal) and value % 1 == 0:
-                        processed_row[key] = int(value)
-                    elif isinstance(value, float) and value.is_integer():
-                        processed_row[key] = int(value)
-                    elif isinstance(value, datetime.datetime):
-                        processed_row[key] = value.isoformat()
-                    elif isinstance(value, str) and key == 'Details':
-                        processed_row[key] = self.parse_details(value)
-                    else:
-                        processed_row[key] = value.strip() if isinstance(value, str) else value
-
-                if processed_row:
-                    result_data.update(processed_row)
-
-            return result_data
-
+            return self.process_rows(query_rows(self.db_config, self.sql_query, self.sql_params))
         except Exception as e:
             print(f"Database connection error: {str(e)}")
             return {"error": str(e)}
 
-        finally:
-            if connection:
-                connection.close()
+    @classmethod
+    def process_rows(cls, rows):
+        result_data = {}
+
+        for row in rows:
+            processed_row = {}
+            for key, value in row.items():
+                if value is None:
+                    processed_row[key] = None
+                elif isinstance(value, decimal.Decimal) and value % 1 == 0:
+                    processed_row[key] = int(value)
+                elif isinstance(value, float) and value.is_integer():
+                    processed_row[key] = int(value)
+                elif isinstance(value, datetime.datetime):
+                    processed_row[key] = value.isoformat()
+                elif isinstance(value, str) and key == 'Details':
+                    processed_row[key] = cls.parse_details(value)
+                else:
+                    processed_row[key] = value.strip() if isinstance(value, str) else value
+
+            if processed_row:
+                result_data.update(processed_row)
+
+        return result_data
 
     def __str__(self):
         return json.dumps(self.data, indent=2) or 'No data available'
 
 
 class GetWOMInfo:
-    def __init__(self, ticket_id):
-        self.ticket_id = normalize_ticket_number(ticket_id)
-        self.db_config = {
-            "host": "ods",
-            "database": "ODS",
-            "user": os.getenv('GRT_USER'),
-            "password": os.getenv("GRT_PASS"),
-            "tds_version": "7.0"
-        }
-        self.sql_query = f"""
+    SQL_QUERY = """
 select distinct * from (
 select
 WOM.customerinformation$provisioningworkorder.provisioningwonumber as 'Ticket',
@@ -565,12 +716,35 @@ left join WOM.customerinformation$provisioningworkorder_provisioningworkordersta
 left join WOM.customerinformation$provisioningworkorderstatus on WOM.customerinformation$provisioningworkorderstatus.id = WOM.customerinformation$provisioningworkorder_provisioningworkorderstatus.customerinformation$provisioningworkorderstatusid	
 
 
-
+where WOM.customerinformation$provisioningworkorder.provisioningwonumber IN ({tickets})
 ) as MASTER_WOM_QUERY
-where [Ticket] = '{self.ticket_id}'
 """
+
+    def __init__(self, ticket_id):
+        self.ticket_id = normalize_ticket_number(ticket_id)
+        self.db_config = self.get_db_config()
+        self.sql_query, self.sql_params = self.build_query([self.ticket_id])
         self.data = self.query_wom()
 
+    @staticmethod
+    def get_db_config():
+        return {
+            "host": "ods",
+            "database": "ODS",
+            "user": os.getenv('GRT_USER'),
+            "password": os.getenv("GRT_PASS"),
+            "tds_version": "7.0"
+        }
+
+    @classmethod
+    def build_query(cls, ticket_ids):
+        ticket_list, params = in_list_params("TicketNumber", "VARCHAR(20)", ticket_ids)
+        return cls.SQL_QUERY.replace("{tickets}", ticket_list), params
+
+    @classmethod
+    def fetch_many(cls, ticket_ids):
+        return fetch_many_from_sql(cls, ticket_ids, "Ticket")
+
     def parse_details(self, details):
         lines = details.split('\u2022')[1:]  # Skip the first element if details start with a bullet
         parsed_details = {}
@@ -614,54 +788,105 @@ where [Ticket] = '{self.ticket_id}'
         return items or None  # Return None if the list is empty
 
     def query_wom(self):
-        connection = None
         try:
-            connection = pymssql.connect(**self.db_config)
-            cursor = connection.cursor(as_dict=True)
-            cursor.execute(self.sql_query)
-            rows = cursor.fetchall()
-
-            result_data = {}
-            if not rows:
-                return result_data  # Return empty dict if no rows found
-
-            for row in rows:
-                for key, value in row.items():
-                    if isinstance(value, decimal.Decimal) and value % 1 == 0:
-                        value = int(value)
-                    elif isinstance(value, float) and value.is_integer():
-                        value = int(value)
-                    elif isinstance(value, datetime.datetime):
-                        value = value.isoformat()
-                    elif isinstance(value, str):
-                        value = value.strip()
-
-                    if value:  # Add to result if value is meaningful (not None, not empty string, etc.)
-                        result_data[key] = value
-
-            return result_data
+            return self.process_rows(query_rows(self.db_config, self.sql_query, self.sql_params))
         except Exception as e:
             print(f"Database connection error: {str(e)}")
             return {"error": str(e)}
-        finally:
-            if connection:
-                connection.close()
+
+    @staticmethod
+    def process_rows(rows):
+        result_data = {}
+        if not rows:
+            return result_data  # Return empty dict if no rows found
+
+        for row in rows:
+            for key, value in row.items():
+                if isinstance(value, decimal.Decimal) and value % 1 == 0:
+                    value = int(value)
+                elif isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                elif isinstance(value, datetime.datetime):
+                    value = value.isoformat()
+                elif isinstance(value, str):
+                    value = value.strip()
+
+                if value:  # Add to result if value is meaningful (not None, not empty string, etc.)
+                    result_data[key] = value
+
+        return result_data
 
     def __str__(self):
         return json.dumps(self.data, indent=2) or 'No data available'
 
 
+# Shared by all concurrent TicketAggregators, so the number of in-flight source queries stays bounded
+source_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TICKET_SOURCE_WORKERS", 16)),
+                                     thread_name_prefix="ticket-source")
+
+
 class TicketAggregator:
-    def __init__(self, ticket_id):
+    # ConnectWise is preferred; WOM and then Cornerstone are only used when the sources before them are empty
+    FALLBACK_SOURCES = [("ConnectWise", GetCWInfo), ("WOM", GetWOMInfo), ("Cornerstone", GetCSInfo)]
+
+    def __init__(self, ticket_id, concurrent=False):
         self.ticket_id = ticket_id
-        self.ss_info = GetSSInfo(ticket_id)
-        self.gp_info = GetGPInfo(ticket_id)
+        self.concurrent = concurrent
+        if concurrent:
+            # Start every source right away, including the fallbacks, so aggregate_data only waits on the slowest
+            self.futures = {source_class: submit(source_executor, self.get_data_from_source, source_class)
+                            for source_class in [GetSSInfo, GetGPInfo] + [s for _, s in self.FALLBACK_SOURCES]}
+        else:
+            with span("source.GetSSInfo"):
+                self.ss_info = GetSSInfo(ticket_id)
+            with span("source.GetGPInfo"):
+                self.gp_info = GetGPInfo(ticket_id)
 
     def get_data_from_source(self, source_class):
-        source = source_class(self.ticket_id)
-        return source.data
+        with span(f"source.{source_class.__name__}"):
+            source = source_class(self.ticket_id)
+            return source.data
+
+    @staticmethod
+    def fetch_many_from_source(source_class, ticket_ids):
+        with span(f"source.{source_class.__name__}", tickets=len(ticket_ids)):
+            return source_class.fetch_many(ticket_ids)
+
+    @classmethod
+    def aggregate_many(cls, ticket_ids):
+        """
+        Aggregates data for many tickets with one query per source rather than one per ticket and source.
+        Returns {ticket ID: aggregated data}, keyed by the ticket IDs as passed in.
+        """
+        normalized_ids = {ticket_id: normalize_ticket_number(ticket_id) for ticket_id in ticket_ids}
+        unique_ids = list(dict.fromkeys(normalized_ids.values()))
+        if not unique_ids:
+            return {}
+
+        source_classes = [GetSSInfo, GetGPInfo] + [source_class for _, source_class in cls.FALLBACK_SOURCES]
+        futures = {source_class: submit(source_executor, cls.fetch_many_from_source, source_class, unique_ids)
+                   for source_class in source_classes}
+        results = {source_class: future.result() for source_class, future in futures.items()}
+
+        aggregated = {}
+        for ticket_id, normalized_id in normalized_ids.items():
+            aggregated_data = {
+                "Smartsheet": results[GetSSInfo].get(normalized_id),
+                "Salespad/GP": results[GetGPInfo].get(normalized_id),
+            }
+            for name, source_class in cls.FALLBACK_SOURCES:
+                data = results[source_class].get(normalized_id)
+                if data:
+                    aggregated_data[name] = data
+                    break
+            aggregated[ticket_id] = {k: v for k, v in aggregated_data.items() if v}
+
+        return aggregated
 
     def aggregate_data(self):
+        if self.concurrent:
+            return self.aggregate_data_concurrently()
+
         aggregated_data = {
             "Smartsheet": self.ss_info.data,
             "Salespad/GP": self.gp_info.data,
@@ -684,6 +909,24 @@ class TicketAggregator:
 
         return {k: v for k, v in aggregated_data.items() if v}
 
+    def aggregate_data_concurrently(self):
+        aggregated_data = {
+            "Smartsheet": self.futures[GetSSInfo].result(),
+            "Salespad/GP": self.futures[GetGPInfo].result(),
+        }
+
+        for name, source_class in self.FALLBACK_SOURCES:
+            data = self.futures[source_class].result()
+            if data:
+                aggregated_data[name] = data
+                break
+
+        # Speculative fallbacks that are no longer needed are dropped, or cancelled if they have not started yet
+        for future in self.futures.values():
+            future.cancel()
+
+        return {k: v for k, v in aggregated_data.items() if v}
+
     def __str__(self):
         aggregated_data = self.aggregate_data()
         return json.dumps(aggregated_data, indent=2)
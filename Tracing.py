@@ -0,0 +1,226 @@
+"""
+Per-stage timing and token accounting.
+
+Wrap work in `span("stage")` to time it. Every span is added to the process-wide histograms (see
+prometheus_text), and when it runs inside `start_trace(...)` it also becomes part of that trace's breakdown
+(see Trace.report). The trace and the enclosing span are held in context variables, so work handed to a thread
+pool is only attributed to them when submitted with `submit`, which carries the caller's context across.
+
+    with start_trace("prompt") as trace:
+        with span("intent"):
+            ...
+    print(trace.report())
+"""
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+
+# Upper bounds of the histogram buckets, in seconds and in tokens
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations for each set of label values."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = defaultdict(lambda: [[0] * len(self.buckets), 0.0, 0])  # labels -> [counts, sum, count]
+
+    def observe(self, value, labels):
+        series = self.series[labels]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in labels)
+            separator = "," if label_text else ""
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket{{{label_text}{separator}le="{bound}"}} {bucket_count}'
+            yield f'{self.name}_bucket{{{label_text}{separator}le="+Inf"}} {count}'
+            yield f"{self.name}_sum{{{label_text}}} {total:.6f}"
+            yield f"{self.name}_count{{{label_text}}} {count}"
+
+
+class Counter:
+    """Running totals for each set of label values."""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.series = defaultdict(float)
+
+    def inc(self, labels, amount=1):
+        self.series[labels] += amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.series.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in labels)
+            # Totals are floats only so that fractional amounts can be added; whole ones are written as integers
+            value = int(value) if value.is_integer() else repr(value)
+            yield f"{self.name}{{{label_text}}} {value}"
+
+
+_metrics_lock = threading.Lock()
+stage_seconds = Histogram("granitebot_stage_seconds", "Time spent in each stage.", SECONDS_BUCKETS)
+stage_errors = Counter("granitebot_stage_errors_total", "Stages that ended with an exception.")
+llm_tokens = Counter("granitebot_llm_tokens_total", "Tokens used by LLM calls, by stage and kind.")
+llm_call_tokens = Histogram("granitebot_llm_call_tokens", "Total tokens per LLM call.", TOKEN_BUCKETS)
+_metrics = [stage_seconds, stage_errors, llm_tokens, llm_call_tokens]
+
+
+class Span:
+    __slots__ = ("name", "parent", "depth", "start", "duration", "attributes", "error")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+
+class Trace:
+    """The spans recorded while handling one request, from whichever threads did the work."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span_):
+        with self.lock:
+            self.spans.append(span_)
+
+    def tokens(self):
+        """Returns (prompt tokens, completion tokens) summed over every LLM call in the trace."""
+        with self.lock:
+            spans = list(self.spans)
+        return (sum(s.attributes.get("prompt_tokens", 0) for s in spans),
+                sum(s.attributes.get("completion_tokens", 0) for s in spans))
+
+    def report(self):
+        """
+        Returns the breakdown as indented lines in start order, e.g. "  sql.execute  0.412s", with token counts
+        and other attributes after the duration.
+        """
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        lines = []
+        for s in spans:
+            duration = f"{s.duration:.3f}s" if s.duration is not None else "running"
+            offset = f"+{s.start - self.start:.3f}s"
+            details = " ".join(f"{key}={value}" for key, value in s.attributes.items())
+            if s.error:
+                details = f"{details} error={s.error}".strip()
+            lines.append(f"{'  ' * s.depth}{s.name:<{36 - 2 * s.depth}} {duration:>9} {offset:>9}  {details}".rstrip())
+        prompt_tokens, completion_tokens = self.tokens()
+        lines.append(f"{self.name} total {time.perf_counter() - self.start:.3f}s, "
+                     f"{prompt_tokens} prompt + {completion_tokens} completion tokens")
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def start_trace(name):
+    """Starts a trace for one request; spans in this context (and work passed to `submit`) are recorded in it."""
+    trace = Trace(name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Times the enclosed block as stage `name`. Yields the Span, whose attributes can be added to."""
+    parent = _current_span.get()
+    current = Span(name, parent, attributes)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        with _metrics_lock:
+            stage_errors.inc((("stage", name),))
+        raise
+    finally:
+        _current_span.reset(token)
+        current.duration = time.perf_counter() - current.start
+        with _metrics_lock:
+            stage_seconds.observe(current.duration, (("stage", name),))
+
+
+def traced(name):
+    """Decorator form of span()."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attributes):
+    """Adds attributes to the current span, if there is one."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def record_tokens(prompt_tokens, completion_tokens, model=None, estimated=False):
+    """Records an LLM call's token usage on the current span and in the per-stage token totals."""
+    current = _current_span.get()
+    stage = current.name if current is not None else "unknown"
+    # An LLM call's own span is named "llm"; attribute its tokens to the stage that made the call
+    if current is not None and current.name == "llm" and current.parent is not None:
+        stage = current.parent.name
+    if current is not None:
+        current.attributes["prompt_tokens"] = current.attributes.get("prompt_tokens", 0) + prompt_tokens
+        current.attributes["completion_tokens"] = current.attributes.get("completion_tokens", 0) + completion_tokens
+        if model:
+            current.attributes["model"] = model
+        if estimated:
+            current.attributes["estimated"] = True
+    with _metrics_lock:
+        llm_tokens.inc((("kind", "prompt"), ("stage", stage)), prompt_tokens)
+        llm_tokens.inc((("kind", "completion"), ("stage", stage)), completion_tokens)
+        llm_call_tokens.observe(prompt_tokens + completion_tokens, (("stage", stage),))
+
+
+def submit(executor, function, *args, **kwargs):
+    """executor.submit that runs `function` in a copy of the caller's context, so its spans join the caller's trace."""
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+def prometheus_text():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _metrics_lock:
+        lines = [line for metric in _metrics for line in metric.lines()]
+    return "\n".join(lines) + "\n"
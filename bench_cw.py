@@ -0,0 +1,234 @@
+"""
+Compares the old and new GetCWInfo retrieval against a local ConnectWise stand-in server.
+
+The old path requests the full ticket, then the full product list, one after the other; the new path requests both
+at once with a `fields=` projection and pages through the products. The stand-in serves synthetic tickets with the
+same shape as CW's (including a long tail of fields get_var never reads) and adds a fixed latency to every
+response, so the comparison shows round trips and payload size rather than CW's own processing time.
+
+    python bench_cw.py --tickets 200 --lookups 50 --latency 40
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+
+def make_ticket(ticket_id, rng):
+    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    custom_fields = []
+    for day in days:
+        custom_fields.append({"id": len(custom_fields), "caption": f"Access Start | {day}", "type": "Text",
+                              "entryMethod": "EntryField", "numberOfDecimals": 0, "value": "08:00"})
+        custom_fields.append({"id": len(custom_fields), "caption": f"Access End | {day}", "type": "Text",
+                              "entryMethod": "EntryField", "numberOfDecimals": 0, "value": "17:00"})
+    for n in range(20):
+        custom_fields.append({"id": len(custom_fields), "caption": f"Site Detail {n}", "type": "Text",
+                              "entryMethod": "EntryField", "numberOfDecimals": 0,
+                              "value": f"detail {rng.getrandbits(32):x}" if n % 3 == 0 else None})
+
+    reference = {"id": 1, "name": "Reference", "_info": {"href": "https://cw.example/ref/1"}}
+    ticket = {
+        "id": ticket_id,
+        "summary": f"Equipment swap for location {rng.randrange(10000)}",
+        "recordType": "ServiceTicket",
+        "board": {**reference, "name": "Field Services"},
+        "status": {**reference, "name": "In Progress"},
+        "type": {**reference, "name": "Equipment"},
+        "subType": {**reference, "name": "Replacement"},
+        "company": {**reference, "identifier": "ACME", "name": "Acme Corp"},
+        "site": reference, "contact": reference, "priority": reference, "serviceLocation": reference,
+        "source": reference, "team": reference, "agreement": reference, "location": reference,
+        "department": reference, "currency": {"symbol": "$", "isoCode": "USD", "name": "US Dollars"},
+        "addressLine1": "1 Main St", "addressLine2": "Suite 100", "city": "Quincy", "stateIdentifier": "MA",
+        "zip": "02169", "country": reference, "contactName": "Site Contact", "contactPhoneNumber": "5555555555",
+        "contactEmailAddress": "contact@example.com",
+        "initialDescription": "Lorem ipsum dolor sit amet. " * 40,
+        "resources": "tech1, tech2",
+        "_info": {"lastUpdated": "2024-01-01T00:00:00Z", "updatedBy": "bot", "dateEntered": "2024-01-01T00:00:00Z",
+                  "enteredBy": "dispatcher", "activities_href": "https://cw.example/activities",
+                  "timeentries_href": "https://cw.example/timeentries"},
+        "customFields": custom_fields,
+    }
+    for n in range(60):
+        ticket[f"unusedField{n}"] = None if n % 2 else f"value {n}"
+    return ticket
+
+
+def make_product(ticket_id, index, rng):
+    reference = {"id": 1, "name": "Reference", "_info": {"href": "https://cw.example/ref/1"}}
+    product = {
+        "id": ticket_id * 100 + index,
+        "ticket": {"id": ticket_id, "summary": "Equipment swap", "_info": {"href": "https://cw.example/ticket"}},
+        "catalogItem": {"id": index, "identifier": f"ITEM-{index}", "_info": {"href": "https://cw.example/item"}},
+        "description": f"Replacement part {index}",
+        "quantity": rng.randint(1, 5),
+        "price": 10.0, "cost": 5.0, "company": reference, "warehouse": reference, "vendor": reference,
+        "productClass": "NonInventory", "unitOfMeasure": reference, "customerDescription": "Part " * 20,
+        "internalNotes": "Note " * 40,
+        "_info": {"lastUpdated": "2024-01-01T00:00:00Z", "updatedBy": "bot"},
+    }
+    for n in range(30):
+        product[f"unusedField{n}"] = None if n % 2 else n
+    return product
+
+
+def project(record, fields):
+    """Applies a CW `fields=` projection, where nested fields are written as parent/child."""
+    result = {}
+    for field in fields.split(","):
+        source, target = record, result
+        parts = field.split("/")
+        for part in parts[:-1]:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = source[parts[-1]]
+    return result
+
+
+class StandInCW:
+    def __init__(self, ticket_count, max_products, latency, seed=0):
+        rng = random.Random(seed)
+        self.latency = latency
+        self.tickets = {}
+        self.products = {}
+        for n in range(ticket_count):
+            ticket_id = 4000000 + n
+            self.tickets[ticket_id] = make_ticket(ticket_id, rng)
+            self.products[ticket_id] = [make_product(ticket_id, i, rng)
+                                        for i in range(rng.randint(0, max_products))]
+        self.bytes_sent = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def handle(self, path, query):
+        fields = query.get("fields", [None])[0]
+        page_size = int(query.get("pageSize", [25])[0])  # CW's default page size
+        page = int(query.get("page", [1])[0])
+        conditions = query.get("conditions", [""])[0]
+
+        match = re.fullmatch(r"/service/tickets/(\d+)", path)
+        if match:
+            ticket = self.tickets.get(int(match.group(1)))
+            if ticket is None:
+                return 404, {"code": "NotFound"}
+            return 200, project(ticket, fields) if fields else ticket
+
+        ids = [int(i) for i in re.findall(r"\d+", conditions)]
+        if path == "/service/tickets":
+            records = [self.tickets[i] for i in ids if i in self.tickets]
+        elif path == "/procurement/products":
+            records = [product for i in ids for product in self.products.get(i, [])]
+        else:
+            return 404, {"code": "NotFound"}
+        records = records[(page - 1) * page_size:page * page_size]
+        return 200, [project(record, fields) for record in records] if fields else records
+
+
+def serve(stand_in):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # Otherwise delayed ACKs add ~40 ms to every keep-alive response
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            status, body = stand_in.handle(parts.path, parse_qs(parts.query))
+            payload = json.dumps(body).encode()
+            time.sleep(stand_in.latency)
+            with stand_in.lock:
+                stand_in.bytes_sent += len(payload)
+                stand_in.requests += 1
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def old_lookup(ticket_id):
+    """The original GetCWInfo request sequence: full ticket, then full products, each on a new connection."""
+    from TicketInfo import GetCWInfo
+    base_url = os.environ["CW_BASE_URL"]
+    ticket = requests.get(f"{base_url}/service/tickets/{ticket_id}").json()
+    products = requests.get(f"{base_url}/procurement/products?conditions=ticket/id={ticket_id}").json()
+    return GetCWInfo(ticket_id, ticket_data=ticket, products=GetCWInfo.summarize_products(products)).data
+
+
+def new_lookup(ticket_id):
+    from TicketInfo import GetCWInfo
+    return GetCWInfo(ticket_id).data
+
+
+def time_lookups(stand_in, lookup, ticket_ids):
+    stand_in.bytes_sent = stand_in.requests = 0
+    timings, results = [], []
+    for ticket_id in ticket_ids:
+        start = time.perf_counter()
+        results.append(lookup(ticket_id))
+        timings.append(time.perf_counter() - start)
+    return timings, results, stand_in.bytes_sent, stand_in.requests
+
+
+def report(name, timings, bytes_sent, request_count):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))]
+    print(f"  {name:<4} median {statistics.median(timings_ms):8.1f} ms   p95 {p95:8.1f} ms   "
+          f"{request_count:5d} requests   {bytes_sent / len(timings) / 1024:8.1f} KiB per lookup")
+    return statistics.median(timings_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=200, help="number of synthetic tickets to serve")
+    parser.add_argument("--lookups", type=int, default=50, help="number of ticket lookups to time per path")
+    parser.add_argument("--max-products", type=int, default=40, help="most products on one ticket")
+    parser.add_argument("--latency", type=float, default=40, help="milliseconds added to every response")
+    args = parser.parse_args()
+
+    stand_in = StandInCW(args.tickets, args.max_products, args.latency / 1000)
+    server = serve(stand_in)
+    os.environ.update({
+        "CW_BASE_URL": f"http://127.0.0.1:{server.server_port}",
+        "CW_COMPANY_ID_PROD": "bench", "CW_PUBLIC_KEY": "public", "CW_PRIVATE_KEY": "private",
+        "CW_CLIENT_ID": "bench",
+    })
+    lookups = random.Random(1).sample(sorted(stand_in.tickets), min(args.lookups, len(stand_in.tickets)))
+
+    print(f"GetCWInfo ({len(lookups)} lookups, {args.latency:.0f} ms per response):")
+    old_timings, old_results, old_bytes, old_requests = time_lookups(stand_in, old_lookup, lookups)
+    new_timings, new_results, new_bytes, new_requests = time_lookups(stand_in, new_lookup, lookups)
+    old_median = report("old", old_timings, old_bytes, old_requests)
+    new_median = report("new", new_timings, new_bytes, new_requests)
+
+    # The old path only ever saw CW's first page of products, so tickets with more than that differ by design
+    comparable = [(old, new) for ticket_id, old, new in zip(lookups, old_results, new_results)
+                  if len(stand_in.products[ticket_id]) <= 25]
+    identical = all(old == new for old, new in comparable)
+    truncated = len(lookups) - len(comparable)
+    print(f"  speedup {old_median / new_median:.1f}x, payload {old_bytes / max(new_bytes, 1):.1f}x smaller, "
+          f"results identical: {identical} ({truncated} tickets with over 25 products now complete)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Benchmarks the whole prompt pipeline (intent, database searches, ticket sources, Teams search and LLM calls)
+offline, from a cassette of real responses recorded once (see Replay.py).
+
+Record a workload against the live services with the usual .env, then replay it on any machine, as often as
+needed, with the recorded latency or with injected latency (in ms, per service or per HTTP host):
+
+    python bench_pipeline.py record prompts.txt
+    python bench_pipeline.py replay --iterations 20
+    python bench_pipeline.py replay --latency openai=800,http=60,sql=20 --jitter 0.2 --save after.json \\
+        --baseline before.json
+
+prompts.txt holds one prompt per line, sent in order in one conversation, so follow-ups such as "summarize it"
+work. Each replay iteration sends the whole workload in a new session; the report gives p50 and p95 for every
+stage (the Tracing spans, plus io.http and io.sql for the replayed calls) over all prompts of the measured
+iterations. Caches of responses and query results are off while recording and, unless --warm is given, while
+replaying, so every prompt runs the full pipeline. The local GP index is always off.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from Replay import Cassette, LatencyModel, recording, replaying
+
+DEFAULT_CASSETTE = "pipeline.cassette.json"
+
+# Settings that shape URLs, SQL or prompts, so replay must use the values they were recorded with
+RECORDED_SETTINGS = ["CW_BASE_URL", "MS_TENANT_ID", "MS_CLIENT_ID", "GP_SERVER", "GP_DATABASE",
+                     "PROMPT_TOKEN_BUDGET", "TEAMS_TOP_K", "TEAMS_CONTEXT_MESSAGES"]
+# Credentials the clients insist on having; replayed calls never send them anywhere
+PLACEHOLDER_SETTINGS = ["OPENAI_API_KEY", "SMARTSHEET_ACCESS_TOKEN", "GRT_USER", "GRT_PASS", "CW_COMPANY_ID_PROD",
+                        "CW_PUBLIC_KEY", "CW_PRIVATE_KEY", "CW_CLIENT_ID", "MS_CLIENT_SECRET"]
+
+
+class ReplayAuth:
+    """Stands in for MSGraphAuthenticate.Authenticate, whose token comes from an interactive sign-in."""
+
+    def get_headers(self):
+        return {"Authorization": "Bearer replayed", "Content-Type": "application/json"}
+
+
+def configure_environment(work_dir, cold=True):
+    """Points every local cache at `work_dir` and turns off the caches that would skip pipeline stages."""
+    os.environ.update({
+        "GP_INDEX_ENABLED": "false",
+        "TRACE_PROMPTS": "false",
+        "RESPONSE_CACHE_PATH": os.path.join(work_dir, "response_cache.db"),
+        "SMARTSHEET_SNAPSHOT_PATH": os.path.join(work_dir, "smartsheet.db"),
+        "TEAMS_CHANNEL_CACHE_PATH": os.path.join(work_dir, "channel_teams.json"),
+    })
+    if cold:
+        os.environ.update({"RESPONSE_CACHE_TTL": "0", "QUERY_CACHE_TTL": "0"})
+
+
+def run_workload(prompts, stream):
+    """Sends the prompts in order in a new session and returns the trace of each."""
+    import bot
+    session = bot.BotSession(f"bench-{time.monotonic_ns()}")
+    traces = []
+    for prompt in prompts:
+        _, trace = bot.process_user_prompt(prompt, stream=(lambda text: None) if stream else None, session=session,
+                                           return_trace=True)
+        traces.append(trace)
+    return traces
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """Silences the bot's console output, which would otherwise swamp the report and slow the run."""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def stage_stats(traces):
+    """Returns {stage: {"calls", "p50", "p95", "mean"}} in ms, "calls" being the average number per prompt."""
+    samples = defaultdict(list)
+    for trace in traces:
+        for s in trace.spans:
+            if s.duration is not None:
+                samples[s.name].append(s.duration * 1000)
+    return {name: {"calls": len(durations) / len(traces),
+                   "p50": percentile(durations, 0.5),
+                   "p95": percentile(durations, 0.95),
+                   "mean": statistics.fmean(durations)}
+            for name, durations in samples.items()}
+
+
+def report(stats, baseline=None):
+    # The whole prompt first, then the stages that take the most time per prompt
+    order = sorted(stats, key=lambda name: (name != "prompt", -stats[name]["mean"] * stats[name]["calls"]))
+    header = f"  {'stage':<28} {'calls/prompt':>12} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}"
+    if baseline:
+        header += f" {'base p50':>9} {'change':>8}"
+    print(header)
+    for name in order:
+        stage = stats[name]
+        line = (f"  {name:<28} {stage['calls']:>12.1f} {stage['p50']:>9.1f} {stage['p95']:>9.1f} "
+                f"{stage['mean']:>9.1f}")
+        if baseline:
+            base = baseline.get(name)
+            if base:
+                change = (stage["p50"] - base["p50"]) / base["p50"] * 100 if base["p50"] else 0.0
+                line += f" {base['p50']:>9.1f} {change:>+7.1f}%"
+            else:
+                line += f" {'-':>9} {'new':>8}"
+        print(line)
+
+
+def record(args):
+    with open(args.prompts, encoding="utf-8") as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    cassette = Cassette(environment={name: os.environ[name] for name in RECORDED_SETTINGS if name in os.environ},
+                        workload={"prompts": prompts, "stream": not args.no_stream})
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir)
+        started = time.perf_counter()
+        with recording(cassette), quiet(args.verbose):
+            traces = run_workload(prompts, stream=not args.no_stream)
+        elapsed = time.perf_counter() - started
+
+    cassette.save(args.cassette)
+    counts = cassette.counts()
+    print(f"Recorded {len(prompts)} prompts in {elapsed:.1f} s to {args.cassette}: "
+          + ", ".join(f"{count} {service}" for service, count in counts.items()) + " interactions.")
+    report(stage_stats(traces))
+
+
+def replay(args):
+    cassette = Cassette.load(args.cassette)
+    prompts, stream = cassette.workload["prompts"], cassette.workload.get("stream", True)
+    latency = LatencyModel.parse(args.latency, scale=args.latency_scale, jitter=args.jitter)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["stages"]
+
+    os.environ.update(cassette.environment)
+    for name in PLACEHOLDER_SETTINGS:
+        os.environ.setdefault(name, "replay")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir, cold=not args.warm)
+        import bot
+        bot.teams_auth = ReplayAuth()
+
+        with replaying(cassette, latency), quiet(args.verbose):
+            # Warm-up iterations load the Smartsheet snapshot and channel index and fill the connection pools
+            for _ in range(args.warmup):
+                run_workload(prompts, stream)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                runs = list(executor.map(lambda _: run_workload(prompts, stream), range(args.iterations)))
+            elapsed = time.perf_counter() - started
+
+    traces = [trace for run in runs for trace in run]
+    stats = stage_stats(traces)
+    print(f"Replayed {args.iterations} iterations of {len(prompts)} prompts in {elapsed:.1f} s "
+          f"(concurrency {args.concurrency}, latency {args.latency}, scale {args.latency_scale}, "
+          f"jitter {args.jitter}, {'warm' if args.warm else 'cold'} caches, {args.warmup} warm-up iterations):")
+    report(stats, baseline)
+
+    if cassette.misses or cassette.fallbacks:
+        print(f"  Cassette is out of date: {dict(cassette.misses)} unrecorded requests, "
+              f"{dict(cassette.fallbacks)} answered by a similar recording. Record it again for exact results.")
+        for description in cassette.missed:
+            print(f"    missed {description}")
+    if args.save:
+        settings = {key: getattr(args, key) for key in ("iterations", "warmup", "concurrency", "latency",
+                                                        "latency_scale", "jitter", "warm")}
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "stages": stats}, f, indent=2)
+        print(f"  Saved to {args.save}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="run a workload against the live services and record it")
+    record_parser.add_argument("prompts", help="file with one prompt per line")
+    record_parser.add_argument("--no-stream", action="store_true", help="request whole responses, not streamed ones")
+
+    replay_parser = subparsers.add_parser("replay", help="run a recorded workload against the local stand-ins")
+    replay_parser.add_argument("--iterations", type=int, default=10, help="measured runs of the workload")
+    replay_parser.add_argument("--warmup", type=int, default=1, help="runs before measuring, not reported")
+    replay_parser.add_argument("--concurrency", type=int, default=1, help="workload runs in parallel")
+    replay_parser.add_argument("--latency", default="recorded",
+                               help='"recorded", or ms per service or host, e.g. "openai=800,http=60,sql=20,all=0"')
+    replay_parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier for every delay")
+    replay_parser.add_argument("--jitter", type=float, default=0.0, help="random variation of each delay, e.g. 0.2")
+    replay_parser.add_argument("--warm", action="store_true", help="keep the response and query result caches on")
+    replay_parser.add_argument("--save", help="write the per-stage results to this JSON file")
+    replay_parser.add_argument("--baseline", help="compare against results saved earlier with --save")
+
+    for subparser in (record_parser, replay_parser):
+        subparser.add_argument("--cassette", default=DEFAULT_CASSETTE, help=f"defaults to {DEFAULT_CASSETTE}")
+        subparser.add_argument("--verbose", action="store_true", help="show the bot's console output")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        replay(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Compares the old and new GetGPInfo / GetCSInfo query shapes against a local SQLite stand-in database.
+
+The old shapes join the whole of each table and filter on the alias outside the UNION; the new shapes filter
+inside each branch with bound parameters. The stand-in keeps the same tables, keys and join structure as GP and
+ODS with synthetic rows, so the comparison shows the cost of the query shape rather than of SQL Server itself.
+
+    python bench_queries.py --tickets 50000 --lookups 200
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+
+OLD_GP_QUERY = """
+SELECT DISTINCT [Equipment Ticket], [Account Number], [Queue], [Item Number], [Serial Number], Tracking_Number
+FROM (
+    SELECT sop30300.SOPNUMBE AS 'Equipment Ticket', sop30200.CSTPONBR AS 'Account Number',
+           sop30200.BACHNUMB AS 'Queue', sop30300.ITEMNMBR AS 'Item Number', sop10201.SERLTNUM AS 'Serial Number',
+           sop10107.Tracking_Number
+    FROM sop30300
+    FULL JOIN sop30200 ON sop30200.SOPNUMBE = sop30300.SOPNUMBE
+    FULL JOIN sop10107 ON sop10107.SOPNUMBE = sop30300.SOPNUMBE
+    FULL JOIN sop10201 ON sop10201.ITEMNMBR = sop30300.ITEMNMBR AND sop10201.SOPNUMBE = sop30300.SOPNUMBE
+    FULL JOIN sop10200 ON sop30300.SOPNUMBE = sop10200.SOPNUMBE
+
+    UNION ALL
+
+    SELECT sop10100.SOPNUMBE, sop10100.CSTPONBR, sop10100.BACHNUMB, sop10200.ITEMNMBR, sop10201.SERLTNUM,
+           sop10107.Tracking_Number
+    FROM sop10100
+    FULL JOIN sop10200 ON sop10200.SOPNUMBE = sop10100.SOPNUMBE
+    FULL JOIN sop10201 ON sop10201.SOPNUMBE = sop10100.SOPNUMBE AND sop10201.ITEMNMBR = sop10200.ITEMNMBR
+    FULL JOIN sop10107 ON sop10107.SOPNUMBE = sop10100.SOPNUMBE
+) AS MASTER_GP_QUERY
+WHERE [Equipment Ticket] IN ('CW' || :ticket || '-1', :ticket)
+"""
+
+NEW_GP_QUERY = """
+SELECT DISTINCT [Equipment Ticket], [Account Number], [Queue], [Item Number], [Serial Number], Tracking_Number
+FROM (
+    SELECT sop30300.SOPNUMBE AS 'Equipment Ticket', sop30200.CSTPONBR AS 'Account Number',
+           sop30200.BACHNUMB AS 'Queue', sop30300.ITEMNMBR AS 'Item Number', sop10201.SERLTNUM AS 'Serial Number',
+           sop10107.Tracking_Number
+    FROM sop30300
+    LEFT JOIN sop30200 ON sop30200.SOPNUMBE = sop30300.SOPNUMBE
+    LEFT JOIN sop10107 ON sop10107.SOPNUMBE = sop30300.SOPNUMBE
+    LEFT JOIN sop10201 ON sop10201.ITEMNMBR = sop30300.ITEMNMBR AND sop10201.SOPNUMBE = sop30300.SOPNUMBE
+    WHERE sop30300.SOPNUMBE IN (:cw_ticket, :ticket)
+
+    UNION ALL
+
+    SELECT sop10100.SOPNUMBE, sop10100.CSTPONBR, sop10100.BACHNUMB, sop10200.ITEMNMBR, sop10201.SERLTNUM,
+           sop10107.Tracking_Number
+    FROM sop10100
+    LEFT JOIN sop10200 ON sop10200.SOPNUMBE = sop10100.SOPNUMBE
+    LEFT JOIN sop10201 ON sop10201.SOPNUMBE = sop10100.SOPNUMBE AND sop10201.ITEMNMBR = sop10200.ITEMNMBR
+    LEFT JOIN sop10107 ON sop10107.SOPNUMBE = sop10100.SOPNUMBE
+    WHERE sop10100.SOPNUMBE IN (:cw_ticket, :ticket)
+) AS MASTER_GP_QUERY
+"""
+
+OLD_CS_QUERY = """
+SELECT DISTINCT * FROM (
+    SELECT DISTINCT t.TICKET_ID AS 'Ticket', t.STATUS AS 'Status', a.NAME AS 'Assigned To', c.NAME AS 'Creator'
+    FROM TICKETS_CORE_VIEW t
+    FULL JOIN EMPLOYEES c ON c.EMPLOYEE_ID = t.LOGGED_BY
+    FULL JOIN EMPLOYEES a ON a.EMPLOYEE_ID = t.ASSIGNED_TO
+
+    UNION
+
+    SELECT DISTINCT t.TICKET_ID, CAST(t.TICKET_STATUS_ID AS TEXT), a.NAME, c.NAME
+    FROM CAN_TICKETS_CORE t
+    FULL JOIN EMPLOYEES c ON c.EMPLOYEE_ID = t.LOGGED_BY
+    FULL JOIN EMPLOYEES a ON a.EMPLOYEE_ID = t.ASSIGNED_TO
+) AS MASTER_CS_QUERY
+WHERE [Ticket] = :ticket
+"""
+
+NEW_CS_QUERY = """
+SELECT t.TICKET_ID AS 'Ticket', t.STATUS AS 'Status', a.NAME AS 'Assigned To', c.NAME AS 'Creator'
+FROM TICKETS_CORE_VIEW t
+LEFT JOIN EMPLOYEES c ON c.EMPLOYEE_ID = t.LOGGED_BY
+LEFT JOIN EMPLOYEES a ON a.EMPLOYEE_ID = t.ASSIGNED_TO
+WHERE t.TICKET_ID = :ticket
+
+UNION
+
+SELECT t.TICKET_ID, CAST(t.TICKET_STATUS_ID AS TEXT), a.NAME, c.NAME
+FROM CAN_TICKETS_CORE t
+LEFT JOIN EMPLOYEES c ON c.EMPLOYEE_ID = t.LOGGED_BY
+LEFT JOIN EMPLOYEES a ON a.EMPLOYEE_ID = t.ASSIGNED_TO
+WHERE t.TICKET_ID = :ticket
+"""
+
+
+def build_database(ticket_count, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE sop10100 (SOPNUMBE TEXT PRIMARY KEY, CSTPONBR TEXT, BACHNUMB TEXT);
+        CREATE TABLE sop10200 (SOPNUMBE TEXT, ITEMNMBR TEXT, QUANTITY REAL, PRIMARY KEY (SOPNUMBE, ITEMNMBR));
+        CREATE TABLE sop30200 (SOPNUMBE TEXT PRIMARY KEY, CSTPONBR TEXT, BACHNUMB TEXT);
+        CREATE TABLE sop30300 (SOPNUMBE TEXT, ITEMNMBR TEXT, QUANTITY REAL, PRIMARY KEY (SOPNUMBE, ITEMNMBR));
+        CREATE TABLE sop10201 (SOPNUMBE TEXT, ITEMNMBR TEXT, SERLTNUM TEXT);
+        CREATE INDEX sop10201_doc ON sop10201 (SOPNUMBE, ITEMNMBR);
+        CREATE TABLE sop10107 (SOPNUMBE TEXT, Tracking_Number TEXT);
+        CREATE INDEX sop10107_doc ON sop10107 (SOPNUMBE);
+        CREATE TABLE EMPLOYEES (EMPLOYEE_ID INTEGER PRIMARY KEY, NAME TEXT);
+        CREATE TABLE TICKETS_CORE_VIEW (TICKET_ID TEXT PRIMARY KEY, STATUS TEXT, LOGGED_BY INTEGER,
+                                        ASSIGNED_TO INTEGER);
+        CREATE TABLE CAN_TICKETS_CORE (TICKET_ID TEXT PRIMARY KEY, TICKET_STATUS_ID INTEGER, LOGGED_BY INTEGER,
+                                       ASSIGNED_TO INTEGER);
+    """)
+
+    tickets = []
+    for n in range(ticket_count):
+        ticket = str(3000000 + n)
+        tickets.append(ticket)
+        sopnumbe = f"CW{ticket}-1" if rng.random() < 0.5 else ticket
+        account = f"{rng.randrange(1000000, 9999999):08d}"
+        # Roughly one in ten documents is still open; the rest have moved to history
+        header, lines = ("sop10100", "sop10200") if n % 10 == 0 else ("sop30200", "sop30300")
+        conn.execute(f"INSERT INTO {header} VALUES (?, ?, ?)", (sopnumbe, account, rng.choice(["OPEN", "RDY TO INV"])))
+        for item in range(rng.randint(1, 4)):
+            item_number = f"ITEM-{item}"
+            conn.execute(f"INSERT INTO {lines} VALUES (?, ?, ?)", (sopnumbe, item_number, rng.randint(1, 5)))
+            conn.execute("INSERT INTO sop10201 VALUES (?, ?, ?)", (sopnumbe, item_number, f"SN{rng.getrandbits(40):x}"))
+        conn.execute("INSERT INTO sop10107 VALUES (?, ?)", (sopnumbe, f"1Z{rng.getrandbits(48):x}"))
+
+        if n % 2:
+            conn.execute("INSERT INTO TICKETS_CORE_VIEW VALUES (?, ?, ?, ?)",
+                         (ticket, "Open", rng.randrange(500), rng.randrange(500)))
+        else:
+            conn.execute("INSERT INTO CAN_TICKETS_CORE VALUES (?, ?, ?, ?)",
+                         (ticket, rng.randrange(5), rng.randrange(500), rng.randrange(500)))
+
+    conn.executemany("INSERT INTO EMPLOYEES VALUES (?, ?)", [(i, f"Employee {i}") for i in range(500)])
+    conn.commit()
+    return conn, tickets
+
+
+def time_query(conn, query, ticket_ids, params_for):
+    timings, results = [], []
+    for ticket in ticket_ids:
+        start = time.perf_counter()
+        rows = conn.execute(query, params_for(ticket)).fetchall()
+        timings.append(time.perf_counter() - start)
+        results.append(sorted(rows, key=repr))
+    return timings, results
+
+
+def report(name, timings):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * 0.95))]
+    print(f"  {name:<5} median {statistics.median(timings_ms):9.3f} ms   p95 {p95:9.3f} ms   "
+          f"total {sum(timings_ms):10.1f} ms")
+    return statistics.median(timings_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=20000, help="number of synthetic tickets to generate")
+    parser.add_argument("--lookups", type=int, default=50, help="number of ticket lookups to time per shape")
+    args = parser.parse_args()
+
+    print(f"Building stand-in database with {args.tickets} tickets (SQLite {sqlite3.sqlite_version}).")
+    conn, tickets = build_database(args.tickets)
+    lookups = random.Random(1).sample(tickets, min(args.lookups, len(tickets)))
+
+    cases = [
+        ("GetGPInfo", OLD_GP_QUERY, NEW_GP_QUERY, lambda t: {"ticket": t, "cw_ticket": f"CW{t}-1"}),
+        ("GetCSInfo", OLD_CS_QUERY, NEW_CS_QUERY, lambda t: {"ticket": t}),
+    ]
+    for name, old_query, new_query, params_for in cases:
+        print(f"{name} ({len(lookups)} lookups):")
+        old_timings, old_results = time_query(conn, old_query, lookups, params_for)
+        new_timings, new_results = time_query(conn, new_query, lookups, params_for)
+        old_median = report("old", old_timings)
+        new_median = report("new", new_timings)
+        print(f"  speedup {old_median / new_median:.1f}x, results identical: {old_results == new_results}")
+
+
+if __name__ == "__main__":
+    main()
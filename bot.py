@@ -1,14 +1,24 @@
 import os
 import json
 import re
-import datetime
+import time
+import threading
 import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 from openai import OpenAI, OpenAIError
 from dotenv import load_dotenv
 import pymssql
 from colorama import init, Fore, Style
 from TicketInfo import TicketAggregator
 from MSGraphAuthenticate import Authenticate, TeamsSearch
+from Database import sql_connection, BoundedQuery, SQL_MAX_ROWS
+from Cache import ResponseCache, QueryResultCache
+from PromptContext import build_context, select_relevant_messages, count_tokens
+from QueryTemplates import match_query_template, parse_search
+from GPIndex import GPIndex
+from ConversationMemory import ConversationMemory
+from Tracing import span, traced, annotate, record_tokens, start_trace
 
 # Initialize colorama
 init(autoreset=True)
@@ -19,6 +29,33 @@ load_dotenv()
 # OpenAI client
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 client = OpenAI(api_key=OPENAI_API_KEY)
+CHAT_MODEL = "gpt-4o-mini"
+
+# Most tokens the ticket and chat data may take up in a data question's prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 12000))
+
+# Teams messages that best match the question, and the neighbouring messages kept with each of them
+TEAMS_TOP_K = int(os.getenv('TEAMS_TOP_K', 30))
+TEAMS_CONTEXT_MESSAGES = int(os.getenv('TEAMS_CONTEXT_MESSAGES', 1))
+
+# Answers to data questions are reused while the prompt and the ticket and chat data are unchanged
+response_cache = ResponseCache(
+    os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db'),
+    memory_size=int(os.getenv('RESPONSE_CACHE_MEMORY_SIZE', 256)),
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', 86400)),
+    max_disk_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 5000)),
+)
+
+# Database search results are reused for the same SQL until they expire or the user asks for a refresh
+query_result_cache = QueryResultCache(
+    ttl=int(os.getenv('QUERY_CACHE_TTL', 300)),
+    max_entries=int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 128)),
+    max_bytes=int(os.getenv('QUERY_CACHE_MAX_BYTES', 20_000_000)),
+)
+
+# Plain searches by serial, account, item, customer or tracking number are answered from a local copy of GP
+GP_INDEX_ENABLED = os.getenv('GP_INDEX_ENABLED', 'true').lower() not in ('false', '0', 'no')
+gp_index = None
 
 # SQL server connection details
 GP_SERVER = os.getenv('GP_SERVER')
@@ -63,13 +100,78 @@ LEFT JOIN spv3SalesDocument ON spv3SalesDocument.Sales_Doc_Num = COALESCE(sop101
 WHERE COALESCE(SOP10100.SOPTYPE, SOP30300.SOPTYPE) in (1, 2)
 """
 
+# Print a per-stage timing and token breakdown after each console prompt
+TRACE_PROMPTS = os.getenv('TRACE_PROMPTS', 'false').lower() in ('true', '1', 'yes')
+
+# Print responses as they are generated rather than once they are complete
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() not in ('false', '0', 'no')
+
 # Regex patterns
 ticket_pattern = re.compile(r'\b(?:CW)?(?:[1-9]\d{5,8})(?:[.-]\d+)?\b', re.IGNORECASE)
 account_pattern = re.compile(r'\b\d{7,8}\b')
 
-# Initialize conversation history and contextual ticket numbers
-conversation_history = []
-last_ticket_number = None  # Track last ticket number for follow-up reference
+# Patterns for the local intent classifier, which settles obvious prompts without an LLM call
+lookup_question_pattern = re.compile(
+    r'\b(?:what|which)\s+tickets?\b|\b(?:find|search|look\s*up|list|show)\b.{0,30}\btickets\b', re.IGNORECASE)
+search_field_pattern = re.compile(r'\b(?:serial|s/?n|account|acct|item|part|customer|tracking|project|queue)s?\b',
+                                  re.IGNORECASE)
+bare_ticket_pattern = re.compile(
+    r'^\s*(?P<prefix>(?:ticket\s*#?\s*)?CW\s*|ticket\s*#?\s*)?(?P<number>[1-9]\d{5,8})(?P<suffix>[.-]\d+)?\s*[?.!]?\s*$',
+    re.IGNORECASE)
+ticket_question_pattern = re.compile(r'\b(?:status|eta|update|notes|summary|summarize)\b|\bticket\s*#?\s*(?:CW\s*)?\d|'
+                                     r'\bCW\s*\d', re.IGNORECASE)
+ticket_reference_pattern = re.compile(r'\b(?:that|this|the|same)\s+ticket\b', re.IGNORECASE)
+# Asking for fresh results skips the query result cache
+refresh_pattern = re.compile(r'\b(?:refresh(?:ed)?|reload|re-?run|up[\s-]to[\s-]date|right\s+now)\b', re.IGNORECASE)
+small_talk_pattern = re.compile(
+    r'^\s*(?:(?:thanks?|thank\s+you|thx|ty|ok(?:ay)?|cool|great|perfect|awesome|nice|got\s+it|sounds\s+good|'
+    r'appreciate\s+it|hi|hello|hey|good\s+(?:morning|afternoon|evening)|bye|goodbye)[\s,]*)+'
+    r'(?:so\s+much|a\s+lot|again|there)?[\s!.,]*$',
+    re.IGNORECASE)
+
+# How often prompts were classified locally versus by the LLM
+intent_counters = Counter()
+# Database searches answered from the local GP index, from a query template, or by generating SQL with the LLM
+query_counters = Counter()
+
+# Counters are updated from every session's thread
+counters_lock = threading.Lock()
+
+# MS Graph authentication is shared across requests so the access token stays cached in memory
+teams_auth = None
+# Guards creating the shared MS Graph authenticator and GP index, which sessions may first need at the same time
+shared_init_lock = threading.Lock()
+
+# Each session keeps its latest messages verbatim and folds older ones into a summary written in the background
+CONVERSATION_MAX_MESSAGES = int(os.getenv('CONVERSATION_MAX_MESSAGES', 6))
+CONVERSATION_SUMMARY_BATCH = int(os.getenv('CONVERSATION_SUMMARY_BATCH', 6))
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+
+class BotSession:
+    """
+    Conversation state for one user: the recent messages and the ticket under discussion. A session handles one
+    prompt at a time; everything else (caches, connection pools, the GP index) is shared by all sessions.
+    """
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.history = ConversationMemory(max_messages=CONVERSATION_MAX_MESSAGES,
+                                          fold_batch=CONVERSATION_SUMMARY_BATCH, summarize=summarize_conversation,
+                                          executor=summary_executor, ticket_pattern=ticket_pattern,
+                                          normalize_ticket=normalize_ticket_number)
+        self.last_ticket_number = None  # Track last ticket number for follow-up reference
+        self.lock = threading.Lock()
+        self.last_active = time.time()
+
+    def remember_ticket(self, text):
+        """Makes the first ticket number in `text`, if any, the ticket under discussion."""
+        match = ticket_pattern.search(text)
+        if match:
+            self.last_ticket_number = normalize_ticket_number(match.group())
+
+    def recent_history(self):
+        return self.history.recent_history()
 
 
 def print_token_usage(response):
@@ -86,14 +188,110 @@ def print_token_usage(response):
         print("Token usage data not found in the response.")
 
 
-def determine_context(prompt):
+def _complete(messages, stream=None, model=CHAT_MODEL):
+    """
+    Runs a chat completion and returns the stripped response text. If `stream` is given, the completion is
+    streamed and each piece of text is passed to it as it arrives.
+
+    Each call is recorded as an "llm" span with its token usage. Streamed completions don't report usage, so
+    their tokens are counted locally.
+    """
+    with span("llm", model=model) as llm_span:
+        if stream is None:
+            chat_completion = client.chat.completions.create(messages=messages, model=model)
+            # print_token_usage(chat_completion)
+            if chat_completion.usage:
+                record_tokens(chat_completion.usage.prompt_tokens, chat_completion.usage.completion_tokens)
+            return chat_completion.choices[0].message.content.strip()
+
+        pieces = []
+        for chunk in client.chat.completions.create(messages=messages, model=model, stream=True):
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if not pieces:
+                    llm_span.attributes["first_token_s"] = round(time.perf_counter() - llm_span.start, 3)
+                pieces.append(text)
+                stream(text)
+        response = "".join(pieces)
+        record_tokens(sum(count_tokens(message["content"], model) for message in messages),
+                      count_tokens(response, model), estimated=True)
+        return response.strip()
+
+
+class StreamWrapper:
+    """
+    Word-wraps streamed text to `width` columns as it arrives, laying it out exactly as textwrap.wrap does for the
+    complete text. Each word is written once the whitespace after it has arrived, by wrapping the text since the
+    start of the current line again with textwrap. `prefix` is written before the first piece of text.
+    """
+
+    def __init__(self, write, width=100, prefix=""):
+        self.write_out = write
+        self.width = width
+        self.prefix = prefix
+        self.started = False
+        self.text = ""  # Text from the start of a line, with whitespace turned to spaces the way textwrap does
+        self.tab_column = 0  # Column used to expand tabs, which like str.expandtabs restarts after line breaks
+        self.lines_written = 0  # Lines of `text` written in full
+        self.line_written = 0  # Characters written of the line after those
+
+    def write(self, text):
+        if not self.started:
+            self.started = True
+            if self.prefix:
+                self.write_out(self.prefix)
+        for char in text:
+            if char == "\t":
+                spaces = 8 - self.tab_column % 8
+                self.text += " " * spaces
+                self.tab_column += spaces
+            elif char in "\n\r":
+                self.text += " "
+                self.tab_column = 0
+            else:
+                self.text += " " if char in "\x0b\x0c" else char
+                self.tab_column += 1
+        # Only words followed by whitespace are complete; the last one may still grow or be hyphen-split differently
+        word_start = self.text.rfind(" ", 0, len(self.text.rstrip(" "))) + 1
+        if word_start > 0:
+            self.emit(self.text[:word_start])
+
+    def emit(self, text):
+        """Writes what is new in textwrap's layout of `text`, all of whose lines but the last are final."""
+        lines = textwrap.wrap(text, width=self.width)
+        for index in range(self.lines_written, len(lines)):
+            self.write_out(lines[index][self.line_written:])
+            if index < len(lines) - 1:
+                self.write_out("\n")
+                self.line_written = 0
+            else:
+                self.line_written = len(lines[index])
+        self.lines_written = max(self.lines_written, len(lines) - 1)
+
+        # Start again from the last line when it begins a word, so only the current line is wrapped next time
+        if len(lines) > 1:
+            position = 0
+            for line in lines:
+                position = text.find(line, position)
+                line_start, position = position, position + len(line)
+            if line_start > 0 and text[line_start - 1] == " ":
+                self.text = self.text[line_start:]
+                self.lines_written = 0
+
+    def close(self):
+        if self.started:
+            self.emit(self.text)
+            self.write_out("\n")
+
+
+def determine_context(prompt, session=None):
     """
     Determines the context of the user prompt: 'chat', 'ticket', or 'database_search'.
     """
     # Gather recent conversation history (last 6 messages)
-    recent_history = ""
-    for entry in conversation_history[-6:]:
-        recent_history += f"{entry['role']}: {entry['content']}\n"
+    recent_history = (session or console_session).recent_history()
 
     context_prompt = f"""
 You are an internal assistant for Granite Telecommunications, helping with ticket inquiries and database searches.
@@ -122,15 +320,9 @@ Do not include any quotes or additional text in your response.
 """
     try:
         print("Determining context.")
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": context_prompt},
-            ],
-            model="gpt-4o-mini",
-        )
-        # print_token_usage(chat_completion)
-
-        gpt_response = chat_completion.choices[0].message.content.strip().lower()
+        gpt_response = _complete([
+            {"role": "system", "content": context_prompt},
+        ]).lower()
         gpt_response = gpt_response.strip("'\"").strip()
         return gpt_response
 
@@ -139,6 +331,77 @@ Do not include any quotes or additional text in your response.
         return "chat"  # Default to general chat in case of an error
 
 
+def classify_intent_locally(prompt, session=None):
+    """
+    Classifies prompts whose intent is obvious from their shape: a bare ticket number, a "what ticket is serial X on"
+    style search, small talk, or a question about "that ticket" after one has been discussed. Returns 'chat',
+    'ticket' or 'database_search', or None when the prompt needs the LLM.
+    """
+    text = prompt.strip()
+    if not text:
+        return None
+
+    if small_talk_pattern.match(text):
+        return 'chat'
+
+    if lookup_question_pattern.search(text) and (search_field_pattern.search(text) or not (
+            ticket_pattern.search(text) or ticket_reference_pattern.search(text))):
+        return 'database_search'
+
+    # 7 and 8 digit numbers may be account numbers, so only trust those when the prompt is about a ticket
+    bare_match = bare_ticket_pattern.match(text)
+    if bare_match and (bare_match.group('prefix') or bare_match.group('suffix') or
+                       len(bare_match.group('number')) not in (7, 8)):
+        return 'ticket'
+
+    ticket_match = ticket_pattern.search(text)
+    if ticket_match and not search_field_pattern.search(text):
+        if len(normalize_ticket_number(ticket_match.group())) not in (7, 8):
+            return 'ticket'
+        # "What ticket is 3807975 on" looks up an account, not ticket 3807975
+        if lookup_question_pattern.search(text):
+            return 'database_search'
+        if ticket_question_pattern.search(text):
+            return 'ticket'
+
+    # A follow-up about the ticket already under discussion
+    if (session or console_session).last_ticket_number and not ticket_match and not account_pattern.search(text) and \
+            ticket_reference_pattern.search(text) and not lookup_question_pattern.search(text):
+        return 'ticket'
+
+    return None
+
+
+@traced("intent")
+def classify_intent(prompt, session=None):
+    """
+    Returns the intent for a prompt, from the local classifier when it is confident and from the LLM otherwise.
+    """
+    intent = classify_intent_locally(prompt, session)
+    if intent:
+        increment_counter(intent_counters, 'local')
+        annotate(classifier='local', intent=intent)
+        return intent
+    increment_counter(intent_counters, 'llm')
+    intent = determine_context(prompt, session)
+    annotate(classifier='llm', intent=intent)
+    return intent
+
+
+def increment_counter(counters, name):
+    with counters_lock:
+        counters[name] += 1
+
+
+def intent_stats():
+    """
+    Returns the number of prompts classified locally and by the LLM, and the share handled locally.
+    """
+    total = intent_counters['local'] + intent_counters['llm']
+    hit_rate = intent_counters['local'] / total if total else 0.0
+    return {"local": intent_counters['local'], "llm": intent_counters['llm'], "local_hit_rate": round(hit_rate, 3)}
+
+
 def normalize_ticket_number(ticket_num):
     ticket_str = str(ticket_num).strip()
     ticket_str = re.sub(r'^CW', '', ticket_str, flags=re.IGNORECASE)
@@ -146,14 +409,14 @@ def normalize_ticket_number(ticket_num):
     return ticket_str
 
 
-def get_recent_ticket_number():
+def get_recent_ticket_number(session=None):
     """
     Return the most recent ticket number based on last_ticket_number for direct reference.
     """
-    global last_ticket_number
-    return last_ticket_number
+    return (session or console_session).last_ticket_number
 
 
+@traced("sql.generate")
 def generate_sql_query(prompt):
     """
     Generates an SQL query based on the user's prompt and the base SQL query using GPT.
@@ -206,16 +469,11 @@ Important Instructions:
 
     try:
         print("Generating SQL query.")
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system",
-                 "content": "You are an assistant that generates SQL queries to help users retrieve information from the database."},
-                {"role": "user", "content": query_prompt}
-            ],
-            model="gpt-4o-mini",
-        )
-#         print_token_usage(chat_completion)
-        response_content = chat_completion.choices[0].message.content.strip()
+        response_content = _complete([
+            {"role": "system",
+             "content": "You are an assistant that generates SQL queries to help users retrieve information from the database."},
+            {"role": "user", "content": query_prompt}
+        ])
         # print(f"GPT Response:\n{response_content}")  # Add this line to debug
         sql_code_match = re.search(r'```sql\n(.*?)\n```', response_content, re.DOTALL | re.IGNORECASE)
         if sql_code_match:
@@ -229,9 +487,81 @@ Important Instructions:
         return None
 
 
-def execute_query(sql_query):
+def get_gp_index():
+    """
+    Returns the shared local GP index, creating it on first use.
+    """
+    global gp_index
+    with shared_init_lock:
+        if gp_index is None:
+            gp_index = GPIndex(
+                os.getenv('GP_INDEX_PATH', 'gp_index.db'),
+                lambda: sql_connection(host=GP_SERVER, user=GRT_USER, password=GRT_PASS, database=GP_DATABASE,
+                                       tds_version="7.0"),
+                base_gp_query,
+                sync_interval=int(os.getenv('GP_INDEX_SYNC_INTERVAL', 300)),
+                full_sync_interval=int(os.getenv('GP_INDEX_FULL_SYNC_INTERVAL', 86400)),
+            )
+        return gp_index
+
+
+@traced("gp_index.search")
+def search_gp_index(prompt):
+    """
+    Answers a plain lookup from the local GP index. Returns None when the index is disabled or not yet built, the
+    request isn't a plain lookup, or nothing matched (the index may be a few minutes behind GP), so the caller
+    queries GP instead.
+    """
+    if not GP_INDEX_ENABLED:
+        return None
+    search = parse_search(prompt)
+    if search is None:
+        return None
+    try:
+        rows = get_gp_index().search(*search, limit=SQL_MAX_ROWS)
+    except Exception as e:
+        print(f"Error searching the local GP index: {e}")
+        return None
+    if not rows:
+        return None
+    increment_counter(query_counters, 'index')
+    print("Answered from the local GP index.")
+    return rows
+
+
+def build_sql_query(prompt):
+    """
+    Returns (sql, params) for a database search. Plain lookups by serial, account, item, customer or tracking
+    number are filled into a query template locally; anything else is written by the LLM, with no params.
+    """
+    template = match_query_template(prompt, base_gp_query)
+    if template:
+        increment_counter(query_counters, 'template')
+        print("Using a query template.")
+        return template
+    increment_counter(query_counters, 'llm')
+    return generate_sql_query(prompt), None
+
+
+def query_stats():
+    """
+    Returns the number of database searches answered from the local GP index, from query templates and with
+    LLM-written SQL, and the share that needed no LLM call.
+    """
+    total = query_counters['index'] + query_counters['template'] + query_counters['llm']
+    hit_rate = (query_counters['index'] + query_counters['template']) / total if total else 0.0
+    return {"index": query_counters['index'], "template": query_counters['template'], "llm": query_counters['llm'],
+            "local_hit_rate": round(hit_rate, 3)}
+
+
+@traced("sql.execute")
+def execute_query(sql_query, params=None, refresh=False):
     """
-    Executes the provided SQL query against the configured SQL Server and returns the results.
+    Executes the provided SQL query against the configured SQL Server and returns the results. `params` fill the
+    query's %s placeholders, so values are never pasted into the SQL text.
+
+    Results are cached by the normalized SQL and params for QUERY_CACHE_TTL seconds; `refresh` skips the cached
+    result and replaces it with a fresh one.
     """
     try:
         print("Executing SQL query.")
@@ -243,24 +573,24 @@ def execute_query(sql_query):
         if sql_query.strip().endswith(','):
             return "Invalid SQL query: The query appears to be incomplete."
 
-        with pymssql.connect(GP_SERVER, GRT_USER, GRT_PASS, GP_DATABASE, tds_version="7.0") as conn:
-            with conn.cursor(as_dict=True) as cursor:
-                if "TOP" not in sql_query.upper():
-                    sql_query = sql_query.replace("SELECT DISTINCT", "SELECT DISTINCT TOP 100", 1)
-                cursor.execute(sql_query)
-                results = cursor.fetchall()
-
-                if not results:
-                    return "No data found."
-
-                for row in results:
-                    for key, value in row.items():
-                        if isinstance(value, datetime.datetime):
-                            row[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                        elif isinstance(value, datetime.date):
-                            row[key] = value.strftime('%Y-%m-%d')
-
-                return results
+        cache_key = query_result_cache.make_key(sql_query, params)
+        results = None if refresh else query_result_cache.get(cache_key)
+        if results is not None:
+            print("Using cached query results.")
+            annotate(cached=True)
+        else:
+            with sql_connection(host=GP_SERVER, user=GRT_USER, password=GRT_PASS, database=GP_DATABASE,
+                                tds_version="7.0") as conn:
+                query = BoundedQuery(conn, sql_query, params)
+                results = list(query)
+            if query.truncated:
+                print(f"Query results capped at {query.rows} rows ({query.truncated} limit reached).")
+            query_result_cache.put(cache_key, results)
+        annotate(rows=len(results))
+
+        if not results:
+            return "No data found."
+        return results
 
     except pymssql.DatabaseError as e:
         return f"SQL execution error: {str(e)}"
@@ -268,6 +598,7 @@ def execute_query(sql_query):
         return f"Unexpected error during SQL execution: {str(e)}"
 
 
+@traced("teams.summarize")
 def summarize_chat_data(chat_data):
     """
     Summarizes the chat data using GPT.
@@ -281,15 +612,10 @@ You are a helpful assistant. Summarize the following Microsoft Teams chat data r
 
 Provide a concise summary highlighting the key discussions and any important messages. Use bullet points where appropriate. Do not include any unnecessary information.
 """
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that summarizes chat data."},
-                {"role": "user", "content": prompt},
-            ],
-            model="gpt-4o-mini",
-        )
-#         print_token_usage(chat_completion)
-        summary = chat_completion.choices[0].message.content.strip()
+        summary = _complete([
+            {"role": "system", "content": "You are a helpful assistant that summarizes chat data."},
+            {"role": "user", "content": prompt},
+        ])
         return summary
     except OpenAIError as e:
         return f"Error summarizing chat data: {str(e)}"
@@ -297,30 +623,47 @@ Provide a concise summary highlighting the key discussions and any important mes
         return f"Unexpected error in summarize_chat_data: {str(e)}"
 
 
-def get_ticket_info(ticket_num, user_prompt):
+def get_teams_auth():
+    """
+    Returns the shared MS Graph authenticator, creating it on first use.
+    """
+    global teams_auth
+    with shared_init_lock:
+        if teams_auth is None:
+            teams_auth = Authenticate()
+        return teams_auth
+
+
+@traced("ticket")
+def get_ticket_info(ticket_num, user_prompt, stream=None):
     """
     Retrieves detailed information for a specific ticket, including data from MS Teams, and returns a response to the user's prompt.
+    If `stream` is given, the response is also passed to it piece by piece as it is generated.
     """
     try:
         print(f"Fetching ticket information for ticket number: {ticket_num}")
-        aggregator = TicketAggregator(ticket_num)
-        ticket_data = aggregator.aggregate_data()  # Retrieve the aggregated data
-        # print(f"Ticket Data Retrieved: {ticket_data}")
+        # The aggregator queries its sources in the background while the Teams search runs
+        aggregator = TicketAggregator(ticket_num, concurrent=True)
 
         # Retrieve MS Teams chat data
-        auth_instance = Authenticate()
-        teams_search = TeamsSearch(auth_instance)
-        chat_data = teams_search.get_conversations(search_term=ticket_num)
+        with span("teams.search"):
+            teams_search = TeamsSearch(get_teams_auth())
+            chat_data = teams_search.get_conversations(search_term=ticket_num)
         # print(f"Chat Data Retrieved: {chat_data}")
 
-        # Prepare the data for the final prompt, clearly separating chat data
+        with span("ticket.aggregate"):
+            ticket_data = aggregator.aggregate_data()  # Retrieve the aggregated data
+        # print(f"Ticket Data Retrieved: {ticket_data}")
+
+        # Prepare the data for the final prompt, clearly separating chat data. Both are passed as structures and
+        # serialized once when the prompt is built.
         data = {
-            "ticket_data": str(ticket_data),
-            "ms_teams_chat_data": str(chat_data)  # Explicitly labeled for clarity
+            "ticket_data": ticket_data,
+            "ms_teams_chat_data": chat_data  # Explicitly labeled for clarity
         }
 
         # Send both data sets to respond_to_prompt_with_data
-        response = respond_to_prompt_with_data(user_prompt, data)
+        response = respond_to_prompt_with_data(user_prompt, data, stream=stream)
         return response
 
     except Exception as e:
@@ -328,17 +671,41 @@ def get_ticket_info(ticket_num, user_prompt):
         return "There was an error fetching the ticket information. Please try again later."
 
 
-def respond_to_prompt_with_data(prompt, data):
+@traced("respond")
+def respond_to_prompt_with_data(prompt, data, stream=None):
     """
     Provides a response to the user's prompt using the data provided, focusing on MS Teams chat data if requested.
+    If `stream` is given, the response is also passed to it piece by piece as it is generated.
+
+    Only the Teams messages most relevant to the prompt are kept, with their thread context. The data is then
+    serialized compactly, deduplicated across sources and trimmed to PROMPT_TOKEN_BUDGET tokens.
+    Responses are cached by model, normalized prompt and a fingerprint of the data, so repeating a question about
+    unchanged data is answered from the cache.
     """
     try:
         if not data:
             return "No data available to provide an answer."
 
-        # Prepare ticket data JSON and full MS Teams chat
-        ticket_data_json = json.dumps(data.get('ticket_data', {}), indent=2)
-        ms_teams_chat_data = json.dumps(data.get('ms_teams_chat_data', {}), indent=2)
+        with span("context.build") as context_span:
+            chat_data = select_relevant_messages(data.get('ms_teams_chat_data'), prompt, top_k=TEAMS_TOP_K,
+                                                 context=TEAMS_CONTEXT_MESSAGES)
+            context = build_context(data.get('ticket_data', {}), chat_data, budget=PROMPT_TOKEN_BUDGET,
+                                    model=CHAT_MODEL)
+            context_span.attributes["tokens"] = context['tokens']
+        if context['trimmed']:
+            print(f"Trimmed prompt data to {context['tokens']} tokens ({', '.join(context['trimmed'])}).")
+
+        cache_key = response_cache.make_key(CHAT_MODEL, prompt,
+                                            [context['ticket_data'], context['ms_teams_chat_data']])
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            annotate(cached=True)
+            if stream:
+                stream(cached_response)
+            return cached_response
+
+        ticket_data_json = context['ticket_data']
+        ms_teams_chat_data = context['ms_teams_chat_data']
 
         # Generate the response with full MS Teams chat data included
         final_prompt = f"""
@@ -347,7 +714,8 @@ def respond_to_prompt_with_data(prompt, data):
         Here is the ticket data:
         {ticket_data_json}
 
-        Here is the complete Microsoft Teams chat data:
+        Here is the relevant Microsoft Teams chat data, as a list of threads (best match first), each a list of
+        "time sender: message" lines:
         {ms_teams_chat_data}
 
         All of the above Microsoft Teams chat data is relevant to the user request. Use it directly in your response as needed.
@@ -362,16 +730,13 @@ def respond_to_prompt_with_data(prompt, data):
         - Answer directly and concisely in complete sentences, in a clear and understandable manner.
         """
 
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system",
-                 "content": "You are a helpful assistant that uses the provided data to answer questions."},
-                {"role": "user", "content": final_prompt},
-            ],
-            model="gpt-4o-mini",
-        )
-#         print_token_usage(chat_completion)
-        assistant_response = chat_completion.choices[0].message.content.strip()
+        assistant_response = _complete([
+            {"role": "system",
+             "content": "You are a helpful assistant that uses the provided data to answer questions."},
+            {"role": "user", "content": final_prompt},
+        ], stream=stream)
+        if assistant_response:
+            response_cache.put(cache_key, assistant_response)
         return assistant_response
 
     except OpenAIError as e:
@@ -380,19 +745,16 @@ def respond_to_prompt_with_data(prompt, data):
         return f"Unexpected error: {str(e)}"
 
 
-def generate_chat_response(prompt):
+@traced("chat")
+def generate_chat_response(prompt, stream=None, session=None):
     """
-    Generates a general chat response using GPT.
+    Generates a general chat response using GPT, passing it to `stream` piece by piece if given.
     """
     try:
         print("Generating chat response.")
 
         # Include the most recent conversation history (limit to last 6 messages)
-        history_text = ''
-        for entry in conversation_history[-6:]:
-            role = entry['role']
-            content = entry['content']
-            history_text += f"{role}: {content}\n"
+        history_text = (session or console_session).recent_history()
 
         chat_prompt = f"""
 You are an internal assistant at a telecommunications company, communicating with a colleague.
@@ -414,19 +776,13 @@ Instructions:
 - Use language appropriate for internal communication between colleagues.
 - Use full sentences unless the user requests otherwise.
 """
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an internal assistant at Granite Telecommunications, communicating with a colleague.",
-                },
-                {"role": "user", "content": chat_prompt},
-            ],
-            model="gpt-4o-mini",
-        )
-#         print_token_usage(chat_completion)
-
-        assistant_response = chat_completion.choices[0].message.content.strip()
+        assistant_response = _complete([
+            {
+                "role": "system",
+                "content": "You are an internal assistant at Granite Telecommunications, communicating with a colleague.",
+            },
+            {"role": "user", "content": chat_prompt},
+        ], stream=stream)
         return assistant_response
 
     except OpenAIError as e:
@@ -435,92 +791,144 @@ Instructions:
         return f"Unexpected error in generate_chat_response: {str(e)}"
 
 
-def process_user_prompt(prompt):
-    global last_ticket_number
+@traced("conversation.summary")
+def summarize_conversation(summary, records):
+    """
+    Folds older conversation messages into the running summary of a session, keeping the tickets, accounts,
+    serials and decisions that later questions may refer back to. Summaries are cached like other responses.
+    """
+    messages = "\n".join(f"{record.role}: {record.content}" for record in records)
+    summary_prompt = f"""
+Update the running summary of a conversation between a coworker and an internal ticket assistant.
+
+Current summary:
+{summary or "(none yet)"}
+
+Messages to add:
+{messages}
+
+Instructions:
+- Keep every ticket, account, serial and item number mentioned, and what was asked or found about each.
+- Drop small talk and details that later questions are unlikely to need.
+- Respond with the updated summary only, in plain text, under 150 words.
+"""
+    cache_key = response_cache.make_key(CHAT_MODEL, summary_prompt, None)
+    cached_summary = response_cache.get(cache_key)
+    if cached_summary is not None:
+        return cached_summary
+    new_summary = _complete([
+        {"role": "system", "content": "You summarize conversations concisely."},
+        {"role": "user", "content": summary_prompt},
+    ])
+    response_cache.put(cache_key, new_summary)
+    return new_summary
+
+
+# The console REPL's session
+console_session = BotSession()
 
-    # Determine context with GPT
-    intent = determine_context(prompt)
-    conversation_history.append({"role": "user", "content": prompt})
+
+def process_user_prompt(prompt, stream=None, session=None, return_trace=False):
+    """
+    Handles one user prompt and returns the response wrapped to 100 columns. If `stream` is given, LLM-generated
+    responses are also passed to it piece by piece as they are generated; fixed responses and errors are only
+    returned. `session` holds the user's conversation state (the console's session if not given); prompts in
+    the same session are handled one at a time. With `return_trace`, returns (response, trace), the trace being
+    the timing and token breakdown of this prompt.
+    """
+    session = session or console_session
+    with session.lock:
+        session.last_active = time.time()
+        with start_trace("prompt") as trace:
+            response = handle_prompt(prompt, stream, session)
+        if TRACE_PROMPTS:
+            print(trace.report())
+        return (response, trace) if return_trace else response
+
+
+def handle_prompt(prompt, stream, session):
+    history = session.history
+
+    # Determine context locally when the prompt is unambiguous, otherwise with GPT
+    intent = classify_intent(prompt, session)
+    history.add("user", prompt)
 
     print(f"Detected Intent: {intent}")
 
     # Extract ticket number from user prompt
-    match = ticket_pattern.search(prompt)
-    if match:
-        last_ticket_number = normalize_ticket_number(match.group())
+    session.remember_ticket(prompt)
 
     if intent == 'ticket':
-        if last_ticket_number:
+        if session.last_ticket_number:
             # Fetch and return detailed ticket information
-            ticket_info = get_ticket_info(last_ticket_number, prompt)
-            conversation_history.append({"role": "assistant", "content": ticket_info})
+            ticket_info = get_ticket_info(session.last_ticket_number, prompt, stream=stream)
+            history.add("assistant", ticket_info)
 
             # Extract any ticket numbers from the bot response and update `last_ticket_number`
-            response_ticket_match = ticket_pattern.search(ticket_info)
-            if response_ticket_match:
-                last_ticket_number = normalize_ticket_number(response_ticket_match.group())
+            session.remember_ticket(ticket_info)
 
             return '\n'.join(textwrap.wrap(ticket_info, width=100))
         else:
             # Ask user to specify a ticket number if none was found
             bot_response = "Could you please specify the ticket number?"
-            conversation_history.append({"role": "assistant", "content": bot_response})
+            history.add("assistant", bot_response)
             return bot_response
 
     if intent == 'database_search':
-        account_match = account_pattern.search(prompt)
-        if account_match:
-            account_num = account_match.group()
-            sql_query = generate_sql_query(f"Find open tickets under account number {account_num}")
-        else:
-            sql_query = generate_sql_query(prompt)
+        refresh = bool(refresh_pattern.search(prompt))
+        query_results = None if refresh else search_gp_index(prompt)
+        if query_results is None:
+            sql_query, sql_params = build_sql_query(prompt)
 
-        if not sql_query:
-            bot_response = "I'm sorry, I couldn't generate a query based on your request."
-            conversation_history.append({"role": "assistant", "content": bot_response})
-            return bot_response
+            if not sql_query:
+                bot_response = "I'm sorry, I couldn't generate a query based on your request."
+                history.add("assistant", bot_response)
+                return bot_response
 
-        query_results = execute_query(sql_query)
+            query_results = execute_query(sql_query, sql_params, refresh=refresh)
         if isinstance(query_results, str):
             response = query_results
         else:
             data = {
                 "ticket_data": query_results
             }
-            response = respond_to_prompt_with_data(prompt, data)
+            response = respond_to_prompt_with_data(prompt, data, stream=stream)
 
             # Update `last_ticket_number` with the first valid ticket found in query results
             for row in query_results:
                 if 'Equipment Ticket' in row and validate_ticket_number(row['Equipment Ticket']):
-                    last_ticket_number = normalize_ticket_number(row['Equipment Ticket'])
+                    session.last_ticket_number = normalize_ticket_number(row['Equipment Ticket'])
                     break
 
         # Extract any ticket numbers from the bot response and update `last_ticket_number`
-        response_ticket_match = ticket_pattern.search(response)
-        if response_ticket_match:
-            last_ticket_number = normalize_ticket_number(response_ticket_match.group())
+        session.remember_ticket(response)
 
-        conversation_history.append({"role": "assistant", "content": response})
+        history.add("assistant", response)
         return '\n'.join(textwrap.wrap(response, width=100))
 
     elif intent == 'chat':
-        chat_response = generate_chat_response(prompt)
-        conversation_history.append({"role": "assistant", "content": chat_response})
+        chat_response = generate_chat_response(prompt, stream=stream, session=session)
+        history.add("assistant", chat_response)
 
         # Check for ticket numbers in the chat response, just in case
-        response_ticket_match = ticket_pattern.search(chat_response)
-        if response_ticket_match:
-            last_ticket_number = normalize_ticket_number(response_ticket_match.group())
+        session.remember_ticket(chat_response)
 
         return '\n'.join(textwrap.wrap(chat_response, width=100))
 
     else:
         # Default response if intent is unclear
         bot_response = "I'm not sure how to assist with that request. Could you please provide more details?"
-        conversation_history.append({"role": "assistant", "content": bot_response})
+        history.add("assistant", bot_response)
         return bot_response
 
 
+def print_stats():
+    print(f"Intent classification: {intent_stats()}")
+    print(f"Database queries: {query_stats()}")
+    print(f"Response cache: {response_cache.stats()}")
+    print(f"Query result cache: {query_result_cache.stats()}")
+
+
 def validate_ticket_number(ticket_num):
     """
     Checks if the provided ticket number matches the expected ticket format.
@@ -530,18 +938,38 @@ def validate_ticket_number(ticket_num):
 
 
 def main():
-    global conversation_history, last_ticket_number
-    conversation_history = []
-    last_ticket_number = None
     while True:
         try:
             user_prompt = input(Style.BRIGHT + Fore.LIGHTRED_EX + 'UserPrompt: ' + Style.RESET_ALL)
             if user_prompt.lower() in ["exit", "quit"]:
+                print_stats()
                 print("Exiting GraniteBot as per user request.")
                 break
-            result = process_user_prompt(user_prompt)
-            print(
-                Style.BRIGHT + Fore.LIGHTBLUE_EX + 'GraniteBot: ' + Style.RESET_ALL + Fore.LIGHTCYAN_EX + result + Style.RESET_ALL)
+            if not STREAM_RESPONSES:
+                result = process_user_prompt(user_prompt)
+                print(
+                    Style.BRIGHT + Fore.LIGHTBLUE_EX + 'GraniteBot: ' + Style.RESET_ALL + Fore.LIGHTCYAN_EX + result + Style.RESET_ALL)
+                continue
+
+            # Print the response as it is generated; responses that weren't generated are printed once returned
+            wrapper = StreamWrapper(lambda text: print(Fore.LIGHTCYAN_EX + text, end='', flush=True), width=100,
+                                    prefix=Style.BRIGHT + Fore.LIGHTBLUE_EX + 'GraniteBot: ' + Style.RESET_ALL)
+            streamed = []
+
+            def write(text):
+                streamed.append(text)
+                wrapper.write(text)
+
+            result = process_user_prompt(user_prompt, stream=write)
+            if not wrapper.started:
+                wrapper.write(result)
+                wrapper.close()
+            elif result.split() != "".join(streamed).split():
+                # The stream failed part way; the error returned in its place goes on a line of its own
+                wrapper.close()
+                print(Fore.LIGHTCYAN_EX + result + Style.RESET_ALL)
+            else:
+                wrapper.close()
 
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
@@ -0,0 +1,281 @@
+"""
+Serves GraniteBot over HTTP, so one process can hold a conversation with many users at once.
+
+Each user gets a session with its own conversation history and ticket under discussion; the caches, connection
+pools, GP index and MS Graph token are shared by all of them. Each connection gets a thread of its own, so idle
+keep-alive connections never hold up other clients; prompts run on a pool of SERVER_WORKERS threads.
+
+    POST   /sessions                  -> {"session_id": "..."}
+    POST   /sessions/<id>/prompts     {"prompt": "...", "stream": false} -> {"response": "..."}
+    DELETE /sessions/<id>
+    GET    /health
+    GET    /stats
+    GET    /metrics                   Prometheus text format: per-stage latency histograms, token counts
+
+With "stream": true the response is sent as plain text with chunked transfer encoding, piece by piece as it is
+generated. With "trace": true (and no streaming) the response also carries the prompt's per-stage timing
+breakdown. If SERVER_TOKEN is set, every request except /health must send "Authorization: Bearer <token>".
+
+    python server.py
+"""
+import os
+import json
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bot
+from Database import close_all_pools
+from HttpClient import close_all_sessions
+from Tracing import prometheus_text
+
+SERVER_HOST = os.getenv('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.getenv('SERVER_PORT', 8080))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 16))
+SERVER_TOKEN = os.getenv('SERVER_TOKEN')
+SESSION_IDLE_TIMEOUT = int(os.getenv('SESSION_IDLE_TIMEOUT', 3600))
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', 500))
+MAX_PROMPT_BYTES = 64 * 1024
+
+prompt_path_pattern = re.compile(r'^/sessions/([A-Za-z0-9_-]+)/prompts$')
+session_path_pattern = re.compile(r'^/sessions/([A-Za-z0-9_-]+)$')
+
+
+class SessionStore:
+    """
+    Thread-safe map of session ID to BotSession. Sessions unused for `idle_timeout` seconds are dropped, and when
+    `max_sessions` are open the least recently active one makes way for a new one.
+    """
+
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=MAX_SESSIONS):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def evict_idle(self):
+        """Removes sessions that have sat idle too long. Must be called with the lock held."""
+        cutoff = time.time() - self.idle_timeout
+        for session_id in [sid for sid, session in self.sessions.items() if session.last_active < cutoff]:
+            del self.sessions[session_id]
+
+    def create(self):
+        session = bot.BotSession(secrets.token_urlsafe(16))
+        with self.lock:
+            self.evict_idle()
+            if len(self.sessions) >= self.max_sessions:
+                oldest = min(self.sessions.values(), key=lambda s: s.last_active)
+                del self.sessions[oldest.session_id]
+            self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.time()
+            return session
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+
+class BotHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer whose prompts run on a fixed pool of worker threads, which bounds the LLM calls, queries
+    and connection pool checkouts in flight however many clients are connected.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, handler, workers=SERVER_WORKERS):
+        super().__init__(address, handler)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="granitebot-worker")
+        self.sessions = SessionStore()
+
+    def process_prompt(self, prompt, **kwargs):
+        """Runs bot.process_user_prompt on a worker thread and waits for it, re-raising anything it raised."""
+        return self.executor.submit(bot.process_user_prompt, prompt, **kwargs).result()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class BotRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "GraniteBot"
+    timeout = 30  # Idle keep-alive connections are closed after this many seconds
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        payload = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {"error": message})
+
+    def authorized(self):
+        if not SERVER_TOKEN:
+            return True
+        expected = f"Bearer {SERVER_TOKEN}"
+        if secrets.compare_digest(self.headers.get("Authorization", ""), expected):
+            return True
+        self.send_error_json(401, "Missing or invalid bearer token.")
+        return False
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_PROMPT_BYTES:
+            raise ValueError("Request body is too large.")
+        body = self.rfile.read(length) if length else b"{}"
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError("Request body must be a JSON object.")
+        return data
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif not self.authorized():
+            return
+        elif self.path == "/stats":
+            self.send_json(200, {
+                "sessions": len(self.server.sessions),
+                "intents": bot.intent_stats(),
+                "queries": bot.query_stats(),
+                "response_cache": bot.response_cache.stats(),
+                "query_result_cache": bot.query_result_cache.stats(),
+            })
+        elif self.path == "/metrics":
+            self.send_text(200, prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self.send_error_json(404, "Not found.")
+
+    def do_POST(self):
+        # Read the body before anything else, so an error response doesn't leave it to be parsed as the next request
+        try:
+            data = self.read_json()
+        except ValueError as e:  # Includes malformed JSON
+            self.close_connection = True  # An oversized body is left unread
+            self.send_error_json(400, str(e))
+            return
+        if not self.authorized():
+            return
+        if self.path == "/sessions":
+            self.send_json(201, {"session_id": self.server.sessions.create().session_id})
+            return
+
+        match = prompt_path_pattern.match(self.path)
+        if not match:
+            self.send_error_json(404, "Not found.")
+            return
+        session = self.server.sessions.get(match.group(1))
+        if session is None:
+            self.send_error_json(404, "Unknown or expired session.")
+            return
+        prompt = str(data.get("prompt", "")).strip()
+        if not prompt:
+            self.send_error_json(400, "A prompt is required.")
+            return
+
+        if data.get("stream"):
+            self.stream_prompt(session, prompt)
+        else:
+            try:
+                response, trace = self.server.process_prompt(prompt, session=session, return_trace=True)
+            except Exception as e:
+                print(f"Error handling prompt: {e}")
+                self.send_error_json(500, "The prompt could not be handled. Please try again later.")
+                return
+            body = {"response": response}
+            if data.get("trace"):
+                body["trace"] = trace.report()
+            self.send_json(200, body)
+
+    def stream_prompt(self, session, prompt):
+        """Sends the response as chunks as it is generated, or in one chunk if it wasn't generated by the LLM."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        state = {"started": False, "connected": True, "streamed": []}
+
+        def write(text):
+            state["started"] = True
+            state["streamed"].append(text)
+            if not text or not state["connected"]:
+                return
+            data = text.encode()
+            try:
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            except OSError:
+                # The client went away; finish the prompt anyway so the session's history stays consistent
+                state["connected"] = False
+
+        try:
+            result = self.server.process_prompt(prompt, stream=write, session=session)
+        except Exception as e:
+            # The 200 status has already been sent, so the error goes in the body
+            print(f"Error handling prompt: {e}")
+            result = "The prompt could not be handled. Please try again later."
+        if not state["started"]:
+            write(result)
+        elif result.split() != "".join(state["streamed"]).split():
+            # The stream failed part way and an error was returned in its place
+            write("\n" + result)
+        if state["connected"]:
+            try:
+                self.wfile.write(b"0\r\n\r\n")
+            except OSError:
+                pass
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        match = session_path_pattern.match(self.path)
+        if match and self.server.sessions.delete(match.group(1)):
+            self.send_json(200, {"deleted": True})
+        else:
+            self.send_error_json(404, "Unknown or expired session.")
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def main():
+    server = BotHTTPServer((SERVER_HOST, SERVER_PORT), BotRequestHandler)
+    print(f"GraniteBot serving on http://{SERVER_HOST}:{server.server_port} with {SERVER_WORKERS} prompt workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        bot.print_stats()
+        close_all_pools()
+        close_all_sessions()
+
+
+if __name__ == '__main__':
+    main()